@@ -1,28 +1,60 @@
+import time
+
+# Отсчёт времени запуска: от начала импорта модуля до готовности приложения (см. /startup-time)
+_IMPORT_STARTED = time.perf_counter()
+
 import os
 import io
+import asyncio
+import threading
+import uuid
 import zipfile
 import json
+import re
+import tempfile
 import sqlite3
 import hashlib
 import hmac
 import base64
-import numpy as np
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request, Depends, Response
+from importlib import metadata as importlib_metadata
+from contextlib import asynccontextmanager, contextmanager
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request, Depends, Response, WebSocket, WebSocketDisconnect
 from fastapi.responses import JSONResponse, FileResponse, StreamingResponse, HTMLResponse, RedirectResponse
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
-from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import HTTPConnection
 from fastapi.templating import Jinja2Templates
 from fastapi import status
-from typing import List, Optional, Dict, Any, Tuple
-from pydantic import BaseModel
-from datetime import datetime
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional, Tuple
+from pydantic import BaseModel, Field, ValidationError
+from datetime import datetime, timedelta
 import logging
-from data_processing import calculate_moving_average
 from dotenv import load_dotenv
 from pathlib import Path
 
 from services.openrouter import get_openrouter_client
+from services.llm_limiter import LLMQueueTimeout, get_llm_limiter
+from services.compression import CompressionMiddleware
+from services.superseding import RequestCoalescer, SupersedingRunner
+from services.shared_cache import create_cache_backend
+from services.rate_limit import RateLimitExceeded, WorkRateLimiter, create_rate_limit_backend
+from services.upload_store import ParsedUploadStore, is_sha256, sha256_hex
+from services.job_queue import FINISHED_STATUSES, JobCancelled, JobContext, JobManager, JobResult
+from services.http_cache import (
+    FingerprintedStaticFiles,
+    StaticFingerprints,
+    compute_etag,
+    etag_matches,
+    not_modified,
+)
+from processing_pipeline import ProcessDataRequest, ProcessingCancelled, process_spectra
+
+# Модули с numpy/scipy (data_processing, spectral_library, chemometrics, spectral_export)
+# и openai импортируются внутри функций при первом использовании: так запуск
+# приложения (и каждого нового экземпляра при автомасштабировании) не ждёт их загрузки
+if TYPE_CHECKING:
+    from spectral_library import SpectralLibrary
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 load_dotenv(Path(BASE_DIR) / ".env")
@@ -39,44 +71,70 @@ except Exception:
     psycopg2 = None  # type: ignore
 
 try:
-    client = get_openrouter_client()
-    logger.info("OpenRouter client initialized")
-except RuntimeError as exc:
-    logger.error("Failed to initialize OpenRouter client: %s", exc)
-    client = None
+    import fcntl  # блокировка файла библиотеки между воркерами (только POSIX)
+except ImportError:
+    fcntl = None  # type: ignore
 
-# Импорты из data_processing (обработка возможных ошибок)
-try:
-    from data_processing import (
-        baseline_als,
-        smooth_signal,
-        normalize_snv,
-        find_signal_peaks,
-        filter_frequency_range,
-        parse_esp_file,
-        calculate_mean_std, 
-        calculate_boxplot_stats,
-        parse_txt_file,
-        parse_csv_file,
-        parse_any_spectral_file
+# Клиент OpenRouter создаётся при первом запросе к модели
+_ai_client: Any = None
+_ai_client_lock = threading.Lock()
+
+
+def get_ai_client() -> Any:
+    """Возвращает клиент OpenRouter или None, если сервис не настроен."""
+    global _ai_client
+    with _ai_client_lock:
+        if _ai_client is None:
+            try:
+                _ai_client = get_openrouter_client()
+                logger.info("OpenRouter client initialized")
+            except RuntimeError as exc:
+                logger.error("Failed to initialize OpenRouter client: %s", exc)
+                return None
+    return _ai_client
+
+# Общая очередь обращений к модели: ограничивает число одновременных запросов к OpenRouter
+llm_limiter = get_llm_limiter()
+
+# Время запуска: import_seconds — импорт app.py, init_seconds — lifespan, total_seconds — до готовности
+STARTUP_TIMINGS: Dict[str, float] = {}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Инициализация при запуске (папки, БД, фоновые задачи) и остановка фоновых задач."""
+    init_started = time.perf_counter()
+    # Создаем папки если они не существуют
+    os.makedirs(TEMPLATES_DIR, exist_ok=True)
+    os.makedirs(STATIC_DIR, exist_ok=True)
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+    try:
+        init_user_db()
+        logger.info("User database ready at %s", USER_DB_PATH)
+    except Exception as auth_init_error:
+        logger.error("Failed to initialize user database: %s", auth_init_error)
+        raise
+    # Воркеров uvicorn может быть несколько: каждый отмечает свои задачи, а неудачными
+    # помечаются только задачи воркеров, переставших обновлять отметку (упали или перезапущены)
+    job_manager.start()
+
+    STARTUP_TIMINGS["init_seconds"] = round(time.perf_counter() - init_started, 4)
+    STARTUP_TIMINGS["total_seconds"] = round(time.perf_counter() - _IMPORT_STARTED, 4)
+    logger.info(
+        "Startup finished: import %.3f s, init %.3f s, total %.3f s",
+        STARTUP_TIMINGS["import_seconds"],
+        STARTUP_TIMINGS["init_seconds"],
+        STARTUP_TIMINGS["total_seconds"],
     )
-except ImportError as e:
-    logger.error(f"Ошибка импорта data_processing: {e}")
-    # Заглушки функций на случай ошибки импорта
-    def baseline_als(*args, **kwargs): return np.zeros_like(args[0])
-    def smooth_signal(*args, **kwargs): return args[0]
-    def normalize_snv(*args, **kwargs): return args[0]
-    def find_signal_peaks(*args, **kwargs): return [], {}
-    def filter_frequency_range(*args, **kwargs): return args[0], args[1]
-    def parse_esp_file(*args, **kwargs): return [], []
-    def calculate_mean_std(*args, **kwargs): return [], []
-    def calculate_boxplot_stats(*args, **kwargs): return []
-    def parse_txt_file(*args, **kwargs): return [], []
-    def parse_csv_file(*args, **kwargs): return [], []
-    def parse_any_spectral_file(*args, **kwargs): return [], []
+    try:
+        yield
+    finally:
+        job_manager.shutdown()
+
 
 # Инициализация FastAPI приложения
-app = FastAPI(title="Spectral Processing API", version="1.0.0")
+app = FastAPI(title="Spectral Processing API", version="1.0.0", lifespan=lifespan)
 
 # Настройка CORS
 app.add_middleware(
@@ -87,9 +145,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Сжатие ответов (крупные JSON /upload_files и /process_data, HTML, статика)
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.getenv("COMPRESSION_MIN_SIZE", "1024")),
+)
+
 USER_DB_PATH = os.getenv("USER_DB_PATH", os.path.join(BASE_DIR, "users.db"))
 SESSION_MAX_AGE = int(os.getenv("SESSION_MAX_AGE", str(60 * 60 * 24 * 7)))
-MAX_PRESET_SLOTS = 5
+PRESET_PAGE_SIZE = int(os.getenv("PRESET_PAGE_SIZE", "100"))
+PRESET_MAX_PAGE_SIZE = 500
+# Слот хранится в INTEGER; в Postgres это 32-битное целое
+PRESET_MAX_SLOT = 2 ** 31 - 1
+AI_CACHE_TTL_SECONDS = int(os.getenv("AI_CACHE_TTL_SECONDS", str(60 * 60 * 24 * 7)))
+AI_BATCH_MAX_SPECTRA = int(os.getenv("AI_BATCH_MAX_SPECTRA", "10"))
 
 app.add_middleware(
     SessionMiddleware,
@@ -110,10 +179,38 @@ UPLOAD_DIR = os.path.join(BASE_DIR, "uploads")
 logger.info(f"Templates directory exists: {os.path.exists(TEMPLATES_DIR)}")
 logger.info(f"Static directory exists: {os.path.exists(STATIC_DIR)}")
 
-# Создаем папки если они не существуют
-os.makedirs(TEMPLATES_DIR, exist_ok=True)
-os.makedirs(STATIC_DIR, exist_ok=True)
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+# Общий для воркеров uvicorn кэш узла: распарсенные файлы и результаты /process_data.
+# SHARED_CACHE_BACKEND: sqlite (по умолчанию), memory (только текущий процесс) или none;
+# другие реализации подключаются через services.shared_cache.register_cache_backend.
+SHARED_CACHE_MAX_BYTES = int(os.getenv("SHARED_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+shared_cache = create_cache_backend(
+    os.getenv("SHARED_CACHE_BACKEND", "sqlite"),
+    path=os.getenv("SHARED_CACHE_PATH", os.path.join(BASE_DIR, "cache", "shared_cache.sqlite3")),
+    max_bytes=SHARED_CACHE_MAX_BYTES,
+)
+# Результат обработки крупнее этой доли кэша не сохраняется, чтобы не вытеснять всё остальное
+PROCESSED_CACHE_MAX_ENTRY_BYTES = SHARED_CACHE_MAX_BYTES // 8
+
+# Ограничение нагрузки на пользователя: корзины токенов в памяти процесса (RATE_LIMIT_BACKEND: memory или none;
+# общие для воркеров реализации подключаются через services.rate_limit.register_rate_limit_backend).
+# Обработка и экспорт расходуют бюджет точек (спектры × точки), AI-анализ — бюджет обращений к модели.
+rate_limit_backend = create_rate_limit_backend(os.getenv("RATE_LIMIT_BACKEND", "memory"))
+work_rate_limiter = WorkRateLimiter(
+    rate_limit_backend,
+    "work",
+    rate=float(os.getenv("RATE_LIMIT_POINTS_PER_SECOND", "500000")),
+    capacity=float(os.getenv("RATE_LIMIT_POINTS_BURST", "10000000")),
+)
+ai_rate_limiter = WorkRateLimiter(
+    rate_limit_backend,
+    "ai",
+    rate=float(os.getenv("RATE_LIMIT_AI_PER_MINUTE", "10")) / 60,
+    capacity=float(os.getenv("RATE_LIMIT_AI_BURST", "5")),
+)
+
+# Распарсенные файлы по SHA-256 содержимого: повторная загрузка того же файла не требует передачи и парсинга
+upload_store = ParsedUploadStore(shared_cache)
+MAX_UPLOAD_LOOKUP_HASHES = 1000
 
 
 
@@ -156,6 +253,63 @@ def _using_postgres() -> bool:
     return bool(DATABASE_URL) and psycopg2 is not None  # type: ignore
 
 
+JOB_INSTANCE_COLUMNS = (
+    ("instance_id", "TEXT"),
+    ("heartbeat_at", "TEXT"),
+    ("cancel_requested", "INTEGER NOT NULL DEFAULT 0"),
+)
+
+# Перенос может одновременно начать несколько воркеров: уже перенесённые слоты пропускаются
+PRESETS_MIGRATION_SQL = {
+    "postgres": """
+        INSERT INTO user_presets (user_id, slot, name, payload, updated_at)
+        SELECT user_id, slot, name, payload, updated_at FROM saved_presets
+        ON CONFLICT (user_id, slot) DO NOTHING
+    """,
+    "sqlite": """
+        INSERT OR IGNORE INTO user_presets (user_id, slot, name, payload, updated_at)
+        SELECT user_id, slot, name, payload, updated_at FROM saved_presets
+    """,
+}
+PRESETS_MISSING_SQL = """
+    SELECT COUNT(*) AS missing FROM saved_presets old_preset
+    WHERE NOT EXISTS (
+        SELECT 1 FROM user_presets new_preset
+        WHERE new_preset.user_id = old_preset.user_id AND new_preset.slot = old_preset.slot
+    )
+"""
+# Прежняя таблица после переноса переименовывается, а не удаляется: при откате релиза
+# пресеты остаются; удалить её можно в одном из следующих релизов
+PRESETS_LEGACY_TABLE = "saved_presets_legacy"
+
+
+def _table_exists(db: DBConnection, name: str) -> bool:
+    if db.driver == 'postgres':
+        return db.execute("SELECT to_regclass(?) AS name", (name,)).fetchone()["name"] is not None
+    row = db.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone()
+    return row is not None
+
+
+def _migrate_legacy_presets(db: DBConnection) -> None:
+    """
+    Переносит пресеты из прежней таблицы saved_presets в user_presets.
+    saved_presets переименовывается в PRESETS_LEGACY_TABLE, только если каждый её слот
+    есть в user_presets; иначе остаётся на месте, и перенос повторится при следующем запуске.
+    Вызывается под блокировкой, в одной транзакции с проверками.
+    """
+    if not _table_exists(db, "saved_presets"):
+        return
+    db.execute(PRESETS_MIGRATION_SQL[db.driver])
+    missing = db.execute(PRESETS_MISSING_SQL).fetchone()["missing"]
+    if missing:
+        logger.warning("Не перенесено пресетов из saved_presets: %d; таблица оставлена без изменений", missing)
+        return
+    if _table_exists(db, PRESETS_LEGACY_TABLE):
+        logger.warning("Таблица %s уже существует; saved_presets оставлена без изменений", PRESETS_LEGACY_TABLE)
+        return
+    db.execute(f"ALTER TABLE saved_presets RENAME TO {PRESETS_LEGACY_TABLE}")
+
+
 def init_user_db() -> None:
     if _using_postgres():
         conn = psycopg2.connect(DATABASE_URL)  # type: ignore
@@ -172,12 +326,13 @@ def init_user_db() -> None:
                 )
                 """
             )
+            # Ограничения на число слотов нет; UNIQUE(user_id, slot) служит индексом для постраничной выборки
             db.execute(
                 """
-                CREATE TABLE IF NOT EXISTS saved_presets (
+                CREATE TABLE IF NOT EXISTS user_presets (
                     id SERIAL PRIMARY KEY,
                     user_id INTEGER NOT NULL,
-                    slot INTEGER NOT NULL CHECK (slot BETWEEN 1 AND 5),
+                    slot INTEGER NOT NULL CHECK (slot >= 1),
                     name TEXT NOT NULL,
                     payload TEXT NOT NULL,
                     updated_at TEXT NOT NULL,
@@ -186,6 +341,50 @@ def init_user_db() -> None:
                 )
                 """
             )
+            # Перенос из прежней таблицы saved_presets (не больше пяти слотов на пользователя).
+            # Блокировка до конца транзакции: таблицу проверяет и переименовывает только один воркер
+            db.execute("SELECT pg_advisory_xact_lock(hashtext('saved_presets_migration'))")
+            _migrate_legacy_presets(db)
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS ai_analysis_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    analysis TEXT NOT NULL,
+                    peaks_identified INTEGER NOT NULL,
+                    spectrum_type TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    expires_at TEXT NOT NULL
+                )
+                """
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS idx_ai_analysis_cache_expires ON ai_analysis_cache(expires_at)")
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS processing_jobs (
+                    job_id TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    progress REAL NOT NULL DEFAULT 0,
+                    message TEXT,
+                    error TEXT,
+                    result_path TEXT,
+                    result_media_type TEXT,
+                    result_filename TEXT,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    finished_at TEXT,
+                    instance_id TEXT,
+                    heartbeat_at TEXT,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0
+                )
+                """
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS idx_processing_jobs_owner ON processing_jobs(owner, created_at)")
+            # Таблица из версии, где задачи выполнял один процесс: добавляем поля воркера-владельца
+            for column, definition in JOB_INSTANCE_COLUMNS:
+                db.execute(f"ALTER TABLE processing_jobs ADD COLUMN IF NOT EXISTS {column} {definition}")
             db.commit()
         finally:
             db.close()
@@ -206,10 +405,10 @@ def init_user_db() -> None:
             )
             conn.execute(
                 """
-                CREATE TABLE IF NOT EXISTS saved_presets (
+                CREATE TABLE IF NOT EXISTS user_presets (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     user_id INTEGER NOT NULL,
-                    slot INTEGER NOT NULL CHECK(slot BETWEEN 1 AND 5),
+                    slot INTEGER NOT NULL CHECK(slot >= 1),
                     name TEXT NOT NULL,
                     payload TEXT NOT NULL,
                     updated_at TEXT NOT NULL,
@@ -218,6 +417,53 @@ def init_user_db() -> None:
                 )
                 """
             )
+            # BEGIN IMMEDIATE берёт блокировку записи до проверки: другой воркер ждёт
+            # и после переноса уже не находит saved_presets
+            conn.row_factory = sqlite3.Row
+            conn.execute("BEGIN IMMEDIATE")
+            _migrate_legacy_presets(DBConnection('sqlite', conn))
+            conn.commit()
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS ai_analysis_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    analysis TEXT NOT NULL,
+                    peaks_identified INTEGER NOT NULL,
+                    spectrum_type TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    expires_at TEXT NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_ai_analysis_cache_expires ON ai_analysis_cache(expires_at)")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS processing_jobs (
+                    job_id TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    progress REAL NOT NULL DEFAULT 0,
+                    message TEXT,
+                    error TEXT,
+                    result_path TEXT,
+                    result_media_type TEXT,
+                    result_filename TEXT,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    finished_at TEXT,
+                    instance_id TEXT,
+                    heartbeat_at TEXT,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_processing_jobs_owner ON processing_jobs(owner, created_at)")
+            job_columns = {row[1] for row in conn.execute("PRAGMA table_info(processing_jobs)")}
+            for column, definition in JOB_INSTANCE_COLUMNS:
+                if column not in job_columns:
+                    conn.execute(f"ALTER TABLE processing_jobs ADD COLUMN {column} {definition}")
             conn.commit()
         finally:
             conn.close()
@@ -278,53 +524,221 @@ def require_user(request: Request) -> str:
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
     return user
-def _get_user_row_or_401(username: str):
-    user_row = get_user_by_username(username)
-    if user_row is None:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
-    return user_row
+def _rate_limit_key(connection: HTTPConnection) -> str:
+    """
+    Чей бюджет расходует запрос (HTTP или WebSocket): пользователя, если он вошёл, иначе адреса клиента.
+    Анонимная сессия своего бюджета не получает: новая cookie выдаётся бесплатно
+    и дала бы неограниченный бюджет простым сбросом cookie.
+    """
+    user = connection.session.get("user")
+    if user:
+        return f"user:{user}"
+    return f"ip:{connection.client.host if connection.client else 'unknown'}"
+
+
+def _too_many_requests(exc: RateLimitExceeded) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=f"Слишком много работы за короткое время, повторите через {exc.retry_after_header} с",
+        headers={"Retry-After": exc.retry_after_header},
+    )
+
+
+def _enforce_rate_limit(limiter: WorkRateLimiter, key: str, cost: float) -> None:
+    try:
+        limiter.acquire(key, cost)
+    except RateLimitExceeded as exc:
+        raise _too_many_requests(exc)
+
+
+def _spectra_points(amplitudes: List[List[float]]) -> int:
+    return sum(len(values) for values in amplitudes)
 
 
 def _validate_preset_slot(slot: int) -> None:
-    if not 1 <= slot <= MAX_PRESET_SLOTS:
+    if not 1 <= slot <= PRESET_MAX_SLOT:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Slot must be between 1 and {MAX_PRESET_SLOTS}",
+            detail=f"Slot must be between 1 and {PRESET_MAX_SLOT}",
         )
 
 
-try:
-    init_user_db()
-    logger.info("User database ready at %s", USER_DB_PATH)
-except Exception as auth_init_error:
-    logger.error("Failed to initialize user database: %s", auth_init_error)
-    raise
-
-# Монтирование статических файлов и шаблонов
-app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
+def _validate_preset_after(after: int) -> None:
+    if not 0 <= after <= PRESET_MAX_SLOT:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"after must be between 0 and {PRESET_MAX_SLOT}",
+        )
+
+
+def _user_id_or_401(conn: DBConnection, username: str) -> int:
+    """id пользователя через уже открытое соединение (без отдельного подключения к БД)."""
+    row = conn.execute("SELECT id FROM users WHERE username = ?", (username,)).fetchone()
+    if row is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+    return row["id"]
+
+
+def _preset_page_limit(limit: Optional[int]) -> int:
+    if limit is None:
+        return PRESET_PAGE_SIZE
+    if not 1 <= limit <= PRESET_MAX_PAGE_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"limit must be between 1 and {PRESET_MAX_PAGE_SIZE}",
+        )
+    return limit
+
+
+def _fetch_presets_page(username: str, after: int, limit: int, with_payload: bool) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """
+    Страница пресетов пользователя по возрастанию слота, начиная после слота after
+    (выборка по индексу UNIQUE(user_id, slot)).
+    :return: (пресеты, слот для следующей страницы или None, если это последняя)
+    """
+    columns = "slot, name, payload, updated_at" if with_payload else "slot, name, updated_at"
+    conn = get_db_connection()
+    try:
+        user_id = _user_id_or_401(conn, username)
+        rows = conn.execute(
+            f"SELECT {columns} FROM user_presets WHERE user_id = ? AND slot > ? ORDER BY slot LIMIT ?",
+            (user_id, after, limit + 1),
+        ).fetchall()
+    finally:
+        conn.close()
+
+    items = []
+    for row in rows[:limit]:
+        item = {"slot": row["slot"], "name": row["name"], "updated_at": row["updated_at"]}
+        if with_payload:
+            item["payload"] = _decode_preset_payload(row["payload"])
+        items.append(item)
+    next_after = items[-1]["slot"] if len(rows) > limit else None
+    return items, next_after
+
+
+def _decode_preset_payload(raw: str) -> Dict[str, Any]:
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError:
+        return {}
+
+
+# Фоновые задачи: ограниченный пул потоков, состояние в processing_jobs, результаты на диске
+JOB_RESULTS_DIR = os.getenv("JOB_RESULTS_DIR", os.path.join(BASE_DIR, "job_results"))
+job_manager = JobManager(
+    get_db_connection,
+    JOB_RESULTS_DIR,
+    max_workers=int(os.getenv("JOB_MAX_WORKERS", "2")),
+    result_ttl_seconds=int(os.getenv("JOB_RESULT_TTL_SECONDS", str(60 * 60 * 24))),
+)
+
+SPECTRAL_LIBRARY_PATH = os.getenv("SPECTRAL_LIBRARY_PATH", os.path.join(BASE_DIR, "library", "spectral_library.npz"))
+
+
+def load_spectral_library() -> "SpectralLibrary":
+    from spectral_library import SpectralLibrary
+
+    if os.path.exists(SPECTRAL_LIBRARY_PATH):
+        return SpectralLibrary.load(SPECTRAL_LIBRARY_PATH)
+    return SpectralLibrary.from_range(
+        float(os.getenv("SPECTRAL_LIBRARY_GRID_MIN", "200")),
+        float(os.getenv("SPECTRAL_LIBRARY_GRID_MAX", "3500")),
+        float(os.getenv("SPECTRAL_LIBRARY_GRID_STEP", "2")),
+        peak_tolerance=float(os.getenv("SPECTRAL_LIBRARY_PEAK_TOLERANCE", "8")),
+    )
+
+
+# Библиотека загружается при первом обращении к /library*. У каждого воркера своя копия в памяти:
+# она перечитывается, когда файл изменил другой воркер, а добавление эталона выполняется
+# под блокировкой файла (перечитать — добавить — сохранить), чтобы не затереть чужие эталоны.
+# Без fcntl (Windows) межпроцессной блокировки нет — запускайте один воркер.
+spectral_library: Optional["SpectralLibrary"] = None
+_spectral_library_signature: Optional[Tuple[int, int]] = None
+_spectral_library_lock = threading.Lock()
+
+
+def _library_file_signature() -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(SPECTRAL_LIBRARY_PATH)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+@contextmanager
+def _spectral_library_file_lock() -> Iterator[None]:
+    if fcntl is None:
+        yield
+        return
+    directory = os.path.dirname(SPECTRAL_LIBRARY_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(f"{SPECTRAL_LIBRARY_PATH}.lock", "a") as handle:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+
+
+def _refresh_spectral_library() -> "SpectralLibrary":
+    """Загружает библиотеку, если её ещё нет в памяти или файл изменился (вызывать под _spectral_library_lock)."""
+    global spectral_library, _spectral_library_signature
+    signature = _library_file_signature()
+    if spectral_library is None or signature != _spectral_library_signature:
+        spectral_library = load_spectral_library()
+        _spectral_library_signature = signature
+        logger.info("Spectral library loaded: %d references", len(spectral_library))
+    return spectral_library
+
+
+def _add_library_reference(
+    name: str, frequencies: List[float], amplitudes: List[float], metadata: Dict[str, Any]
+) -> Tuple[int, int]:
+    """Добавляет эталон к актуальной версии файла и сохраняет её; возвращает (id, размер библиотеки)."""
+    global _spectral_library_signature
+    with _spectral_library_lock, _spectral_library_file_lock():
+        library = _refresh_spectral_library()
+        ref_id = library.add_reference(name, frequencies, amplitudes, metadata)
+        try:
+            library.save(SPECTRAL_LIBRARY_PATH)
+        except Exception:
+            # Эталон не сохранён: при следующем обращении перечитываем файл
+            _spectral_library_signature = None
+            raise
+        _spectral_library_signature = _library_file_signature()
+        return ref_id, len(library)
+
+# Монтирование статических файлов и шаблонов.
+# В шаблонах ссылки строятся через static_url(): /static/app.js?v=<hash> кэшируется навсегда.
+static_fingerprints = StaticFingerprints(STATIC_DIR)
+app.mount(
+    "/static",
+    FingerprintedStaticFiles(directory=STATIC_DIR, fingerprints=static_fingerprints, check_dir=False),
+    name="static",
+)
 templates = Jinja2Templates(directory=TEMPLATES_DIR)
+templates.env.globals["static_url"] = static_fingerprints.url
+
+# ETag ответов /process_data зависит от тела запроса, версии кода обработки
+# и версий numpy/scipy (версии читаются из метаданных пакетов, без импорта)
+_processing_sources = ("data_processing.py", "processing_pipeline.py", os.path.basename(__file__))
+_processing_digest = hashlib.sha256()
+for _source_name in _processing_sources:
+    with open(os.path.join(BASE_DIR, _source_name), "rb") as _source_file:
+        _processing_digest.update(_source_file.read())
+for _package_name in ("numpy", "scipy"):
+    try:
+        _processing_digest.update(f"{_package_name}=={importlib_metadata.version(_package_name)}".encode())
+    except importlib_metadata.PackageNotFoundError:
+        pass
+PROCESSING_ETAG_SEED = _processing_digest.hexdigest().encode()
+PROCESSING_CACHE_CONTROL = "private, no-cache"
+PROCESSING_STREAM_PATTERN = re.compile(r"^[A-Za-z0-9_.:-]{1,64}$")
+processing_coalescer = RequestCoalescer()
 
 # Модели Pydantic для валидации данных
-class ProcessDataRequest(BaseModel):
-    frequencies: List[List[float]]
-    amplitudes: List[List[float]]
-    min_freq: Optional[float] = 0
-    max_freq: Optional[float] = 10000
-    remove_baseline: Optional[bool] = False
-    apply_smoothing: Optional[bool] = False
-    normalize: Optional[bool] = False
-    find_peaks: Optional[bool] = False
-    calculate_boxplot: Optional[bool] = False
-    calculate_mean_std: Optional[bool] = False
-    width: Optional[int] = 1
-    prominence: Optional[int] = 1
-    lam: Optional[int] = 1000
-    p: Optional[float] = 0.001
-    window_length: Optional[int] = 25
-    polyorder: Optional[int] = 1
-    show_moving_average: Optional[bool] = False
-    moving_average_window: Optional[int] = 10
-
 class ExportDataRequest(BaseModel):
     frequencies: List[List[float]]
     amplitudes: List[List[float]]
@@ -368,6 +782,64 @@ class AIAnalysisRequest(BaseModel):
     
     
 
+class AIBatchSpectrum(BaseModel):
+    frequencies: List[float]
+    amplitudes: List[float]
+    name: Optional[str] = None
+
+
+class AIBatchAnalysisRequest(BaseModel):
+    spectra: List[AIBatchSpectrum]
+    processing_params: Dict[str, Any]
+    sample_info: Optional[Dict[str, Any]] = None
+
+class LibraryReferenceRequest(BaseModel):
+    name: str
+    frequencies: List[float]
+    amplitudes: List[float]
+    metadata: Optional[Dict[str, Any]] = None
+
+
+class LibrarySearchRequest(BaseModel):
+    frequencies: List[float]
+    amplitudes: List[float]
+    top_k: int = Field(5, ge=1)
+    metric: Optional[str] = "pearson"
+    prefilter: Optional[bool] = False
+    min_shared_peaks: int = Field(1, ge=1)
+
+class ChemometricsRequest(BaseModel):
+    frequencies: List[List[float]]
+    amplitudes: List[List[float]]
+    fileNames: Optional[List[str]] = None
+    labels: Optional[List[str]] = None
+
+
+class PCARequest(ChemometricsRequest):
+    n_components: int = Field(3, ge=1)
+    scale: Optional[bool] = False
+    center: Optional[bool] = True
+    method: Optional[str] = "auto"
+
+
+class PLSDARequest(ChemometricsRequest):
+    labels: List[str]
+    n_components: int = Field(2, ge=1)
+    scale: Optional[bool] = False
+    cv_folds: int = Field(5, ge=2)
+
+
+class CorrelationRequest(ChemometricsRequest):
+    metric: Optional[str] = "pearson"
+    method: Optional[str] = "average"
+    n_clusters: Optional[int] = None
+    distance_threshold: Optional[float] = None
+    outlier_threshold: float = Field(3.5, gt=0)
+    include_matrix: Optional[bool] = False
+
+class UploadLookupRequest(BaseModel):
+    hashes: List[str]
+
 class PresetSaveRequest(BaseModel):
     name: str
     payload: Dict[str, Any]
@@ -459,7 +931,14 @@ async def index(request: Request):
 
 
     try:
-        return templates.TemplateResponse("index.html", context)
+        response = templates.TemplateResponse("index.html", context)
+        # Страница зависит от сессии, поэтому кэш частный, но повторный визит получает 304
+        etag = compute_etag(response.body)
+        if etag_matches(request, etag):
+            return not_modified(etag, "private, no-cache")
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response
     except Exception as e:
         logger.error(f"Error loading template: {e}")
         return HTMLResponse(content=f"""
@@ -479,6 +958,13 @@ async def test_endpoint():
     """
     return {"message": "Server is working!", "status": "OK"}
 
+@app.get("/startup-time")
+async def startup_time():
+    """
+    Время запуска экземпляра: импорт модуля, инициализация в lifespan и итог (секунды).
+    """
+    return STARTUP_TIMINGS
+
 @app.get("/check-files")
 async def check_files():
     """
@@ -491,17 +977,64 @@ async def check_files():
     }
     return files
 
+def _parse_uploaded_content(raw_content: bytes, filename: str) -> Tuple[List[float], List[float]]:
+    from data_processing import decode_spectral_bytes, parse_any_spectral_file
+
+    try:
+        decoded_content = decode_spectral_bytes(raw_content)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f'Не удалось декодировать файл {filename}. Поддерживаются только текстовые файлы.')
+
+    try:
+        return parse_any_spectral_file(decoded_content)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f'Ошибка при обработке файла {filename}: {str(e)}')
+
+
+def _load_upload(raw_content: bytes, filename: str) -> Tuple[str, List[float], List[float]]:
+    """
+    Данные файла из хранилища по SHA-256 содержимого либо результат разбора, который
+    туда же сохраняется. Хранилище и разбор синхронные — вызывается в пуле потоков.
+    :return: (хэш, частоты, амплитуды)
+    """
+    digest = sha256_hex(raw_content)
+    stored = upload_store.get(digest)
+    if stored is not None:
+        return digest, stored[0], stored[1]
+    frequencies, amplitudes = _parse_uploaded_content(raw_content, filename)
+    upload_store.put(digest, frequencies, amplitudes)
+    return digest, frequencies, amplitudes
+
+
+def _lookup_uploads(digests: List[str]) -> Tuple[Dict[str, Dict[str, List[float]]], List[str]]:
+    known: Dict[str, Dict[str, List[float]]] = {}
+    missing: List[str] = []
+    for digest in digests:
+        stored = upload_store.get(digest)
+        if stored is None:
+            missing.append(digest)
+        else:
+            known[digest] = {'frequencies': stored[0], 'amplitudes': stored[1]}
+    return known, missing
+
+
 @app.post("/upload_files")
-async def upload_files(files: List[UploadFile] = File(...)):
+async def upload_files(request: Request, files: List[UploadFile] = File(...)):
     """
     Загрузка файлов и извлечение данных частот и амплитуд.
+    Результат парсинга сохраняется по SHA-256 содержимого (см. /uploads/lookup).
+    Число точек известно только после разбора, поэтому бюджет списывается после него,
+    а запрос отклоняется, пока предыдущие не оплачены.
     """
     if not files:
         raise HTTPException(status_code=400, detail="Файлы не найдены")
+    rate_key = _rate_limit_key(request)
+    _enforce_rate_limit(work_rate_limiter, rate_key, 0)
 
     all_frequencies = []
     all_amplitudes = []
     file_names = []
+    file_hashes = []
 
     try:
         for file in files:
@@ -509,30 +1042,19 @@ async def upload_files(files: List[UploadFile] = File(...)):
                 raise HTTPException(status_code=400, detail="Один из файлов не имеет имени")
 
             raw_content = await file.read()
-            decoded_content = None
-            for encoding in ("utf-8", "cp1251", "latin-1"):
-                try:
-                    decoded_content = raw_content.decode(encoding)
-                    break
-                except UnicodeDecodeError:
-                    continue
-
-            if decoded_content is None:
-                raise HTTPException(status_code=400, detail=f'Не удалось декодировать файл {file.filename}. Поддерживаются только текстовые файлы.')
-
-            try:
-                frequencies, amplitudes = parse_any_spectral_file(decoded_content)
-            except ValueError as e:
-                raise HTTPException(status_code=400, detail=f'Ошибка при обработке файла {file.filename}: {str(e)}')
+            digest, frequencies, amplitudes = await run_in_threadpool(_load_upload, raw_content, file.filename)
 
             # Сохраняем результаты
             all_frequencies.append(frequencies)
             all_amplitudes.append(amplitudes)
             file_names.append(file.filename)
+            file_hashes.append(digest)
 
+        work_rate_limiter.charge(rate_key, _spectra_points(all_amplitudes))
         return {
             'message': 'Файлы успешно загружены!',
             'files': file_names,
+            'hashes': file_hashes,
             'frequencies': all_frequencies,
             'amplitudes': all_amplitudes
         }
@@ -540,101 +1062,174 @@ async def upload_files(files: List[UploadFile] = File(...)):
     except Exception as e:
         raise HTTPException(status_code=400, detail=f'Ошибка обработки файлов: {str(e)}')
 
-@app.post("/process_data")
-async def process_data(payload: ProcessDataRequest):
-    try:
-        # Получаем данные из запроса
-        frequencies_list = payload.frequencies
-        amplitudes_list = payload.amplitudes
-        
-        # Обработка данных
-        allFrequencies = []
-        allAmplitudes = []
-        peaks_list = []
-        peaks_values_list = []
-        peaks_info_list = []
-
-        for frequencies, amplitudes in zip(frequencies_list, amplitudes_list):
-            # Конвертируем в numpy arrays
-            freq_array = np.array(frequencies)
-            amp_array = np.array(amplitudes)
-
-            # Фильтрация по частотам
-            freq_array, amp_array = filter_frequency_range(
-                freq_array, amp_array, payload.min_freq, payload.max_freq
-            )
 
-            # Удаление базовой линии
-            if payload.remove_baseline:
-                amp_array -= baseline_als(amp_array, payload.lam, payload.p)
-
-            # Сглаживание
-            if payload.apply_smoothing:
-                amp_array = smooth_signal(amp_array, payload.window_length, payload.polyorder)
-
-            # Нормализация
-            if payload.normalize:
-                amp_array = normalize_snv(amp_array)
-
-            # Поиск пиков
-            peaks = []
-            peaks_values = []
-            peaks_info = []
-            if payload.find_peaks:
-                peaks, _ = find_signal_peaks(amp_array, width=payload.width, prominence=payload.prominence)
-                peaks_values = amp_array[peaks] if len(peaks) > 0 else []
-                if len(peaks) > 0:
-                    for order, peak_idx in enumerate(peaks, start=1):
-                        peaks_info.append({
-                            'index': int(peak_idx),
-                            'order': order,
-                            'frequency': float(freq_array[peak_idx]),
-                            'amplitude': float(amp_array[peak_idx])
-                        })
+@app.post("/uploads/lookup")
+async def lookup_uploads(payload: UploadLookupRequest):
+    """
+    Первый шаг загрузки по хэшам: клиент присылает SHA-256 файлов, сервер
+    возвращает данные уже известных файлов и список хэшей, которые нужно загрузить.
+    """
+    if len(payload.hashes) > MAX_UPLOAD_LOOKUP_HASHES:
+        raise HTTPException(status_code=400, detail=f"Не более {MAX_UPLOAD_LOOKUP_HASHES} хэшей за запрос")
 
-            # Сохраняем результаты
-            allFrequencies.append(freq_array.tolist())
-            allAmplitudes.append(amp_array.tolist())
-            peaks_list.append(peaks.tolist() if hasattr(peaks, 'tolist') else peaks)
-            peaks_values_list.append(peaks_values.tolist() if hasattr(peaks_values, 'tolist') else peaks_values)
-            peaks_info_list.append(peaks_info)
-
-        # Расчет статистики
-        boxplot_stats = []
-        if payload.calculate_boxplot and len(allAmplitudes) > 0:
-            boxplot_stats = calculate_boxplot_stats([np.array(amp) for amp in allAmplitudes])
-
-        mean_amplitude, std_amplitude = [], []
-        if payload.calculate_mean_std and len(allAmplitudes) > 0:
-            mean_amplitude, std_amplitude = calculate_mean_std([np.array(amp) for amp in allAmplitudes])
-            mean_amplitude = mean_amplitude.tolist() if hasattr(mean_amplitude, 'tolist') else mean_amplitude
-            std_amplitude = std_amplitude.tolist() if hasattr(std_amplitude, 'tolist') else std_amplitude
-        moving_averages = []
-        
-        if payload.show_moving_average:  # Добавьте этот параметр в модель
-            for amplitudes in allAmplitudes:
-                moving_avg = calculate_moving_average(amplitudes, payload.moving_average_window)
-                moving_averages.append(moving_avg.tolist())
-        
-        return {
-            'frequencies': allFrequencies,
-            'processed_amplitudes': allAmplitudes,
-            'peaks': peaks_list,
-            'peaks_values': peaks_values_list,
-            'peaks_info': peaks_info_list,
-            'mean_amplitude': mean_amplitude,
-            'boxplot_stats': boxplot_stats,
-            'std_amplitude': std_amplitude,
-            'moving_averages': moving_averages
+    digests = list(dict.fromkeys(value.lower() for value in payload.hashes))
+    for digest in digests:
+        if not is_sha256(digest):
+            raise HTTPException(status_code=400, detail=f"Некорректный SHA-256: {digest}")
 
-        }
+    known, missing = await run_in_threadpool(_lookup_uploads, digests)
+    return {'known': known, 'missing': missing}
+
+@app.post("/process_data")
+async def process_data(payload: ProcessDataRequest, request: Request):
+    # Обработка детерминирована: одинаковое тело запроса даёт одинаковый ответ,
+    # поэтому клиент с If-None-Match получает 304 без повторного расчёта
+    etag = compute_etag(PROCESSING_ETAG_SEED, await request.body())
+    if etag_matches(request, etag):
+        return not_modified(etag, PROCESSING_CACHE_CONTROL)
+
+    # Одинаковые одновременные запросы потока разделяют один расчёт,
+    # а более новый запрос с другими параметрами прерывает устаревший.
+    # Поток — сессия плюс заголовок X-Processing-Stream (вкладка и назначение запроса),
+    # чтобы вкладки и экспорт в полном разрешении не отменяли друг друга
+    session_id = request.session.get("processing_sid")
+    if not session_id:
+        session_id = uuid.uuid4().hex
+        request.session["processing_sid"] = session_id
+    stream_id = request.headers.get("x-processing-stream", "")
+    if not PROCESSING_STREAM_PATTERN.match(stream_id):
+        stream_id = "default"
+
+    headers = {"ETag": etag, "Cache-Control": PROCESSING_CACHE_CONTROL}
+    # ETag включает версию кода и всё тело запроса, поэтому служит ключом общего кэша:
+    # результат, посчитанный любым воркером, отдаётся остальным без пересчёта
+    cache_key = f"processed:{etag}"
+    cached = await run_in_threadpool(shared_cache.get, cache_key)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json", headers=headers)
+
+    # Бюджет расходуют только реальные расчёты: 304 и ответы из кэша бесплатны
+    _enforce_rate_limit(work_rate_limiter, _rate_limit_key(request), _spectra_points(payload.amplitudes))
 
+    try:
+        result = await processing_coalescer.run(
+            f"{session_id}:{stream_id}", etag, lambda is_cancelled: process_spectra(payload, is_cancelled)
+        )
+    except ProcessingCancelled:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Запрос заменён более новым")
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Ошибка обработки данных: {str(e)}")
 
+    response = JSONResponse(content=result, headers=headers)
+    if len(response.body) <= PROCESSED_CACHE_MAX_ENTRY_BYTES:
+        await run_in_threadpool(shared_cache.set, cache_key, bytes(response.body))
+    return response
+
+
+# Параметры, которые клиент живой сессии может менять дельтами (всё, кроме самих спектров)
+LIVE_PARAM_FIELDS = frozenset(ProcessDataRequest.model_fields) - {"frequencies", "amplitudes"}
+
+
+@app.websocket("/ws/process")
+async def live_processing(websocket: WebSocket):
+    """
+    Живая сессия обработки.
+    Клиент один раз отправляет спектры ({"type": "load", "frequencies", "amplitudes", "params"}),
+    затем только изменения параметров ({"type": "params", "delta": {...}}).
+    Сервер отвечает {"type": "result", "seq", "result"}; расчёт, устаревший из-за
+    более новой дельты, прерывается и не отправляется.
+    """
+    await websocket.accept()
+    runner = SupersedingRunner()
+    send_lock = asyncio.Lock()
+    base_payload: Optional[ProcessDataRequest] = None
+    params: Dict[str, Any] = {}
+    pending: set = set()
+
+    async def send(message: Dict[str, Any]) -> None:
+        async with send_lock:
+            await websocket.send_json(message)
+
+    async def compute(seq: int, payload: ProcessDataRequest) -> None:
+        future = runner.submit(lambda is_cancelled: process_spectra(payload, is_cancelled))
+        generation = runner.generation
+        try:
+            result = await future
+        except ProcessingCancelled:
+            return
+        except Exception as e:
+            if runner.is_current(generation):
+                await send({"type": "error", "seq": seq, "detail": f"Ошибка обработки данных: {str(e)}"})
+            return
+        if runner.is_current(generation):
+            await send({"type": "result", "seq": seq, "result": result})
+
+    def merge_params(delta: Dict[str, Any]) -> Dict[str, Any]:
+        unknown = set(delta) - LIVE_PARAM_FIELDS
+        if unknown:
+            raise ValueError(f"Неизвестные параметры: {', '.join(sorted(unknown))}")
+        merged = {**params, **delta}
+        validated = ProcessDataRequest.model_validate({"frequencies": [], "amplitudes": [], **merged})
+        return {name: getattr(validated, name) for name in LIVE_PARAM_FIELDS}
+
+    seq = 0
+    try:
+        while True:
+            raw_message = await websocket.receive_text()
+            seq += 1
+            try:
+                message = json.loads(raw_message)
+                if not isinstance(message, dict):
+                    raise ValueError("Сообщение должно быть JSON-объектом")
+                seq = int(message.get("seq", seq))
+                message_type = message.get("type")
+                if message_type == "load":
+                    params = merge_params(message.get("params") or {})
+                    base_payload = ProcessDataRequest(
+                        frequencies=message.get("frequencies", []),
+                        amplitudes=message.get("amplitudes", []),
+                        **params,
+                    )
+                    await send({"type": "loaded", "seq": seq, "spectra": len(base_payload.amplitudes)})
+                elif message_type == "params":
+                    if base_payload is None:
+                        raise ValueError("Сначала загрузите спектры (type=load)")
+                    params = merge_params(message.get("delta") or {})
+                elif message_type == "cancel":
+                    runner.cancel()
+                    continue
+                else:
+                    raise ValueError(f"Неизвестный тип сообщения: {message_type}")
+            except (ValueError, TypeError, ValidationError) as e:
+                # json.JSONDecodeError — подкласс ValueError; TypeError — seq неподходящего типа
+                await send({"type": "error", "seq": seq, "detail": str(e)})
+                continue
+
+            # Каждый расчёт расходует тот же бюджет, что и /process_data
+            try:
+                work_rate_limiter.acquire(_rate_limit_key(websocket), _spectra_points(base_payload.amplitudes))
+            except RateLimitExceeded as exc:
+                await send({
+                    "type": "error",
+                    "seq": seq,
+                    "detail": f"Слишком много работы за короткое время, повторите через {exc.retry_after_header} с",
+                    "retry_after": int(exc.retry_after_header),
+                })
+                continue
+
+            task = asyncio.ensure_future(compute(seq, base_payload.model_copy(update=params)))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # Расчёты закрытой (в том числе аварийно) сессии никому не нужны
+        runner.cancel()
+        for task in pending:
+            task.cancel()
+
 import zipfile
 import io
-import numpy as np
 from datetime import datetime
 from fastapi import HTTPException
 from fastapi.responses import StreamingResponse
@@ -652,55 +1247,89 @@ class ExportMeanRequest(BaseModel):
     mean_amplitude: List[float]
     params: Optional[Dict[str, Any]] = {}
 
+class ExportMatrixRequest(ExportDataRequest):
+    format: str = "npz"
+
+# Архив собирается во временный файл: в памяти держим не больше этого объёма
+EXPORT_SPOOL_MAX_SIZE = 16 * 1024 * 1024
+EXPORT_CHUNK_SIZE = 256 * 1024
+
+
+def _write_processed_zip(
+    payload: ExportDataRequest,
+    target: Any,
+    progress: Optional[Callable[[float], None]] = None,
+) -> None:
+    """Записывает в target ZIP-архив с обработанными спектрами и файлом метаданных."""
+    from spectral_export import (
+        PROCESSED_METADATA_FILENAME,
+        iter_processed_spectrum_text,
+        processed_entry_name,
+        processing_metadata_text,
+    )
+
+    frequencies = payload.frequencies
+    amplitudes = payload.amplitudes
+    file_names = payload.fileNames
+    params = payload.params
+    total = max(len(frequencies), 1)
+
+    with zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for i, (freq, ampl, name) in enumerate(zip(frequencies, amplitudes, file_names)):
+            if progress is not None:
+                progress(i / total)
+            # Строки форматируются блоками и сразу сжимаются, без сборки всего текста в памяти
+            with zip_file.open(processed_entry_name(name, i), 'w') as entry:
+                for chunk in iter_processed_spectrum_text(name, freq, ampl, params):
+                    entry.write(chunk.encode("utf-8"))
+
+        # Файл с метаданными
+        zip_file.writestr(PROCESSED_METADATA_FILENAME, processing_metadata_text(params))
+
+
+def _build_processed_zip(
+    payload: ExportDataRequest,
+    progress: Optional[Callable[[float], None]] = None,
+) -> bytes:
+    """Собирает ZIP-архив с обработанными спектрами в память (для фоновых задач)."""
+    zip_buffer = io.BytesIO()
+    _write_processed_zip(payload, zip_buffer, progress)
+    return zip_buffer.getvalue()
+
+
+def _spool_processed_zip(payload: ExportDataRequest) -> Any:
+    spool = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_SIZE)
+    try:
+        _write_processed_zip(payload, spool)
+        spool.seek(0)
+    except Exception:
+        spool.close()
+        raise
+    return spool
+
+
+def _iter_spooled_file(spool: Any):
+    try:
+        while True:
+            chunk = spool.read(EXPORT_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        spool.close()
+
+
 @app.post("/export_processed_data")
-async def export_processed_data(payload: ExportDataRequest):
+async def export_processed_data(payload: ExportDataRequest, request: Request):
     """
     Экспорт обработанных данных в ZIP-архив
     """
+    _enforce_rate_limit(work_rate_limiter, _rate_limit_key(request), _spectra_points(payload.amplitudes))
     try:
-        frequencies = payload.frequencies
-        amplitudes = payload.amplitudes
-        file_names = payload.fileNames
-        params = payload.params
-
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            for i, (freq, ampl, name) in enumerate(zip(frequencies, amplitudes, file_names)):
-                base_name = f"spectrum_{i+1}" if not name else name.split('.')[0]
-                file_name = f"{base_name}_processed.txt"
-                
-                content = "# Processed spectral data (after transformations)\n"
-                content += f"# Original file: {name}\n"
-                content += "# Processing parameters:\n"
-                for param, value in params.items():
-                    content += f"# {param}: {value}\n"
-                content += "# Wavenumber (cm⁻¹)\tIntensity (a.u.)\n"
-                
-                for wavenumber, intensity in zip(freq, ampl):
-                    content += f"{wavenumber}\t{intensity}\n"
-                
-                zip_file.writestr(file_name, content)
-            
-            # Файл с метаданными
-            meta_content = "# Processing metadata\n"
-            meta_content += f"# Export date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-            meta_content += "# Applied transformations:\n"
-            if params.get('remove_baseline'):
-                meta_content += "# - Baseline removal applied\n"
-            if params.get('apply_smoothing'):
-                meta_content += "# - Smoothing applied\n"
-            if params.get('normalize'):
-                meta_content += "# - Normalization applied\n"
-            meta_content += "# Parameters:\n"
-            for param, value in params.items():
-                meta_content += f"# {param}: {value}\n"
-            
-            zip_file.writestr("processing_metadata.txt", meta_content)
-
-        zip_buffer.seek(0)
+        spool = await run_in_threadpool(_spool_processed_zip, payload)
         
         return StreamingResponse(
-            io.BytesIO(zip_buffer.getvalue()),
+            _iter_spooled_file(spool),
             media_type='application/zip',
             headers={
                 'Content-Disposition': 'attachment; filename=processed_spectra.zip'
@@ -710,30 +1339,59 @@ async def export_processed_data(payload: ExportDataRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка экспорта: {str(e)}")
 
+@app.post("/export_processed_matrix")
+async def export_processed_matrix(payload: ExportMatrixRequest, request: Request):
+    """
+    Экспорт обработанных спектров одной матрицей: NPZ, HDF5 (h5py) или Parquet (pyarrow)
+    """
+    from spectral_export import EXPORT_FORMATS, ExportFormatUnavailable, export_spectra_matrix
+
+    if payload.format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Неизвестный формат экспорта: {payload.format}")
+    extension, media_type = EXPORT_FORMATS[payload.format]
+    _enforce_rate_limit(work_rate_limiter, _rate_limit_key(request), _spectra_points(payload.amplitudes))
+
+    try:
+        content = await run_in_threadpool(
+            export_spectra_matrix,
+            payload.format,
+            payload.frequencies,
+            payload.amplitudes,
+            payload.fileNames,
+            payload.params,
+        )
+    except (ExportFormatUnavailable, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка экспорта: {str(e)}")
+
+    return Response(
+        content=content,
+        media_type=media_type,
+        headers={
+            'Content-Disposition': f'attachment; filename=processed_spectra{extension}'
+        }
+    )
+
 @app.post("/export_mean_spectrum")
-async def export_mean_spectrum(payload: ExportMeanRequest):
+async def export_mean_spectrum(payload: ExportMeanRequest, request: Request):
     """
     Экспорт среднего спектра в CSV
     """
-    try:
-        frequencies = np.array(payload.frequencies)
-        mean_amplitude = np.array(payload.mean_amplitude)
-        params = payload.params
+    from spectral_export import MEAN_SPECTRUM_FILENAME, iter_mean_spectrum_csv
 
-        # Создаем CSV-строку с метаданными
-        metadata_lines = ["# Metadata"]
-        for param, value in params.items():
-            metadata_lines.append(f"# {param}: {value}")
-        metadata_str = "; ".join(metadata_lines)
+    _enforce_rate_limit(work_rate_limiter, _rate_limit_key(request), len(payload.mean_amplitude))
 
-        csv_data = f"{metadata_str}\n#frequency,mean_amplitude\n"
-        csv_data += "\n".join([f"{freq},{amp}" for freq, amp in zip(frequencies, mean_amplitude)])
+    try:
+        if len(payload.frequencies) != len(payload.mean_amplitude):
+            raise ValueError("Длины массивов частот и амплитуд не совпадают")
+        params = payload.params or {}
 
         return StreamingResponse(
-            io.StringIO(csv_data),
+            iter_mean_spectrum_csv(payload.frequencies, payload.mean_amplitude, params),
             media_type='text/csv',
             headers={
-                'Content-Disposition': 'attachment; filename=mean_spectrum.csv'
+                'Content-Disposition': f'attachment; filename={MEAN_SPECTRUM_FILENAME}'
             }
         )
 
@@ -741,7 +1399,79 @@ async def export_mean_spectrum(payload: ExportMeanRequest):
         raise HTTPException(status_code=400, detail=str(e))
 
 
+def _job_status(job: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "job_id": job["job_id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "progress": job["progress"],
+        "message": job["message"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+        "finished_at": job["finished_at"],
+        "result_url": f"/jobs/{job['job_id']}/result" if job["status"] == "succeeded" else None,
+    }
+
+
+def _get_job_or_404(job_id: str, current_user: str) -> Dict[str, Any]:
+    job = job_manager.get(job_id)
+    if job is None or job["owner"] != current_user:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return job
+
 
+@app.post("/jobs/process", status_code=status.HTTP_202_ACCEPTED)
+async def submit_processing_job(payload: ProcessDataRequest, request: Request, current_user: str = Depends(require_user)):
+    """Ставит обработку в фоновую очередь; результат — тот же JSON, что у /process_data."""
+    _enforce_rate_limit(work_rate_limiter, _rate_limit_key(request), _spectra_points(payload.amplitudes))
+
+    def run(context: JobContext) -> JobResult:
+        try:
+            result = process_spectra(payload, context.is_cancelled, context.report)
+        except ProcessingCancelled:
+            raise JobCancelled()
+        content = json.dumps(result, ensure_ascii=False).encode("utf-8")
+        return JobResult(content, "application/json", "processed_spectra.json")
+
+    job_id = job_manager.submit(current_user, "process", run)
+    return _job_status(job_manager.get(job_id))
+
+
+@app.post("/jobs/export", status_code=status.HTTP_202_ACCEPTED)
+async def submit_export_job(payload: ExportDataRequest, request: Request, current_user: str = Depends(require_user)):
+    """Ставит экспорт ZIP-архива в фоновую очередь."""
+    _enforce_rate_limit(work_rate_limiter, _rate_limit_key(request), _spectra_points(payload.amplitudes))
+
+    def run(context: JobContext) -> JobResult:
+        return JobResult(_build_processed_zip(payload, context.report), "application/zip", "processed_spectra.zip")
+
+    job_id = job_manager.submit(current_user, "export", run)
+    return _job_status(job_manager.get(job_id))
+
+
+@app.get("/jobs/{job_id}")
+async def get_job_status(job_id: str, current_user: str = Depends(require_user)):
+    return _job_status(_get_job_or_404(job_id, current_user))
+
+
+@app.get("/jobs/{job_id}/result")
+async def download_job_result(job_id: str, current_user: str = Depends(require_user)):
+    job = _get_job_or_404(job_id, current_user)
+    if job["status"] != "succeeded":
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Job is {job['status']}")
+    if not job["result_path"] or not os.path.exists(job["result_path"]):
+        raise HTTPException(status_code=status.HTTP_410_GONE, detail="Job result expired")
+    return FileResponse(job["result_path"], media_type=job["result_media_type"], filename=job["result_filename"])
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str, current_user: str = Depends(require_user)):
+    job = _get_job_or_404(job_id, current_user)
+    if job["status"] in FINISHED_STATUSES:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Job is {job['status']}")
+    job_manager.cancel(job_id)
+    return _job_status(job_manager.get(job_id))
 
 
 
@@ -753,133 +1483,403 @@ async def export_mean_spectrum(payload: ExportMeanRequest):
 
 
 
+
+
+
+ANALYSIS_SYSTEM_PROMPT = "Ты ведущий эксперт в области аналитической химии и спектроскопии с глубокими знаниями во всех типах спектроскопических методов (ИК, Раман, УФ-видимая, ЯМР и др.). Твоя задача - предоставлять максимально точный и детальный анализ спектральных данных."
+
+
+def _analysis_model() -> str:
+    return os.getenv("DEEPSEEK_MODEL", "deepseek/deepseek-chat")
+
+
+def _summarize_spectrum(frequencies: List[float], amplitudes: List[float]) -> Tuple[List[Dict[str, float]], str]:
+    """
+    Находит основные пики и определяет тип спектра по диапазону частот.
+    :return: кортеж (peaks_info, spectrum_type)
+    """
+    import numpy as np
+    from scipy.signal import find_peaks
+
+    amplitudes_np = np.array(amplitudes)
+    frequencies_np = np.array(frequencies)
+
+    # Находим пики с значимой интенсивностью
+    peaks, properties = find_peaks(amplitudes_np,
+                                  height=np.percentile(amplitudes_np, 75),
+                                  prominence=0.1*np.max(amplitudes_np))
+
+    # Сортируем пики по интенсивности
+    peak_intensities = amplitudes_np[peaks]
+    sorted_indices = np.argsort(peak_intensities)[::-1]  # Сортировка по убыванию
+    top_peaks = peaks[sorted_indices][:10]  # Берем 10 самых интенсивных пиков
+
+    # Формируем детальную информацию о пиках
+    peaks_info = []
+    for i, peak_idx in enumerate(top_peaks):
+        peaks_info.append({
+            'position': float(frequencies_np[peak_idx]),
+            'intensity': float(amplitudes_np[peak_idx]),
+            'relative_intensity': float(amplitudes_np[peak_idx] / np.max(amplitudes_np))
+        })
+
+    # Определяем тип спектра на основе диапазона частот
+    freq_range = max(frequencies_np) - min(frequencies_np)
+    if freq_range < 1000 and max(frequencies_np) < 1000:
+        spectrum_type = "Рамановская спектроскопия"
+    elif 400 <= min(frequencies_np) and max(frequencies_np) <= 4000:
+        spectrum_type = "ИК-спектроскопия"
+    elif max(frequencies_np) > 10000:
+        spectrum_type = "УФ-видимая спектроскопия"
+    else:
+        spectrum_type = "Неизвестный тип спектра"
+
+    return peaks_info, spectrum_type
+
+
+def _prepare_spectrum_analysis(payload: AIAnalysisRequest) -> Tuple[List[Dict[str, float]], str, List[Dict[str, str]]]:
+    """
+    Находит основные пики, определяет тип спектра и собирает сообщения для модели.
+    :return: кортеж (peaks_info, spectrum_type, messages)
+    """
+    import numpy as np
+
+    peaks_info, spectrum_type = _summarize_spectrum(payload.frequencies, payload.amplitudes)
+    amplitudes_np = np.array(payload.amplitudes)
+    frequencies_np = np.array(payload.frequencies)
+
+    # Формируем промпт для анализа
+    prompt = f"""
+    Ты эксперт-спектроскопист с 20-летним опытом анализа спектральных данных.
+    Проанализируй предоставленные спектральные данные и дай максимально подробный экспертный анализ.
+
+    ОБЩАЯ ИНФОРМАЦИЯ О СПЕКТРЕ:
+    - Тип спектра: {spectrum_type}
+    - Количество точек данных: {len(payload.frequencies)}
+    - Диапазон частот: {min(frequencies_np):.2f} - {max(frequencies_np):.2f} см⁻¹
+    - Диапазон амплитуд: {min(amplitudes_np):.6f} - {max(amplitudes_np):.6f}
+    - Медианная интенсивность: {np.median(amplitudes_np):.6f}
+
+    ОСНОВНЫЕ ПИКИ (отсортированы по интенсивности):
+    {json.dumps(peaks_info, indent=2)}
+
+    ПАРАМЕТРЫ ОБРАБОТКИ ДАННЫХ:
+    {json.dumps(payload.processing_params, indent=2)}
+
+    ПРОФЕССИОНАЛЬНЫЙ АНАЛИЗ:
+    1. ДЕТАЛЬНАЯ ИНТЕРПРЕТАЦИЯ КАЖДОГО ПИКА:
+       - Для каждого пика укажи возможные функциональные группы или химические связи
+       - Укажи характерные области спектра для каждого пика
+       - Оцени силу и специфичность каждого пика
+
+    2. ВЕРОЯТНЫЕ СОЕДИНЕНИЯ ИЛИ МАТЕРИАЛЫ:
+       - Предположи 3-5 наиболее вероятных соединений/материалов
+       - Объясни, какие особенности спектра поддерживают каждое предположение
+       - Укажи степень уверенности для каждого предположения
+
+    3. КАЧЕСТВЕННЫЙ АНАЛИЗ СПЕКТРА:
+       - Оцени качество данных (шумы, артефакты, разрешение)
+       - Определи, есть ли признаки неорганических компонентов
+       - Определи, есть ли признаки органических компонентов
+
+    4. РЕКОМЕНДАЦИИ ПО ДАЛЬНЕЙШЕМУ АНАЛИЗУ:
+       - Какие дополнительные измерения помогут уточнить анализ
+       - Какие методы подтверждения рекомендованы
+       - На какие конкретные спектральные базы данных стоит обратить внимание
+
+    5. ОГРАНИЧЕНИЯ АНАЛИЗА:
+       - Укажи ограничения текущего анализа
+       - Какая дополнительная информация могла бы улучшить анализ
+
+    Предоставь ответ на русском языке в формате профессионального научного отчёта.
+    Будь максимально точным и детальным, но избегай излишней спекуляции.
+    """
+
+    messages = [
+        {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+    return peaks_info, spectrum_type, messages
+
+
+def _prepare_batch_analysis(payload: "AIBatchAnalysisRequest") -> Tuple[List[Dict[str, Any]], List[Dict[str, str]]]:
+    """
+    Собирает один промпт для сравнительного анализа нескольких спектров.
+    :return: кортеж (сводка по каждому спектру, messages)
+    """
+    import numpy as np
+
+    summaries: List[Dict[str, Any]] = []
+    sections: List[str] = []
+    for index, spectrum in enumerate(payload.spectra, start=1):
+        peaks_info, spectrum_type = _summarize_spectrum(spectrum.frequencies, spectrum.amplitudes)
+        amplitudes_np = np.array(spectrum.amplitudes)
+        frequencies_np = np.array(spectrum.frequencies)
+        name = spectrum.name or f"Спектр {index}"
+        summaries.append({
+            "name": name,
+            "peaks_identified": len(peaks_info),
+            "spectrum_type": spectrum_type,
+        })
+        sections.append(f"""
+    СПЕКТР {index} ({name}):
+    - Тип спектра: {spectrum_type}
+    - Количество точек данных: {len(spectrum.frequencies)}
+    - Диапазон частот: {min(frequencies_np):.2f} - {max(frequencies_np):.2f} см⁻¹
+    - Диапазон амплитуд: {min(amplitudes_np):.6f} - {max(amplitudes_np):.6f}
+    - Основные пики: {json.dumps(peaks_info)}
+    """)
+
+    prompt = f"""
+    Ты эксперт-спектроскопист с 20-летним опытом анализа спектральных данных.
+    Проанализируй {len(payload.spectra)} спектров одной серии измерений и дай сравнительный экспертный анализ.
+    {"".join(sections)}
+    ПАРАМЕТРЫ ОБРАБОТКИ ДАННЫХ (общие для всех спектров):
+    {json.dumps(payload.processing_params, indent=2)}
+
+    ПРОФЕССИОНАЛЬНЫЙ АНАЛИЗ:
+    1. Для каждого спектра (отдельный раздел "Спектр N") кратко интерпретируй основные пики.
+    2. Сравни спектры: общие полосы, полосы, отличающие спектры друг от друга, и их возможная природа.
+    3. Отметь спектры с признаками шумов, артефактов или низкого качества.
+    4. Дай рекомендации по дальнейшему анализу серии и укажи ограничения анализа.
+
+    Предоставь ответ на русском языке в формате профессионального научного отчёта.
+    Будь максимально точным, но избегай излишней спекуляции.
+    """
+
+    messages = [
+        {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+    return summaries, messages
+
+
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Форматирует одно событие Server-Sent Events с JSON-данными."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _analysis_cache_key(peaks_info: List[Dict[str, float]], spectrum_type: str, processing_params: Dict[str, Any], model: str) -> str:
+    """
+    Ключ кэша AI-анализа: отпечаток основных пиков (с округлением), тип спектра,
+    параметры обработки и имя модели.
+    """
+    fingerprint = [
+        [round(peak['position'], 1), round(peak['relative_intensity'], 2)]
+        for peak in peaks_info
+    ]
+    key_source = json.dumps(
+        {
+            "peaks": fingerprint,
+            "spectrum_type": spectrum_type,
+            "processing_params": processing_params,
+            "model": model,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+
+
+def get_cached_analysis(cache_key: str) -> Optional[Dict[str, Any]]:
+    now = datetime.utcnow().isoformat()
+    conn = get_db_connection()
+    try:
+        row = conn.execute(
+            "SELECT analysis, peaks_identified, spectrum_type FROM ai_analysis_cache WHERE cache_key = ? AND expires_at > ?",
+            (cache_key, now),
+        ).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    return {
+        "analysis": row["analysis"],
+        "peaks_identified": row["peaks_identified"],
+        "spectrum_type": row["spectrum_type"],
+    }
+
+
+def store_cached_analysis(cache_key: str, model: str, analysis: str, peaks_identified: int, spectrum_type: str) -> None:
+    created_at = datetime.utcnow()
+    expires_at = created_at + timedelta(seconds=AI_CACHE_TTL_SECONDS)
+    conn = get_db_connection()
+    try:
+        # Попутно вытесняем записи с истёкшим TTL
+        conn.execute("DELETE FROM ai_analysis_cache WHERE expires_at <= ?", (created_at.isoformat(),))
+        conn.execute(
+            '''
+            INSERT INTO ai_analysis_cache (cache_key, model, analysis, peaks_identified, spectrum_type, created_at, expires_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(cache_key) DO UPDATE SET
+                analysis = excluded.analysis,
+                peaks_identified = excluded.peaks_identified,
+                spectrum_type = excluded.spectrum_type,
+                created_at = excluded.created_at,
+                expires_at = excluded.expires_at
+            ''',
+            (cache_key, model, analysis, peaks_identified, spectrum_type, created_at.isoformat(), expires_at.isoformat()),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
 @app.post("/analyze_spectrum")
-async def analyze_spectrum(payload: AIAnalysisRequest):
+async def analyze_spectrum(payload: AIAnalysisRequest, request: Request):
     """
     Анализ спектра с помощью DeepSeek AI
     """
+    client = get_ai_client()
     if client is None:
         raise HTTPException(status_code=500, detail="AI analysis service is not configured")
 
     try:
-        # Находим основные пики в спектре
-        import numpy as np
-        from scipy.signal import find_peaks
-        
-        amplitudes_np = np.array(payload.amplitudes)
-        frequencies_np = np.array(payload.frequencies)
-        
-        # Находим пики с значимой интенсивностью
-        peaks, properties = find_peaks(amplitudes_np, 
-                                      height=np.percentile(amplitudes_np, 75),
-                                      prominence=0.1*np.max(amplitudes_np))
-        
-        # Сортируем пики по интенсивности
-        peak_intensities = amplitudes_np[peaks]
-        sorted_indices = np.argsort(peak_intensities)[::-1]  # Сортировка по убыванию
-        top_peaks = peaks[sorted_indices][:10]  # Берем 10 самых интенсивных пиков
-        
-        # Формируем детальную информацию о пиках
-        peaks_info = []
-        for i, peak_idx in enumerate(top_peaks):
-            peaks_info.append({
-                'position': float(frequencies_np[peak_idx]),
-                'intensity': float(amplitudes_np[peak_idx]),
-                'relative_intensity': float(amplitudes_np[peak_idx] / np.max(amplitudes_np))
-            })
-        
-        # Определяем тип спектра на основе диапазона частот
-        freq_range = max(frequencies_np) - min(frequencies_np)
-        if freq_range < 1000 and max(frequencies_np) < 1000:
-            spectrum_type = "Рамановская спектроскопия"
-        elif 400 <= min(frequencies_np) and max(frequencies_np) <= 4000:
-            spectrum_type = "ИК-спектроскопия"
-        elif max(frequencies_np) > 10000:
-            spectrum_type = "УФ-видимая спектроскопия"
-        else:
-            spectrum_type = "Неизвестный тип спектра"
-        
-        # Формируем промпт для анализа
-        prompt = f"""
-        Ты эксперт-спектроскопист с 20-летним опытом анализа спектральных данных.
-        Проанализируй предоставленные спектральные данные и дай максимально подробный экспертный анализ.
-
-        ОБЩАЯ ИНФОРМАЦИЯ О СПЕКТРЕ:
-        - Тип спектра: {spectrum_type}
-        - Количество точек данных: {len(payload.frequencies)}
-        - Диапазон частот: {min(frequencies_np):.2f} - {max(frequencies_np):.2f} см⁻¹
-        - Диапазон амплитуд: {min(amplitudes_np):.6f} - {max(amplitudes_np):.6f}
-        - Медианная интенсивность: {np.median(amplitudes_np):.6f}
-
-        ОСНОВНЫЕ ПИКИ (отсортированы по интенсивности):
-        {json.dumps(peaks_info, indent=2)}
-
-        ПАРАМЕТРЫ ОБРАБОТКИ ДАННЫХ:
-        {json.dumps(payload.processing_params, indent=2)}
-
-        ПРОФЕССИОНАЛЬНЫЙ АНАЛИЗ:
-        1. ДЕТАЛЬНАЯ ИНТЕРПРЕТАЦИЯ КАЖДОГО ПИКА:
-           - Для каждого пика укажи возможные функциональные группы или химические связи
-           - Укажи характерные области спектра для каждого пика
-           - Оцени силу и специфичность каждого пика
-
-        2. ВЕРОЯТНЫЕ СОЕДИНЕНИЯ ИЛИ МАТЕРИАЛЫ:
-           - Предположи 3-5 наиболее вероятных соединений/материалов
-           - Объясни, какие особенности спектра поддерживают каждое предположение
-           - Укажи степень уверенности для каждого предположения
-
-        3. КАЧЕСТВЕННЫЙ АНАЛИЗ СПЕКТРА:
-           - Оцени качество данных (шумы, артефакты, разрешение)
-           - Определи, есть ли признаки неорганических компонентов
-           - Определи, есть ли признаки органических компонентов
-
-        4. РЕКОМЕНДАЦИИ ПО ДАЛЬНЕЙШЕМУ АНАЛИЗУ:
-           - Какие дополнительные измерения помогут уточнить анализ
-           - Какие методы подтверждения рекомендованы
-           - На какие конкретные спектральные базы данных стоит обратить внимание
-
-        5. ОГРАНИЧЕНИЯ АНАЛИЗА:
-           - Укажи ограничения текущего анализа
-           - Какая дополнительная информация могла бы улучшить анализ
-
-        Предоставь ответ на русском языке в формате профессионального научного отчёта.
-        Будь максимально точным и детальным, но избегай излишней спекуляции.
-        """
-
-        # Отправляем запрос к DeepSeek через OpenRouter
-        response = client.chat.completions.create(
-            model=os.getenv("DEEPSEEK_MODEL", "deepseek/deepseek-chat"),
-            messages=[
-                {"role": "system", "content": "Ты ведущий эксперт в области аналитической химии и спектроскопии с глубокими знаниями во всех типах спектроскопических методов (ИК, Раман, УФ-видимая, ЯМР и др.). Твоя задача - предоставлять максимально точный и детальный анализ спектральных данных."},
-                {"role": "user", "content": prompt}
-            ],
+        peaks_info, spectrum_type, messages = _prepare_spectrum_analysis(payload)
+        model = _analysis_model()
+        cache_key = _analysis_cache_key(peaks_info, spectrum_type, payload.processing_params, model)
+
+        cached = get_cached_analysis(cache_key)
+        if cached is not None:
+            queue_stats = {"queue_depth": llm_limiter.queue_depth, "wait_time": 0.0, "attempts": 0}
+            return {**cached, "success": True, "cached": True, "queue": queue_stats}
+
+        _enforce_rate_limit(ai_rate_limiter, _rate_limit_key(request), 1)
+        # Отправляем запрос к DeepSeek через OpenRouter (асинхронно, через общую очередь)
+        response, queue_stats = await llm_limiter.run(lambda: client.chat.completions.create(
+            model=model,
+            messages=messages,
             max_tokens=3000,
             temperature=0.3  # Низкая температура для более детерминированных ответов
-        )
+        ))
 
         analysis = response.choices[0].message.content
+        if analysis:
+            store_cached_analysis(cache_key, model, analysis, len(peaks_info), spectrum_type)
 
         return {
-            "analysis": analysis, 
+            "analysis": analysis,
             "success": True,
             "peaks_identified": len(peaks_info),
-            "spectrum_type": spectrum_type
+            "spectrum_type": spectrum_type,
+            "cached": False,
+            "queue": queue_stats
         }
 
     except HTTPException:
         raise
+    except LLMQueueTimeout as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=f"AI analysis queue is full: {str(e)}")
     except Exception as e:
         logger.error(f"Ошибка AI анализа: {str(e)}")
         return {"analysis": f"Ошибка анализа: {str(e)}", "success": False}
 
 
+@app.post("/analyze_spectrum/stream")
+async def analyze_spectrum_stream(payload: AIAnalysisRequest, request: Request):
+    """
+    Потоковый анализ спектра: токены модели передаются клиенту как Server-Sent Events.
+    События: meta (тип спектра и число пиков), queue (ожидание в очереди),
+    token (фрагмент текста), done, error.
+    """
+    client = get_ai_client()
+    if client is None:
+        raise HTTPException(status_code=500, detail="AI analysis service is not configured")
 
+    try:
+        peaks_info, spectrum_type, messages = _prepare_spectrum_analysis(payload)
+        model = _analysis_model()
+        cache_key = _analysis_cache_key(peaks_info, spectrum_type, payload.processing_params, model)
+        cached = get_cached_analysis(cache_key)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Ошибка анализа: {str(e)}")
+    if cached is None:
+        _enforce_rate_limit(ai_rate_limiter, _rate_limit_key(request), 1)
+
+    async def event_stream():
+        yield _sse_event("meta", {"peaks_identified": len(peaks_info), "spectrum_type": spectrum_type, "cached": cached is not None})
+        if cached is not None:
+            yield _sse_event("token", {"text": cached["analysis"]})
+            yield _sse_event("done", {"success": True})
+            return
+
+        parts: List[str] = []
+        try:
+            async with llm_limiter.slot() as queue_stats:
+                stream = await llm_limiter.call_with_retry(lambda: client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=3000,
+                    temperature=0.3,
+                    stream=True
+                ), queue_stats)
+                yield _sse_event("queue", queue_stats)
+                async for chunk in llm_limiter.iterate_stream(stream):
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        parts.append(delta)
+                        yield _sse_event("token", {"text": delta})
+        except Exception as e:
+            logger.error(f"Ошибка потокового AI анализа: {str(e)}")
+            yield _sse_event("error", {"analysis": f"Ошибка анализа: {str(e)}", "success": False})
+            return
+
+        if parts:
+            try:
+                store_cached_analysis(cache_key, model, "".join(parts), len(peaks_info), spectrum_type)
+            except Exception as e:
+                logger.error(f"Не удалось сохранить AI анализ в кэш: {str(e)}")
+        yield _sse_event("done", {"success": True})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
+@app.post("/analyze_spectrum/batch")
+async def analyze_spectrum_batch(payload: AIBatchAnalysisRequest, request: Request):
+    """
+    Сравнительный анализ нескольких спектров одним запросом к модели
+    """
+    client = get_ai_client()
+    if client is None:
+        raise HTTPException(status_code=500, detail="AI analysis service is not configured")
+    if not payload.spectra:
+        raise HTTPException(status_code=400, detail="Список спектров пуст")
+    if len(payload.spectra) > AI_BATCH_MAX_SPECTRA:
+        raise HTTPException(status_code=400, detail=f"Не более {AI_BATCH_MAX_SPECTRA} спектров в одном запросе")
+    # Сравнительный анализ стоит столько обращений, сколько в нём спектров
+    _enforce_rate_limit(ai_rate_limiter, _rate_limit_key(request), len(payload.spectra))
 
+    try:
+        summaries, messages = _prepare_batch_analysis(payload)
 
+        response, queue_stats = await llm_limiter.run(lambda: client.chat.completions.create(
+            model=_analysis_model(),
+            messages=messages,
+            max_tokens=4000,
+            temperature=0.3
+        ))
 
+        return {
+            "analysis": response.choices[0].message.content,
+            "success": True,
+            "spectra": summaries,
+            "queue": queue_stats
+        }
 
+    except HTTPException:
+        raise
+    except LLMQueueTimeout as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=f"AI analysis queue is full: {str(e)}")
+    except Exception as e:
+        logger.error(f"Ошибка пакетного AI анализа: {str(e)}")
+        return {"analysis": f"Ошибка анализа: {str(e)}", "success": False}
 
 
 
@@ -888,27 +1888,244 @@ async def analyze_spectrum(payload: AIAnalysisRequest):
 
 
 
-@app.get("/presets")
-async def list_presets(current_user: str = Depends(require_user)):
-    user_row = _get_user_row_or_401(current_user)
-    conn = get_db_connection()
+
+
+
+
+
+
+
+
+
+def _require_spectral_library() -> "SpectralLibrary":
+    with _spectral_library_lock:
+        try:
+            return _refresh_spectral_library()
+        except Exception as library_error:
+            logger.error("Failed to load spectral library: %s", library_error)
+            raise HTTPException(status_code=500, detail="Spectral library is not available")
+
+
+# Поля метаданных эталона, которые не отдаются анонимному поиску
+LIBRARY_PRIVATE_METADATA = ("added_by",)
+
+
+def _public_reference_metadata(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value for key, value in metadata.items() if key not in LIBRARY_PRIVATE_METADATA}
+
+
+@app.get("/library")
+async def list_library_references(current_user: str = Depends(require_user)):
+    """
+    Список эталонов спектральной библиотеки (только для вошедших пользователей:
+    в метаданных есть имя добавившего эталон)
+    """
+    library = _require_spectral_library()
+    return {
+        "size": len(library),
+        "grid": {
+            "min": float(library.grid[0]),
+            "max": float(library.grid[-1]),
+            "points": int(library.grid.size),
+        },
+        "references": [
+            {"id": ref_id, "name": name, "metadata": metadata}
+            for ref_id, (name, metadata) in enumerate(zip(library.names, library.metadata))
+        ],
+    }
+
+
+@app.post("/library/references")
+async def add_library_reference(payload: LibraryReferenceRequest, current_user: str = Depends(require_user)):
+    """
+    Добавление эталонного спектра в библиотеку
+    """
+    _require_spectral_library()
+    name = payload.name.strip()
+    if not name:
+        raise HTTPException(status_code=400, detail="Название эталона не может быть пустым")
+    metadata = dict(payload.metadata or {})
+    metadata.setdefault("added_by", current_user)
+    metadata.setdefault("added_at", datetime.utcnow().isoformat())
     try:
-        rows = conn.execute(
-            "SELECT slot, name, updated_at FROM saved_presets WHERE user_id = ? ORDER BY slot",
-            (user_row["id"],),
-        ).fetchall()
-    finally:
-        conn.close()
-    return [
-        {"slot": row["slot"], "name": row["name"], "updated_at": row["updated_at"]}
-        for row in rows
-    ]
+        ref_id, size = await run_in_threadpool(
+            _add_library_reference, name, payload.frequencies, payload.amplitudes, metadata
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Ошибка добавления эталона: {str(e)}")
+    return {"id": ref_id, "name": name, "size": size}
+
+
+@app.post("/library/search")
+async def search_library(payload: LibrarySearchRequest):
+    """
+    Поиск наиболее похожих эталонов (корреляция Пирсона или косинусное сходство).
+    Поиск доступен без входа, поэтому имя добавившего эталон в ответ не попадает
+    """
+    library = _require_spectral_library()
+    try:
+        # Матричное произведение по всей библиотеке — в пуле потоков, как и хемометрика
+        result = await run_in_threadpool(
+            library.search,
+            payload.frequencies,
+            payload.amplitudes,
+            top_k=payload.top_k,
+            metric=payload.metric,
+            prefilter=payload.prefilter,
+            min_shared_peaks=payload.min_shared_peaks,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Ошибка поиска: {str(e)}")
+    for match in result["matches"]:
+        match["metadata"] = _public_reference_metadata(match["metadata"])
+    return result
+
+
+def _run_pca(payload: PCARequest) -> Dict[str, Any]:
+    from chemometrics import class_means, common_grid_matrix, pca, to_serializable
+
+    grid, matrix = common_grid_matrix(payload.frequencies, payload.amplitudes)
+    result = pca(
+        matrix,
+        n_components=payload.n_components,
+        center=payload.center,
+        scale=payload.scale,
+        method=payload.method,
+    )
+    response = to_serializable(result)
+    response["grid"] = grid.tolist()
+    response["fileNames"] = payload.fileNames
+    if payload.labels is not None:
+        if len(payload.labels) != matrix.shape[0]:
+            raise ValueError("Число меток не совпадает с числом спектров")
+        response["labels"] = payload.labels
+        response["class_centroids"] = class_means(result["scores"], payload.labels)
+    return response
+
+
+def _run_plsda(payload: PLSDARequest) -> Dict[str, Any]:
+    from chemometrics import class_means, common_grid_matrix, plsda, to_serializable
+
+    grid, matrix = common_grid_matrix(payload.frequencies, payload.amplitudes)
+    result = plsda(
+        matrix,
+        payload.labels,
+        n_components=payload.n_components,
+        scale=payload.scale,
+        cv_folds=payload.cv_folds,
+    )
+    response = to_serializable(result)
+    response["grid"] = grid.tolist()
+    response["fileNames"] = payload.fileNames
+    response["labels"] = payload.labels
+    response["class_centroids"] = class_means(result["scores"], payload.labels)
+    return response
+
+
+# Полную матрицу расстояний отдаём только для небольших наборов: для n спектров это n² чисел
+CORRELATION_MATRIX_MAX_SPECTRA = 1000
+
+
+def _run_correlation(payload: CorrelationRequest) -> Dict[str, Any]:
+    from chemometrics import cluster_spectra, common_grid_matrix, to_serializable
+
+    if payload.include_matrix and len(payload.amplitudes) > CORRELATION_MATRIX_MAX_SPECTRA:
+        raise ValueError(
+            f"Полная матрица доступна не более чем для {CORRELATION_MATRIX_MAX_SPECTRA} спектров"
+        )
+    _, matrix = common_grid_matrix(payload.frequencies, payload.amplitudes)
+    result = cluster_spectra(
+        matrix,
+        metric=payload.metric,
+        method=payload.method,
+        n_clusters=payload.n_clusters,
+        distance_threshold=payload.distance_threshold,
+        outlier_threshold=payload.outlier_threshold,
+        include_matrix=payload.include_matrix,
+    )
+    response = to_serializable(result)
+    response["fileNames"] = payload.fileNames
+    response["labels"] = payload.labels
+    return response
+
+
+@app.post("/chemometrics/pca")
+async def chemometrics_pca(payload: PCARequest):
+    """
+    PCA по обработанным спектрам: scores, loadings и доли объяснённой дисперсии
+    """
+    try:
+        return await run_in_threadpool(_run_pca, payload)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Ошибка PCA: {str(e)}")
+
+
+@app.post("/chemometrics/plsda")
+async def chemometrics_plsda(payload: PLSDARequest):
+    """
+    PLS-DA по обработанным спектрам с кросс-валидацией и VIP
+    """
+    try:
+        return await run_in_threadpool(_run_plsda, payload)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Ошибка PLS-DA: {str(e)}")
+
+
+@app.post("/chemometrics/correlation")
+async def chemometrics_correlation(payload: CorrelationRequest):
+    """
+    Попарные корреляции/расстояния спектров, иерархическая кластеризация и выбросы
+    """
+    try:
+        return await run_in_threadpool(_run_correlation, payload)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Ошибка кластеризации: {str(e)}")
+
+
+@app.get("/presets")
+async def list_presets(
+    response: Response,
+    after: int = 0,
+    limit: Optional[int] = None,
+    current_user: str = Depends(require_user),
+):
+    """Названия и даты пресетов без содержимого; следующая страница — в заголовке X-Next-After."""
+    _validate_preset_after(after)
+    items, next_after = await run_in_threadpool(
+        _fetch_presets_page, current_user, after, _preset_page_limit(limit), False
+    )
+    if next_after is not None:
+        response.headers["X-Next-After"] = str(next_after)
+    return items
+
+
+@app.get("/presets/bulk")
+async def bulk_presets(
+    request: Request,
+    after: int = 0,
+    limit: Optional[int] = None,
+    current_user: str = Depends(require_user),
+):
+    """
+    Все пресеты пользователя вместе с параметрами одним запросом (постранично).
+    Ответ снабжается ETag: если пресеты не менялись, клиент с If-None-Match получает 304.
+    """
+    _validate_preset_after(after)
+    items, next_after = await run_in_threadpool(
+        _fetch_presets_page, current_user, after, _preset_page_limit(limit), True
+    )
+    response = JSONResponse({"items": items, "next_after": next_after})
+    etag = compute_etag(current_user.encode("utf-8"), response.body)
+    if etag_matches(request, etag):
+        return not_modified(etag, "private, no-cache")
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
 
 
 @app.post("/presets/{slot}")
 async def save_preset(slot: int, preset: PresetSaveRequest, current_user: str = Depends(require_user)):
     _validate_preset_slot(slot)
-    user_row = _get_user_row_or_401(current_user)
     preset_name = (preset.name or "").strip()
     if not preset_name:
         preset_name = f"Пресет {slot}"
@@ -917,7 +2134,7 @@ async def save_preset(slot: int, preset: PresetSaveRequest, current_user: str =
     try:
         conn.execute(
             '''
-            INSERT INTO saved_presets (user_id, slot, name, payload, updated_at)
+            INSERT INTO user_presets (user_id, slot, name, payload, updated_at)
             VALUES (?, ?, ?, ?, ?)
             ON CONFLICT(user_id, slot) DO UPDATE SET
                 name = excluded.name,
@@ -925,7 +2142,7 @@ async def save_preset(slot: int, preset: PresetSaveRequest, current_user: str =
                 updated_at = excluded.updated_at
             ''',
             (
-                user_row["id"],
+                _user_id_or_401(conn, current_user),
                 slot,
                 preset_name,
                 json.dumps(preset.payload, ensure_ascii=False),
@@ -941,25 +2158,20 @@ async def save_preset(slot: int, preset: PresetSaveRequest, current_user: str =
 @app.get("/presets/{slot}")
 async def load_preset(slot: int, current_user: str = Depends(require_user)):
     _validate_preset_slot(slot)
-    user_row = _get_user_row_or_401(current_user)
     conn = get_db_connection()
     try:
         row = conn.execute(
-            "SELECT slot, name, payload, updated_at FROM saved_presets WHERE user_id = ? AND slot = ?",
-            (user_row["id"], slot),
+            "SELECT slot, name, payload, updated_at FROM user_presets WHERE user_id = ? AND slot = ?",
+            (_user_id_or_401(conn, current_user), slot),
         ).fetchone()
     finally:
         conn.close()
     if row is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Preset not found")
-    try:
-        payload = json.loads(row["payload"])
-    except json.JSONDecodeError:
-        payload = {}
     return {
         "slot": row["slot"],
         "name": row["name"],
-        "payload": payload,
+        "payload": _decode_preset_payload(row["payload"]),
         "updated_at": row["updated_at"],
     }
 
@@ -967,12 +2179,11 @@ async def load_preset(slot: int, current_user: str = Depends(require_user)):
 @app.delete("/presets/{slot}")
 async def delete_preset(slot: int, current_user: str = Depends(require_user)):
     _validate_preset_slot(slot)
-    user_row = _get_user_row_or_401(current_user)
     conn = get_db_connection()
     try:
         cursor = conn.execute(
-            "DELETE FROM saved_presets WHERE user_id = ? AND slot = ?",
-            (user_row["id"], slot),
+            "DELETE FROM user_presets WHERE user_id = ? AND slot = ?",
+            (_user_id_or_401(conn, current_user), slot),
         )
         conn.commit()
     finally:
@@ -982,6 +2193,9 @@ async def delete_preset(slot: int, current_user: str = Depends(require_user)):
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
+STARTUP_TIMINGS["import_seconds"] = round(time.perf_counter() - _IMPORT_STARTED, 4)
+logger.info("app.py imported in %.3f s", STARTUP_TIMINGS["import_seconds"])
+
 if __name__ == '__main__':
     import uvicorn, os
     port = int(os.environ.get("PORT", 8000))
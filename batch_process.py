@@ -0,0 +1,373 @@
+"""
+Пакетная обработка каталогов спектров без веб-интерфейса.
+
+Использует тот же конвейер, что и /process_data (processing_pipeline.process_spectra),
+и те же форматы экспорта. Файлы обрабатываются пачками в пуле процессов.
+
+Пример:
+    python batch_process.py data/ -o results/ --preset preset.json --workers 8
+"""
+import argparse
+import fnmatch
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import zipfile
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from data_processing import decode_spectral_bytes, parse_any_spectral_file
+from processing_pipeline import ProcessDataRequest, preset_to_params, process_spectra
+from spectral_export import (
+    EXPORT_FORMATS,
+    MEAN_SPECTRUM_FILENAME,
+    PROCESSED_METADATA_FILENAME,
+    export_spectra_matrix,
+    iter_mean_spectrum_csv,
+    iter_processed_spectrum_text,
+    processed_entry_name,
+    processing_metadata_text,
+)
+
+
+logger = logging.getLogger("batch_process")
+
+DEFAULT_PATTERNS = ("*.txt", "*.csv", "*.esp")
+TEXT_FORMATS = ("txt", "zip")
+PEAKS_FILENAME = "peaks.csv"
+FAILED_FILENAME = "failed_files.txt"
+
+# Параметры, заданные в основном процессе; воркеры получают их через initializer
+_worker_options: Dict[str, Any] = {}
+
+
+def find_spectral_files(root: str, patterns: Sequence[str]) -> List[str]:
+    """Рекурсивно находит файлы по шаблонам; пути относительно root, отсортированы."""
+    found = []
+    for directory, _, names in os.walk(root):
+        for name in names:
+            if any(fnmatch.fnmatch(name.lower(), pattern.lower()) for pattern in patterns):
+                found.append(os.path.relpath(os.path.join(directory, name), root))
+    return sorted(found)
+
+
+def output_entry_name(relative_path: str, index: int) -> str:
+    """Имя результата с сохранением структуры подкаталогов входного каталога."""
+    directory, name = os.path.split(relative_path)
+    entry = processed_entry_name(name, index)
+    return os.path.join(directory, entry).replace(os.sep, "/") if directory else entry
+
+
+def _init_worker(options: Dict[str, Any]) -> None:
+    _worker_options.clear()
+    _worker_options.update(options)
+
+
+def _read_spectrum(path: str) -> Tuple[List[float], List[float]]:
+    with open(path, "rb") as handle:
+        return parse_any_spectral_file(decode_spectral_bytes(handle.read()))
+
+
+def _mean_moments(amplitudes: List[np.ndarray]) -> Tuple[int, np.ndarray, np.ndarray]:
+    matrix = np.vstack(amplitudes)
+    mean = matrix.mean(axis=0)
+    return matrix.shape[0], mean, ((matrix - mean) ** 2).sum(axis=0)
+
+
+def _process_files(items: Sequence[Tuple[int, str]]) -> Dict[str, Any]:
+    """
+    Обрабатывает пачку файлов одним вызовом конвейера (сглаживание идёт матрицей).
+    Если пачка падает целиком, файлы обрабатываются по одному, чтобы найти виновника
+    (всплески тогда ищутся без сравнения с повторами).
+    """
+    options = _worker_options
+    params = options["params"]
+    results: List[Dict[str, Any]] = []
+    parsed: List[Tuple[int, str, List[float], List[float]]] = []
+
+    for index, relative_path in items:
+        try:
+            frequencies, amplitudes = _read_spectrum(os.path.join(options["input_dir"], relative_path))
+            parsed.append((index, relative_path, frequencies, amplitudes))
+        except (OSError, ValueError) as exc:
+            results.append({"index": index, "path": relative_path, "error": str(exc)})
+
+    processed: List[Tuple[int, str, Dict[str, Any], int]] = []
+    try:
+        if parsed:
+            payload = ProcessDataRequest(
+                frequencies=[item[2] for item in parsed],
+                amplitudes=[item[3] for item in parsed],
+                **params,
+            )
+            output = process_spectra(payload)
+            processed = [(index, path, output, position) for position, (index, path, _, _) in enumerate(parsed)]
+    except Exception:
+        for index, relative_path, frequencies, amplitudes in parsed:
+            try:
+                payload = ProcessDataRequest(frequencies=[frequencies], amplitudes=[amplitudes], **params)
+                processed.append((index, relative_path, process_spectra(payload), 0))
+            except Exception as exc:
+                results.append({"index": index, "path": relative_path, "error": str(exc)})
+
+    mean_groups: Dict[bytes, Tuple[np.ndarray, List[np.ndarray]]] = {}
+    for index, relative_path, output, position in processed:
+        frequencies = np.asarray(output["frequencies"][position])
+        amplitudes = np.asarray(output["processed_amplitudes"][position])
+        entry_name = output_entry_name(relative_path, index)
+        result: Dict[str, Any] = {
+            "index": index,
+            "path": relative_path,
+            "entry": entry_name,
+            "error": None,
+            "peaks": output["peaks_info"][position],
+        }
+
+        if options["format"] in TEXT_FORMATS:
+            text = "".join(iter_processed_spectrum_text(relative_path, frequencies, amplitudes, params))
+            if options["format"] == "txt":
+                target = os.path.join(options["output_dir"], entry_name)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with open(target, "w", encoding="utf-8") as handle:
+                    handle.write(text)
+            else:
+                result["content"] = text.encode("utf-8")
+        else:
+            result["frequencies"] = frequencies
+            result["amplitudes"] = amplitudes
+
+        if params.get("calculate_mean_std"):
+            key = frequencies.tobytes()
+            mean_groups.setdefault(key, (frequencies, []))[1].append(amplitudes)
+        results.append(result)
+
+    # Для среднего спектра воркер отдаёт не сами спектры, а моменты по каждой сетке частот
+    moments = [(grid, *_mean_moments(group)) for grid, group in mean_groups.values()]
+    return {"start": items[0][0] if items else 0, "results": results, "moments": moments}
+
+
+class MeanAccumulator:
+    """Объединяет среднее и дисперсию по пачкам (параллельный алгоритм Чана)."""
+
+    def __init__(self) -> None:
+        self.grid: Optional[np.ndarray] = None
+        self.count = 0
+        self.mean: Optional[np.ndarray] = None
+        self.m2: Optional[np.ndarray] = None
+        self.mismatched = False
+
+    def add(self, grid: np.ndarray, count: int, mean: np.ndarray, m2: np.ndarray) -> None:
+        if self.grid is None:
+            self.grid, self.count, self.mean, self.m2 = grid, count, mean, m2
+            return
+        if grid.shape != self.grid.shape or not np.array_equal(grid, self.grid):
+            self.mismatched = True
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * count / total
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * count / total
+        self.count = total
+
+
+def _chunks(files: Sequence[str], chunk_size: int) -> Iterator[List[Tuple[int, str]]]:
+    for start in range(0, len(files), chunk_size):
+        yield list(enumerate(files[start:start + chunk_size], start=start))
+
+
+def _directory_chunks(files: Sequence[str]) -> Iterator[List[Tuple[int, str]]]:
+    """
+    Пачка на каталог. Удаление всплесков сравнивает спектр с повторами из того же
+    вызова конвейера, поэтому повторами считаются файлы одного каталога — тогда
+    результат не зависит от --chunk-size и числа воркеров.
+    """
+    groups: Dict[str, List[Tuple[int, str]]] = {}
+    for index, relative_path in enumerate(files):
+        groups.setdefault(os.path.dirname(relative_path), []).append((index, relative_path))
+    yield from groups.values()
+
+
+def run_batch(
+    input_dir: str,
+    output_dir: str,
+    params: Dict[str, Any],
+    export_format: str = "txt",
+    workers: Optional[int] = None,
+    patterns: Sequence[str] = DEFAULT_PATTERNS,
+    chunk_size: int = 32,
+) -> Dict[str, Any]:
+    """
+    Обрабатывает все подходящие файлы input_dir и пишет результаты в output_dir.
+    :return: сводка (число файлов, ошибок, время)
+    """
+    if export_format not in TEXT_FORMATS and export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат экспорта: {export_format}")
+    if chunk_size <= 0:
+        raise ValueError("chunk_size должен быть положительным")
+
+    # Прореживание для графика в пакетном режиме не нужно
+    params = {name: value for name, value in params.items() if name != "display_width"}
+    files = find_spectral_files(input_dir, patterns)
+    os.makedirs(output_dir, exist_ok=True)
+    workers = max(1, workers or os.cpu_count() or 1)
+    options = {"input_dir": input_dir, "output_dir": output_dir, "params": params, "format": export_format}
+
+    started = time.monotonic()
+    done = 0
+    failed: List[Dict[str, Any]] = []
+    peaks_rows: List[str] = []
+    matrix_results: List[Dict[str, Any]] = []
+    # Моменты объединяются в порядке пачек, чтобы результат не зависел от порядка завершения воркеров
+    moments_by_chunk: List[Tuple[int, List[Any]]] = []
+    archive = None
+    if export_format == "zip":
+        archive = zipfile.ZipFile(os.path.join(output_dir, "processed_spectra.zip"), "w", zipfile.ZIP_DEFLATED)
+
+    def collect(batch: Dict[str, Any]) -> None:
+        nonlocal done
+        for result in batch["results"]:
+            done += 1
+            if result["error"] is not None:
+                failed.append(result)
+                continue
+            for peak in result["peaks"]:
+                peaks_rows.append(f"{result['path']},{peak['order']},{peak['frequency']!r},{peak['amplitude']!r}\n")
+            if archive is not None:
+                archive.writestr(result["entry"], result.pop("content"))
+            elif export_format in EXPORT_FORMATS:
+                matrix_results.append(result)
+        if batch["moments"]:
+            moments_by_chunk.append((batch["start"], batch["moments"]))
+
+    chunks = _directory_chunks(files) if params.get("remove_spikes") else _chunks(files, chunk_size)
+    last_report = started
+    try:
+        if workers == 1:
+            _init_worker(options)
+            batches: Iterator[Dict[str, Any]] = (_process_files(chunk) for chunk in chunks)
+            for batch in batches:
+                collect(batch)
+        else:
+            with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(options,)) as pool:
+                for batch in pool.imap_unordered(_process_files, chunks):
+                    collect(batch)
+                    now = time.monotonic()
+                    if now - last_report >= 5:
+                        last_report = now
+                        logger.info("Обработано %d/%d файлов (%.1f файл/с)", done, len(files), done / (now - started))
+
+        if archive is not None:
+            archive.writestr(PROCESSED_METADATA_FILENAME, processing_metadata_text(params))
+    finally:
+        if archive is not None:
+            archive.close()
+
+    if export_format == "txt":
+        with open(os.path.join(output_dir, PROCESSED_METADATA_FILENAME), "w", encoding="utf-8") as handle:
+            handle.write(processing_metadata_text(params))
+
+    if matrix_results:
+        matrix_results.sort(key=lambda result: result["index"])
+        extension, _ = EXPORT_FORMATS[export_format]
+        content = export_spectra_matrix(
+            export_format,
+            [result["frequencies"] for result in matrix_results],
+            [result["amplitudes"] for result in matrix_results],
+            [result["path"] for result in matrix_results],
+            params,
+        )
+        with open(os.path.join(output_dir, f"processed_spectra{extension}"), "wb") as handle:
+            handle.write(content)
+
+    if peaks_rows:
+        with open(os.path.join(output_dir, PEAKS_FILENAME), "w", encoding="utf-8") as handle:
+            handle.write("file,order,frequency,amplitude\n")
+            handle.writelines(sorted(peaks_rows))
+
+    mean = MeanAccumulator()
+    for _, chunk_moments in sorted(moments_by_chunk, key=lambda item: item[0]):
+        for moments in chunk_moments:
+            mean.add(*moments)
+    if mean.mismatched:
+        logger.warning("Сетки частот спектров различаются: средний спектр не рассчитан")
+    elif mean.count:
+        with open(os.path.join(output_dir, MEAN_SPECTRUM_FILENAME), "w", encoding="utf-8") as handle:
+            handle.writelines(iter_mean_spectrum_csv(mean.grid, mean.mean, params))
+
+    if failed:
+        failed.sort(key=lambda result: result["index"])
+        with open(os.path.join(output_dir, FAILED_FILENAME), "w", encoding="utf-8") as handle:
+            handle.writelines(f"{result['path']}\t{result['error']}\n" for result in failed)
+
+    return {
+        "files": len(files),
+        "processed": len(files) - len(failed),
+        "failed": len(failed),
+        "seconds": round(time.monotonic() - started, 3),
+    }
+
+
+def load_preset(path: Optional[str]) -> Dict[str, Any]:
+    if not path:
+        return {}
+    with open(path, "r", encoding="utf-8") as handle:
+        return preset_to_params(json.load(handle))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Пакетная обработка спектральных файлов")
+    parser.add_argument("input_dir", help="каталог с файлами спектров (обходится рекурсивно)")
+    parser.add_argument("-o", "--output", required=True, help="каталог для результатов")
+    parser.add_argument("--preset", help="JSON пресета (ответ GET /presets/{slot} или словарь параметров)")
+    parser.add_argument(
+        "--format",
+        default="txt",
+        choices=list(TEXT_FORMATS) + list(EXPORT_FORMATS),
+        help="txt — файл на спектр, zip — архив как у /export_processed_data, npz/hdf5/parquet — одна матрица",
+    )
+    parser.add_argument("--workers", type=int, default=None, help="число процессов (по умолчанию — число ядер)")
+    parser.add_argument("--pattern", action="append", help="шаблон имён файлов, можно несколько раз")
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=32,
+        help="файлов в одной задаче воркера (при remove_spikes задача — весь каталог: его файлы считаются повторами)",
+    )
+    return parser
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    if not os.path.isdir(args.input_dir):
+        logger.error("Каталог не найден: %s", args.input_dir)
+        return 2
+    try:
+        params = load_preset(args.preset)
+    except (OSError, ValueError) as exc:
+        logger.error("Не удалось прочитать пресет: %s", exc)
+        return 2
+
+    summary = run_batch(
+        args.input_dir,
+        args.output,
+        params,
+        export_format=args.format,
+        workers=args.workers,
+        patterns=args.pattern or DEFAULT_PATTERNS,
+        chunk_size=args.chunk_size,
+    )
+    logger.info(
+        "Готово: %d файлов, обработано %d, с ошибками %d за %.1f с",
+        summary["files"], summary["processed"], summary["failed"], summary["seconds"],
+    )
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,432 @@
+from __future__ import annotations
+
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy.cluster.hierarchy import fcluster, leaves_list, linkage
+
+from data_processing import ArrayLike
+
+
+# Выше этого размера (min(n_samples, n_features)) PCA по умолчанию считается рандомизированным SVD
+RANDOMIZED_SVD_MIN_SIZE = 500
+
+DISTANCE_METRICS = ("pearson", "cosine", "euclidean")
+LINKAGE_METHODS = ("average", "complete", "single", "ward")
+# Ограничение на размер блока строк матрицы сходства (n_block × n_spectra × float32)
+SIMILARITY_BLOCK_BYTES = 64 * 1024 * 1024
+
+
+def common_grid_matrix(
+    frequencies_list: Sequence[ArrayLike],
+    amplitudes_list: Sequence[ArrayLike],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Собирает спектры в матрицу (n_spectra × n_points) на общей сетке.
+    Если сетки всех спектров совпадают, данные берутся как есть; иначе спектры
+    интерполируются на равномерную сетку по общему для всех диапазону.
+    :return: кортеж (сетка, матрица)
+    """
+    if len(frequencies_list) != len(amplitudes_list):
+        raise ValueError("Число массивов частот и амплитуд не совпадает")
+    if not amplitudes_list:
+        raise ValueError("Нет спектров для анализа")
+
+    freq_arrays = [np.asarray(freq, dtype=np.float64) for freq in frequencies_list]
+    amp_arrays = [np.asarray(ampl, dtype=np.float64) for ampl in amplitudes_list]
+    if any(freq.size != ampl.size or freq.size < 2 for freq, ampl in zip(freq_arrays, amp_arrays)):
+        raise ValueError("Массивы частот и амплитуд пусты или имеют разную длину")
+
+    first = freq_arrays[0]
+    if all(freq.size == first.size and np.array_equal(freq, first) for freq in freq_arrays):
+        return first, np.vstack(amp_arrays)
+
+    low = max(float(freq.min()) for freq in freq_arrays)
+    high = min(float(freq.max()) for freq in freq_arrays)
+    if high <= low:
+        raise ValueError("Диапазоны частот спектров не пересекаются")
+
+    grid = np.linspace(low, high, max(freq.size for freq in freq_arrays))
+    matrix = np.empty((len(amp_arrays), grid.size))
+    for row, (freq, ampl) in enumerate(zip(freq_arrays, amp_arrays)):
+        order = np.argsort(freq, kind="stable")
+        matrix[row] = np.interp(grid, freq[order], ampl[order])
+    return grid, matrix
+
+
+def _flip_signs(u: np.ndarray, vt: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Детерминированные знаки компонент: наибольший по модулю элемент нагрузки положителен."""
+    signs = np.sign(vt[np.arange(vt.shape[0]), np.argmax(np.abs(vt), axis=1)])
+    signs[signs == 0] = 1.0
+    return u * signs, vt * signs[:, None]
+
+
+def randomized_svd(
+    matrix: np.ndarray,
+    n_components: int,
+    n_oversamples: int = 10,
+    n_iter: int = 4,
+    random_state: Optional[int] = 0,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Усечённое SVD рандомизированным методом (Halko, Martinsson, Tropp).
+    Стоимость O(n·p·k) вместо O(n·p·min(n, p)) у полного разложения.
+    :return: кортеж (U, s, Vt) для первых n_components компонент
+    """
+    n_samples, n_features = matrix.shape
+    rank = min(n_components + n_oversamples, n_samples, n_features)
+    rng = np.random.default_rng(random_state)
+
+    basis = matrix @ rng.standard_normal((n_features, rank))
+    # Степенные итерации с ортогонализацией уточняют базис при медленно убывающем спектре
+    for _ in range(n_iter):
+        basis, _ = np.linalg.qr(basis)
+        basis, _ = np.linalg.qr(matrix.T @ basis)
+        basis = matrix @ basis
+    basis, _ = np.linalg.qr(basis)
+
+    u_small, s, vt = np.linalg.svd(basis.T @ matrix, full_matrices=False)
+    u = basis @ u_small
+    return u[:, :n_components], s[:n_components], vt[:n_components]
+
+
+def _center_scale(matrix: np.ndarray, center: bool, scale: bool) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    mean = matrix.mean(axis=0) if center else np.zeros(matrix.shape[1])
+    std = matrix.std(axis=0, ddof=1) if scale and matrix.shape[0] > 1 else np.ones(matrix.shape[1])
+    std = np.where(std > 0, std, 1.0)
+    return (matrix - mean) / std, mean, std
+
+
+def pca(
+    matrix: ArrayLike,
+    n_components: int = 3,
+    center: bool = True,
+    scale: bool = False,
+    method: str = "auto",
+    random_state: Optional[int] = 0,
+) -> Dict[str, Any]:
+    """
+    Метод главных компонент.
+    :param method: 'full' — полное SVD, 'randomized' — рандомизированное усечённое,
+                   'auto' — рандомизированное для больших матриц
+    :return: scores (n_samples × k), loadings (k × n_features), доли объяснённой дисперсии
+    """
+    data = np.asarray(matrix, dtype=np.float64)
+    if data.ndim != 2 or data.shape[0] < 2:
+        raise ValueError("Для PCA нужно минимум два спектра")
+    n_components = min(int(n_components), *data.shape)
+    if n_components <= 0:
+        raise ValueError("n_components должен быть положительным")
+    if method not in ("auto", "full", "randomized"):
+        raise ValueError(f"Неизвестный метод PCA: {method}")
+
+    prepared, mean, std = _center_scale(data, center, scale)
+    if method == "auto":
+        small = min(data.shape) <= RANDOMIZED_SVD_MIN_SIZE or n_components > 0.5 * min(data.shape)
+        method = "full" if small else "randomized"
+
+    if method == "full":
+        u, s, vt = np.linalg.svd(prepared, full_matrices=False)
+        u, s, vt = u[:, :n_components], s[:n_components], vt[:n_components]
+    else:
+        u, s, vt = randomized_svd(prepared, n_components, random_state=random_state)
+    u, vt = _flip_signs(u, vt)
+
+    denominator = max(data.shape[0] - 1, 1)
+    explained_variance = s ** 2 / denominator
+    total_variance = float(np.einsum("ij,ij->", prepared, prepared)) / denominator
+    ratio = explained_variance / total_variance if total_variance > 0 else np.zeros_like(explained_variance)
+
+    return {
+        "scores": u * s,
+        "loadings": vt,
+        "explained_variance": explained_variance,
+        "explained_variance_ratio": ratio,
+        "mean": mean,
+        "scale": std,
+        "method": method,
+    }
+
+
+def _one_hot(labels: Sequence[Any]) -> Tuple[np.ndarray, np.ndarray]:
+    classes, codes = np.unique(np.asarray([str(label) for label in labels]), return_inverse=True)
+    return classes, np.eye(classes.size)[codes]
+
+
+def _simpls(x: np.ndarray, y: np.ndarray, n_components: int) -> Dict[str, np.ndarray]:
+    """
+    PLS2 алгоритмом SIMPLS (de Jong, 1993) по центрированным x и y.
+    Каждая компонента — ведущий сингулярный вектор матрицы ковариаций X'Y
+    размера n_features × n_classes, поэтому итераций NIPALS не требуется.
+    """
+    n_features = x.shape[1]
+    weights = np.zeros((n_features, n_components))
+    x_loadings = np.zeros((n_features, n_components))
+    y_loadings = np.zeros((y.shape[1], n_components))
+    scores = np.zeros((x.shape[0], n_components))
+    basis = np.zeros((n_features, n_components))
+    covariance = x.T @ y
+
+    for component in range(n_components):
+        u, _, _ = np.linalg.svd(covariance, full_matrices=False)
+        r = u[:, 0]
+        t = x @ r
+        tt = float(t @ t)
+        if tt <= 0:
+            n_components = component
+            break
+        p = x.T @ t / tt
+        v = p - basis[:, :component] @ (basis[:, :component].T @ p)
+        v /= np.linalg.norm(v)
+        covariance -= np.outer(v, v @ covariance)
+
+        weights[:, component] = r
+        scores[:, component] = t
+        x_loadings[:, component] = p
+        y_loadings[:, component] = y.T @ t / tt
+        basis[:, component] = v
+
+    return {
+        "weights": weights[:, :n_components],
+        "scores": scores[:, :n_components],
+        "x_loadings": x_loadings[:, :n_components],
+        "y_loadings": y_loadings[:, :n_components],
+    }
+
+
+def _cumulative_predictions(x: np.ndarray, model: Dict[str, np.ndarray]) -> np.ndarray:
+    """Предсказания Y для 1..k компонент сразу: массив (k, n_samples, n_classes)."""
+    scores = x @ model["weights"]
+    contributions = scores.T[:, :, None] * model["y_loadings"].T[:, None, :]
+    return np.cumsum(contributions, axis=0)
+
+
+def _vip(model: Dict[str, np.ndarray]) -> np.ndarray:
+    """Variable Importance in Projection для каждой точки спектра."""
+    weights = model["weights"]
+    explained = np.einsum("ij,ij->j", model["scores"], model["scores"]) * np.einsum(
+        "ij,ij->j", model["y_loadings"], model["y_loadings"]
+    )
+    total = float(explained.sum())
+    if total <= 0:
+        return np.zeros(weights.shape[0])
+    normalized = weights / np.linalg.norm(weights, axis=0)
+    return np.sqrt(weights.shape[0] * (normalized ** 2 @ explained) / total)
+
+
+def _stratified_folds(codes: np.ndarray, n_folds: int, random_state: Optional[int]) -> np.ndarray:
+    """Номер фолда для каждого образца; классы распределяются по фолдам равномерно."""
+    rng = np.random.default_rng(random_state)
+    folds = np.empty(codes.size, dtype=np.int64)
+    for code in np.unique(codes):
+        members = rng.permutation(np.flatnonzero(codes == code))
+        folds[members] = np.arange(members.size) % n_folds
+    return folds
+
+
+def plsda(
+    matrix: ArrayLike,
+    labels: Sequence[Any],
+    n_components: int = 2,
+    scale: bool = False,
+    cv_folds: int = 5,
+    random_state: Optional[int] = 0,
+) -> Dict[str, Any]:
+    """
+    PLS-DA: PLS-регрессия на one-hot кодировку классов, класс — argmax предсказания.
+    Кросс-валидация стратифицированная, точность считается сразу для 1..n_components компонент.
+    :return: scores, loadings, VIP, точность кросс-валидации и матрица ошибок
+    """
+    data = np.asarray(matrix, dtype=np.float64)
+    if data.ndim != 2 or data.shape[0] != len(labels):
+        raise ValueError("Число меток не совпадает с числом спектров")
+    classes, y = _one_hot(labels)
+    if classes.size < 2:
+        raise ValueError("Для PLS-DA нужно минимум два класса")
+    n_components = min(int(n_components), data.shape[0] - 1, data.shape[1])
+    if n_components <= 0:
+        raise ValueError("n_components должен быть положительным")
+
+    codes = np.argmax(y, axis=1)
+    x, x_mean, x_std = _center_scale(data, True, scale)
+    y_mean = y.mean(axis=0)
+    model = _simpls(x, y - y_mean, n_components)
+    n_components = model["weights"].shape[1]
+
+    result: Dict[str, Any] = {
+        "classes": classes.tolist(),
+        "n_components": n_components,
+        "scores": model["scores"],
+        "loadings": model["x_loadings"].T,
+        "vip": _vip(model),
+        "coefficients": (model["weights"] @ model["y_loadings"].T).T,
+        "cv": None,
+    }
+
+    smallest_class = int(np.bincount(codes).min())
+    n_folds = min(int(cv_folds), smallest_class)
+    if n_folds >= 2:
+        folds = _stratified_folds(codes, n_folds, random_state)
+        predicted = np.empty((n_components, codes.size), dtype=np.int64)
+        for fold in range(n_folds):
+            test = folds == fold
+            train = ~test
+            x_train, train_mean, train_std = _center_scale(data[train], True, scale)
+            y_train_mean = y[train].mean(axis=0)
+            fold_model = _simpls(x_train, y[train] - y_train_mean, n_components)
+            x_test = (data[test] - train_mean) / train_std
+            fold_predictions = _cumulative_predictions(x_test, fold_model) + y_train_mean
+            available = fold_predictions.shape[0]
+            predicted[:available, test] = np.argmax(fold_predictions, axis=2)
+            # Если на фолде удалось построить меньше компонент, используем последнюю доступную
+            predicted[available:, test] = predicted[available - 1, test]
+
+        accuracy = (predicted == codes).mean(axis=1)
+        best = int(np.argmax(accuracy))
+        confusion = np.zeros((classes.size, classes.size), dtype=np.int64)
+        np.add.at(confusion, (codes, predicted[best]), 1)
+        result["cv"] = {
+            "folds": n_folds,
+            "accuracy": accuracy,
+            "optimal_components": best + 1,
+            "confusion_matrix": confusion,
+        }
+
+    return result
+
+
+def _prepare_rows(matrix: np.ndarray, metric: str) -> np.ndarray:
+    """
+    Подготавливает строки так, чтобы скалярное произведение давало корреляцию
+    Пирсона или косинусное сходство; для евклидова расстояния строки не меняются.
+    """
+    rows = np.asarray(matrix, dtype=np.float64)
+    if metric == "euclidean":
+        return np.ascontiguousarray(rows, dtype=np.float32)
+    if metric == "pearson":
+        rows = rows - rows.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(rows, axis=1, keepdims=True)
+    rows = np.where(norms > 0, rows / np.where(norms > 0, norms, 1.0), 0.0)
+    return np.ascontiguousarray(rows, dtype=np.float32)
+
+
+def distance_blocks(
+    matrix: ArrayLike,
+    metric: str = "pearson",
+    block_bytes: int = SIMILARITY_BLOCK_BYTES,
+) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    Матрица попарных расстояний по блокам строк: (начальная строка, блок n_block × n).
+    Каждый блок — одно матричное произведение BLAS; для корреляции и косинуса
+    расстояние равно 1 − сходство. Память ограничена размером одного блока.
+    """
+    if metric not in DISTANCE_METRICS:
+        raise ValueError(f"Неизвестная метрика: {metric}")
+
+    rows = _prepare_rows(np.asarray(matrix), metric)
+    n_spectra = rows.shape[0]
+    block_rows = max(1, min(n_spectra, block_bytes // max(n_spectra * 4, 1)))
+    squared_norms = np.einsum("ij,ij->i", rows, rows) if metric == "euclidean" else None
+
+    for start in range(0, n_spectra, block_rows):
+        block = rows[start:start + block_rows] @ rows.T
+        if squared_norms is None:
+            np.subtract(1.0, block, out=block)
+        else:
+            block *= -2.0
+            block += squared_norms[start:start + block_rows, None]
+            block += squared_norms[None, :]
+            np.sqrt(np.maximum(block, 0.0, out=block), out=block)
+        np.maximum(block, 0.0, out=block)
+        # Расстояние спектра до самого себя — точно ноль, без ошибок округления float32
+        block[np.arange(block.shape[0]), np.arange(start, start + block.shape[0])] = 0.0
+        yield start, block
+
+
+def cluster_spectra(
+    matrix: ArrayLike,
+    metric: str = "pearson",
+    method: str = "average",
+    n_clusters: Optional[int] = None,
+    distance_threshold: Optional[float] = None,
+    outlier_threshold: float = 3.5,
+    include_matrix: bool = False,
+) -> Dict[str, Any]:
+    """
+    Попарные расстояния, иерархическая кластеризация и поиск выбросов.
+    Выброс — спектр, у которого медианное расстояние до остальных аномально велико
+    (модифицированный z-score по медиане и MAD больше outlier_threshold).
+    :return: порядок листьев дендрограммы, linkage, кластеры, оценки выбросов
+    """
+    data = np.asarray(matrix, dtype=np.float64)
+    n_spectra = data.shape[0]
+    if data.ndim != 2 or n_spectra < 3:
+        raise ValueError("Для кластеризации нужно минимум три спектра")
+    if method not in LINKAGE_METHODS:
+        raise ValueError(f"Неизвестный метод кластеризации: {method}")
+    if method == "ward" and metric != "euclidean":
+        raise ValueError("Метод ward применим только с евклидовым расстоянием")
+
+    condensed = np.empty(n_spectra * (n_spectra - 1) // 2)
+    typical_distance = np.empty(n_spectra)
+    full_matrix = np.empty((n_spectra, n_spectra), dtype=np.float32) if include_matrix else None
+
+    for start, block in distance_blocks(data, metric):
+        stop = start + block.shape[0]
+        if full_matrix is not None:
+            full_matrix[start:stop] = block
+        for offset, row in enumerate(block):
+            i = start + offset
+            position = i * n_spectra - i * (i + 1) // 2
+            condensed[position:position + n_spectra - i - 1] = row[i + 1:]
+        # Медиана по строке без диагонали: диагональ (ноль) заменяется на NaN
+        block[np.arange(block.shape[0]), np.arange(start, stop)] = np.nan
+        typical_distance[start:stop] = np.nanmedian(block, axis=1)
+
+    tree = linkage(condensed, method=method)
+    clusters = None
+    if n_clusters is not None:
+        clusters = fcluster(tree, t=int(n_clusters), criterion="maxclust")
+    elif distance_threshold is not None:
+        clusters = fcluster(tree, t=float(distance_threshold), criterion="distance")
+
+    center = float(np.median(typical_distance))
+    mad = float(np.median(np.abs(typical_distance - center)))
+    if mad > 0:
+        outlier_scores = 0.6745 * (typical_distance - center) / mad
+    else:
+        outlier_scores = np.zeros(n_spectra)
+
+    return {
+        "metric": metric,
+        "method": method,
+        "order": leaves_list(tree),
+        "linkage": tree,
+        "clusters": clusters,
+        "median_distance": typical_distance,
+        "outlier_scores": outlier_scores,
+        "outliers": np.flatnonzero(outlier_scores > outlier_threshold),
+        "matrix": full_matrix,
+    }
+
+
+def to_serializable(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Переводит numpy-массивы результата в списки для JSON."""
+    serializable: Dict[str, Any] = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            serializable[key] = to_serializable(value)
+        elif isinstance(value, np.ndarray):
+            serializable[key] = value.tolist()
+        elif isinstance(value, np.generic):
+            serializable[key] = value.item()
+        else:
+            serializable[key] = value
+    return serializable
+
+
+def class_means(scores: np.ndarray, labels: Sequence[Any]) -> Dict[str, List[float]]:
+    """Центроиды классов в пространстве scores (для подписи групп на графике)."""
+    classes, y = _one_hot(labels)
+    centroids = (y.T @ scores) / y.sum(axis=0)[:, None]
+    return {str(name): centroid.tolist() for name, centroid in zip(classes, centroids)}
@@ -1,16 +1,23 @@
 from __future__ import annotations
 
+import logging
 import re
-from typing import List, Tuple, Sequence, Union, Dict, Any
+from functools import lru_cache
+from math import factorial
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
 
 import numpy as np
-from scipy.signal import savgol_filter, find_peaks
-from scipy.sparse.linalg import spsolve
+from scipy.linalg import solveh_banded
+from scipy.ndimage import convolve1d, uniform_filter1d
+from scipy.signal import find_peaks, savgol_coeffs
+from scipy.special import expit
 from scipy import sparse
 
 
 ArrayLike = Union[np.ndarray, Sequence[float]]
 
+logger = logging.getLogger(__name__)
+
 
 def calculate_boxplot_stats(amplitudes_list: Sequence[Sequence[float]]) -> List[Dict[str, Any]]:
     """
@@ -158,6 +165,19 @@ def _parse_numeric_pairs_generic(content: str) -> Tuple[List[float], List[float]
     return frequencies, amplitudes
 
 
+SPECTRAL_FILE_ENCODINGS = ("utf-8", "cp1251", "latin-1")
+
+
+def decode_spectral_bytes(raw_content: bytes) -> str:
+    """Декодирует содержимое текстового файла спектра, перебирая поддерживаемые кодировки."""
+    for encoding in SPECTRAL_FILE_ENCODINGS:
+        try:
+            return raw_content.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    raise ValueError("Не удалось декодировать файл: поддерживаются только текстовые файлы")
+
+
 def parse_any_spectral_file(content: str) -> Tuple[List[float], List[float]]:
     parsers = (parse_csv_file, parse_txt_file, parse_esp_file)
     last_error: Exception | None = None
@@ -178,6 +198,100 @@ def parse_any_spectral_file(content: str) -> Tuple[List[float], List[float]]:
     raise ValueError(str(last_error) if last_error else 'Не удалось распарсить спектральный файл')
 
 
+BASELINE_METHODS = ("als", "arpls", "airpls")
+# Кандидаты lam для автоматического подбора: 1e2 … 1e8 с шагом 10^0.5
+BASELINE_LAM_GRID: Tuple[float, ...] = tuple(float(10 ** (power / 2)) for power in range(4, 17))
+# Доля длины спектра, на которую он продлевается с каждой стороны при подборе lam
+BASELINE_EXTENSION_FRACTION = 0.1
+
+
+def _solve_weighted(amplitudes: np.ndarray, weights: np.ndarray, lam: float) -> np.ndarray:
+    """Взвешенное сглаживание Уиттекера (W + lam·D'D) z = W·y со штрафом вторых разностей."""
+    system = lam * difference_penalty_banded(amplitudes.size, 2)
+    system[2] += weights
+    return solveh_banded(system, weights * amplitudes, check_finite=False)
+
+
+def _check_baseline_input(amplitudes: ArrayLike, lam: float) -> np.ndarray:
+    if lam <= 0:
+        raise ValueError("Параметр lam должен быть положительным")
+    amplitudes = np.asarray(amplitudes, dtype=float)
+    if amplitudes.size == 0:
+        raise ValueError("Массив амплитуд пуст")
+    if amplitudes.size < 3:
+        raise ValueError("Для базовой линии нужно не меньше трёх точек")
+    return amplitudes
+
+
+def _fit_als(
+    amplitudes: np.ndarray, lam: float, p: float, niter: int = 10, weights: Optional[np.ndarray] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    if not (0 < p < 1):
+        raise ValueError("p должен быть в пределах (0, 1)")
+    weights = np.ones(amplitudes.size) if weights is None else weights
+    for _ in range(niter):
+        used = weights
+        baseline = _solve_weighted(amplitudes, used, lam)
+        weights = p * (amplitudes > baseline) + (1 - p) * (amplitudes < baseline)
+        # Веса не изменились — следующие итерации дали бы то же решение
+        if np.array_equal(weights, used):
+            break
+    return baseline, used
+
+
+def _fit_arpls(
+    amplitudes: np.ndarray, lam: float, ratio: float = 1e-6, max_iter: int = 50, weights: Optional[np.ndarray] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """arPLS (Baek et al., 2015): логистические веса по статистике отрицательных остатков."""
+    weights = np.ones(amplitudes.size) if weights is None else weights
+    for _ in range(max_iter):
+        baseline = _solve_weighted(amplitudes, weights, lam)
+        residual = amplitudes - baseline
+        negative = residual[residual < 0]
+        if negative.size < 2 or negative.std() == 0:
+            break
+        mean, std = negative.mean(), negative.std()
+        new_weights = expit(-2 * (residual - (2 * std - mean)) / std)
+        converged = np.linalg.norm(weights - new_weights) / np.linalg.norm(weights) < ratio
+        if converged:
+            break
+        weights = new_weights
+    return baseline, weights
+
+
+def _fit_airpls(amplitudes: np.ndarray, lam: float, max_iter: int = 15) -> Tuple[np.ndarray, np.ndarray]:
+    """airPLS (Zhang et al., 2010): точки выше базовой линии исключаются, веса остальных растут с итерацией."""
+    weights = np.ones(amplitudes.size)
+    threshold = 1e-3 * np.abs(amplitudes).sum()
+    for iteration in range(1, max_iter + 1):
+        baseline = _solve_weighted(amplitudes, weights, lam)
+        residual = amplitudes - baseline
+        negative = residual < 0
+        total_negative = np.abs(residual[negative].sum())
+        if total_negative < threshold or iteration == max_iter:
+            break
+        weights = np.zeros(amplitudes.size)
+        weights[negative] = np.exp(iteration * np.abs(residual[negative]) / total_negative)
+        weights[0] = weights[-1] = np.exp(iteration * residual[negative].max() / total_negative)
+    return baseline, weights
+
+
+def _fit_baseline(
+    amplitudes: np.ndarray, method: str, lam: float, p: float, weights: Optional[np.ndarray] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Базовая линия и веса последнего решения системы.
+    weights — начальные веса (ALS, arPLS), например с соседнего lam при подборе.
+    """
+    if method == "als":
+        return _fit_als(amplitudes, lam, p, weights=weights)
+    if method == "arpls":
+        return _fit_arpls(amplitudes, lam, weights=weights)
+    if method == "airpls":
+        return _fit_airpls(amplitudes, lam)
+    raise ValueError(f"Неизвестный метод базовой линии: {method}")
+
+
 def baseline_als(amplitudes: ArrayLike, lam: float, p: float, niter: int = 10) -> np.ndarray:
     """
     Оценка базовой линии методом ALS.
@@ -185,26 +299,79 @@ def baseline_als(amplitudes: ArrayLike, lam: float, p: float, niter: int = 10) -
     - p: асимметрия (0 < p < 1)
     - niter: число итераций
     """
-    if lam <= 0:
-        raise ValueError("Параметр lam должен быть положительным")
-    if not (0 < p < 1):
-        raise ValueError("p должен быть в пределах (0, 1)")
+    amplitudes = _check_baseline_input(amplitudes, lam)
+    return _fit_als(amplitudes, lam, p, niter)[0]
 
-    if not isinstance(amplitudes, np.ndarray):
-        amplitudes = np.array(amplitudes)
 
-    if amplitudes.size == 0:
-        raise ValueError("Массив амплитуд пуст")
+def estimate_baseline(amplitudes: ArrayLike, method: str = "als", lam: float = 1000, p: float = 0.001) -> np.ndarray:
+    """
+    Базовая линия выбранным методом: 'als', 'arpls' или 'airpls'.
+    Каждая итерация — решение ленточной системы за O(n); p используется только в ALS.
+    """
+    amplitudes = _check_baseline_input(amplitudes, lam)
+    return _fit_baseline(amplitudes, method, lam, p)[0]
 
-    L = len(amplitudes)
-    D = sparse.diags([1, -2, 1], [0, -1, -2], shape=(L, L - 2))
-    w = np.ones(L)
-    for _ in range(niter):
-        W = sparse.spdiags(w, 0, L, L)
-        Z = W + lam * D.dot(D.transpose())
-        z = spsolve(Z, w * amplitudes)
-        w = p * (amplitudes > z) + (1 - p) * (amplitudes < z)
-    return z  # type: ignore[name-defined]
+
+def _extend_with_known_baseline(amplitudes: np.ndarray, fraction: float) -> Tuple[np.ndarray, np.ndarray, int]:
+    """
+    Продлевает спектр с обеих сторон известной базовой линией — прямой, подогнанной
+    к краю спектра, — и добавляет на ней гауссов пик высотой с размах спектра.
+    Длина продления не больше длины спектра: по ней же подгоняются прямые у краёв.
+    :return: (продлённый спектр, известная базовая линия продлений [слева, справа], длина продления)
+    """
+    width = min(max(int(fraction * amplitudes.size), 10), amplitudes.size)
+    positions = np.arange(width, dtype=float)
+    left = np.polyval(np.polyfit(positions, amplitudes[:width], 1), positions - width)
+    right = np.polyval(np.polyfit(positions, amplitudes[-width:], 1), positions + width)
+    height = np.ptp(amplitudes) or 1.0
+    peak = height * np.exp(-0.5 * ((positions - width / 2) / (width / 8)) ** 2)
+    extended = np.concatenate([left + peak, amplitudes, right + peak])
+    return extended, np.concatenate([left, right]), width
+
+
+def select_baseline_lam(
+    amplitudes_list: Sequence[ArrayLike],
+    method: str = "als",
+    p: float = 0.001,
+    lam_grid: Sequence[float] = BASELINE_LAM_GRID,
+) -> Tuple[List[np.ndarray], List[float]]:
+    """
+    Базовые линии с автоматическим выбором lam для каждого спектра.
+    Спектр продлевается участками с известной базовой линией и пиком на ней
+    (см. _extend_with_known_baseline); выбирается lam, при котором базовая линия
+    продлённого спектра точнее всего восстанавливает известную на продлениях.
+    Штрафная матрица D'D одна для всех кандидатов (кэш difference_penalty_banded),
+    а итерации каждого кандидата начинаются с весов предыдущего.
+    Если выбран крайний lam сетки, оптимум может лежать за её пределами — это
+    пишется в лог как предупреждение.
+    :return: (базовые линии исходных спектров, выбранные lam) в исходном порядке
+    """
+    if not lam_grid:
+        raise ValueError("Список кандидатов lam пуст")
+    if method not in BASELINE_METHODS:
+        raise ValueError(f"Неизвестный метод базовой линии: {method}")
+
+    grid_edges = (float(min(lam_grid)), float(max(lam_grid)))
+    baselines: List[np.ndarray] = []
+    selected: List[float] = []
+    for index, amplitudes in enumerate(amplitudes_list):
+        amplitudes = _check_baseline_input(amplitudes, lam_grid[0])
+        extended, known, width = _extend_with_known_baseline(amplitudes, BASELINE_EXTENSION_FRACTION)
+        best_error, best_lam = np.inf, float(lam_grid[0])
+        weights = None
+        for lam in sorted(lam_grid):
+            fitted, weights = _fit_baseline(extended, method, lam, p, weights)
+            error = np.mean((np.concatenate([fitted[:width], fitted[-width:]]) - known) ** 2)
+            if error < best_error:
+                best_error, best_lam = error, float(lam)
+        if len(lam_grid) > 1 and best_lam in grid_edges:
+            logger.warning(
+                "Спектр %d (%s): выбран крайний lam=%g из сетки [%g, %g], оптимум может быть за её пределами",
+                index, method, best_lam, grid_edges[0], grid_edges[1],
+            )
+        baselines.append(_fit_baseline(amplitudes, method, best_lam, p)[0])
+        selected.append(best_lam)
+    return baselines, selected
 
 
 def smooth_signal(amplitudes: ArrayLike, window_length: int, polyorder: int) -> np.ndarray:
@@ -221,7 +388,7 @@ def smooth_signal(amplitudes: ArrayLike, window_length: int, polyorder: int) ->
     if polyorder >= window_length:
         raise ValueError("Порядок полинома должен быть меньше длины окна")
 
-    return savgol_filter(amplitudes, window_length, polyorder)
+    return smooth_signals(amplitudes[np.newaxis, :], window_length, polyorder)[0]
 
 
 def normalize_snv(amplitudes: ArrayLike) -> np.ndarray:
@@ -297,16 +464,77 @@ def calculate_mean_std(amplitudes_list: Sequence[Sequence[float]]) -> Tuple[np.n
     return mean_amplitude, std_amplitude
 
 
+def iter_formatted_rows(
+    columns: Sequence[ArrayLike],
+    row_format: str,
+    chunk_rows: int = 65536,
+) -> Iterator[str]:
+    """
+    Форматирует столбцы в текст блоками по chunk_rows строк.
+    Каждый блок форматируется одним вызовом оператора % вместо цикла по строкам.
+    Числа всё равно переводятся в текст по одному (через tolist) — это сделано намеренно:
+    экспорты используют '%r', кратчайшее представление Python float, как прежние f-строки,
+    и вывод совпадает с прежним байт в байт. np.savetxt здесь не подходит: он тоже форматирует
+    каждую строку оператором % в цикле Python, а '%r' для np.float64 даёт 'np.float64(...)'.
+    :param columns: столбцы одинаковой длины
+    :param row_format: формат одной строки, например '%.2f\t%.6f\n'
+    """
+    arrays = [np.asarray(column, dtype=float) for column in columns]
+    if not arrays:
+        return
+    length = arrays[0].size
+    if any(array.size != length for array in arrays):
+        raise ValueError("Длины столбцов не совпадают")
+
+    matrix = np.column_stack(arrays)
+    for start in range(0, length, chunk_rows):
+        block = matrix[start:start + chunk_rows]
+        yield (row_format * block.shape[0]) % tuple(block.ravel().tolist())
+
+
 def format_spectral_data(frequencies: Sequence[float], amplitudes: Sequence[float]) -> str:
     """Форматирует спектральные данные в табличный текст (freq\tampl)."""
     if len(frequencies) != len(amplitudes):
         raise ValueError("Длины массивов частот и амплитуд не совпадают")
 
-    lines: List[str] = []
-    for freq, ampl in zip(frequencies, amplitudes):
-        lines.append(f"{freq:.2f}\t{ampl:.6f}")
+    text = "".join(iter_formatted_rows([frequencies, amplitudes], "%.2f\t%.6f\n"))
+    return text[:-1]
 
-    return "\n".join(lines)
+
+def stack_spectra(
+    frequencies_list: Sequence[ArrayLike],
+    amplitudes_list: Sequence[ArrayLike],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Складывает набор спектров в одну матрицу (n_spectra × max_points).
+    Если у всех спектров одна сетка частот, она возвращается одномерным массивом,
+    иначе — матрицей той же формы, что и амплитуды. Короткие спектры дополняются NaN.
+    :return: кортеж (частоты, матрица амплитуд, длины спектров)
+    """
+    if len(frequencies_list) != len(amplitudes_list):
+        raise ValueError("Число массивов частот и амплитуд не совпадает")
+    if not amplitudes_list:
+        raise ValueError("Нет спектров для экспорта")
+
+    freq_arrays = [np.asarray(freq, dtype=np.float64) for freq in frequencies_list]
+    amp_arrays = [np.asarray(ampl, dtype=np.float64) for ampl in amplitudes_list]
+    lengths = np.array([array.size for array in amp_arrays], dtype=np.int64)
+    if any(freq.size != size for freq, size in zip(freq_arrays, lengths)):
+        raise ValueError("Длины массивов частот и амплитуд не совпадают")
+
+    n_points = int(lengths.max())
+    amplitudes = np.full((len(amp_arrays), n_points), np.nan)
+    for row, array in enumerate(amp_arrays):
+        amplitudes[row, :array.size] = array
+
+    first = freq_arrays[0]
+    if all(freq.size == first.size and np.array_equal(freq, first) for freq in freq_arrays):
+        return first, amplitudes, lengths
+
+    frequencies = np.full_like(amplitudes, np.nan)
+    for row, array in enumerate(freq_arrays):
+        frequencies[row, :array.size] = array
+    return frequencies, amplitudes, lengths
 
 
 def calculate_moving_average(amplitudes: ArrayLike, window_size: int) -> np.ndarray:
@@ -328,7 +556,420 @@ def calculate_moving_average(amplitudes: ArrayLike, window_size: int) -> np.ndar
     if window_size > len(amplitudes):
         raise ValueError("Размер окна не может превышать длину сигнала")
 
-    moving_avg = np.convolve(amplitudes, np.ones(window_size) / window_size, mode='same')
+    return moving_average_signals(amplitudes[np.newaxis, :], window_size)[0]
+
 
-    return moving_avg
+def _group_by_length(arrays: Sequence[ArrayLike]) -> Dict[int, List[int]]:
+    """Группирует позиции спектров по длине: спектры одной длины обрабатываются одной матрицей."""
+    groups: Dict[int, List[int]] = {}
+    for position, array in enumerate(arrays):
+        groups.setdefault(len(array), []).append(position)
+    return groups
+
+
+def apply_batched(
+    amplitudes_list: Sequence[ArrayLike],
+    func: Callable[..., np.ndarray],
+    frequencies_list: Union[Sequence[ArrayLike], None] = None,
+) -> List[np.ndarray]:
+    """
+    Применяет построчную функцию func к матрице (n_spectra × n_points)
+    для каждой группы спектров одинаковой длины.
+    Если передан frequencies_list, func получает вторым аргументом матрицу частот группы.
+    :return: список результатов в исходном порядке
+    """
+    result: List[np.ndarray] = [np.empty(0)] * len(amplitudes_list)
+    for members in _group_by_length(amplitudes_list).values():
+        matrix = np.array([np.asarray(amplitudes_list[pos], dtype=float) for pos in members])
+        if frequencies_list is None:
+            processed = func(matrix)
+        else:
+            processed = func(matrix, np.array([np.asarray(frequencies_list[pos], dtype=float) for pos in members]))
+        for position, row in zip(members, processed):
+            result[position] = row
+    return result
+
+
+@lru_cache(maxsize=32)
+def savgol_kernels(window_length: int, polyorder: int, deriv: int = 0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Коэффициенты фильтра Савицкого-Голея (кэшируются по window_length, polyorder, deriv).
+    :return: кортеж (ядро свёртки, матрица левого края, матрица правого края);
+             края считаются подгонкой полинома по первому/последнему окну, как mode='interp'
+    """
+    kernel = savgol_coeffs(window_length, polyorder, deriv=deriv)
+
+    positions = np.arange(window_length, dtype=float)
+    fit = np.linalg.pinv(np.vander(positions, polyorder + 1, increasing=True))
+    basis = np.zeros((window_length, polyorder + 1))
+    for power in range(deriv, polyorder + 1):
+        basis[:, power] = factorial(power) / factorial(power - deriv) * positions ** (power - deriv)
+    edge = basis @ fit
+
+    half = window_length // 2
+    left, right = edge[:half], edge[window_length - half:]
+    for array in (kernel, left, right):
+        array.setflags(write=False)
+    return kernel, left, right
+
+
+def smooth_signals(
+    amplitudes_matrix: ArrayLike,
+    window_length: int,
+    polyorder: int,
+    deriv: int = 0,
+    delta: float = 1.0,
+) -> np.ndarray:
+    """
+    Сглаживание по Савицкому-Голею сразу для матрицы спектров (по оси 1).
+    Результат совпадает с savgol_filter(..., mode='interp') для каждой строки.
+    - deriv: порядок производной (0 — сглаживание)
+    - delta: шаг сетки для производных
+    """
+    matrix = np.atleast_2d(np.asarray(amplitudes_matrix, dtype=float))
+
+    if matrix.shape[1] < window_length:
+        raise ValueError("Длина сигнала меньше длины окна фильтра")
+    if polyorder >= window_length:
+        raise ValueError("Порядок полинома должен быть меньше длины окна")
+
+    kernel, left, right = savgol_kernels(window_length, polyorder, deriv)
+    smoothed = convolve1d(matrix, kernel, axis=1, mode='constant')
+
+    half = left.shape[0]
+    if half:
+        smoothed[:, :half] = matrix[:, :window_length] @ left.T
+        smoothed[:, -half:] = matrix[:, -window_length:] @ right.T
+    if deriv:
+        smoothed /= delta ** deriv
+    return smoothed
+
+
+@lru_cache(maxsize=16)
+def difference_penalty_banded(n_points: int, order: int = 2) -> np.ndarray:
+    """
+    Штрафная матрица D'D разностей порядка order в верхней ленточной форме
+    scipy.linalg.solveh_banded: строка order - k содержит k-ю наддиагональ (кэшируется по n_points, order).
+    """
+    coefficients = np.diff(np.eye(order + 1), n=order, axis=0)[0]
+    D = sparse.diags(coefficients, np.arange(order + 1), shape=(n_points - order, n_points))
+    penalty = (D.T @ D).todia()
+    banded = np.zeros((order + 1, n_points))
+    for offset in range(order + 1):
+        banded[order - offset, offset:] = penalty.diagonal(offset)
+    banded.setflags(write=False)
+    return banded
+
+
+def whittaker_smooth_signals(amplitudes_matrix: ArrayLike, lam: float, order: int = 2) -> np.ndarray:
+    """
+    Сглаживание Уиттекера для матрицы спектров (по оси 1): решение (I + lam·D'D) z = y.
+    Матрица системы одна для всех строк, поэтому ленточное разложение Холецкого
+    выполняется один раз, а спектры решаются как столбцы правой части — O(n) на спектр.
+    - lam: сила сглаживания (>0)
+    - order: порядок разностей в штрафе
+    """
+    matrix = np.atleast_2d(np.asarray(amplitudes_matrix, dtype=float))
+
+    if lam <= 0:
+        raise ValueError("Параметр lam должен быть положительным")
+    if order < 1:
+        raise ValueError("Порядок разностей должен быть не меньше 1")
+    if matrix.shape[1] <= order:
+        raise ValueError("Длина сигнала должна превышать порядок разностей")
+
+    system = lam * difference_penalty_banded(matrix.shape[1], order)
+    system[order] += 1.0
+    return solveh_banded(system, matrix.T, check_finite=False).T
+
+
+def _gradient_rows(values: np.ndarray, positions: np.ndarray) -> np.ndarray:
+    """Первая производная по строкам на неравномерной сетке (как np.gradient с edge_order=1)."""
+    gradient = np.empty_like(values)
+    before = positions[:, 1:-1] - positions[:, :-2]
+    after = positions[:, 2:] - positions[:, 1:-1]
+    gradient[:, 1:-1] = (
+        before ** 2 * values[:, 2:]
+        + (after ** 2 - before ** 2) * values[:, 1:-1]
+        - after ** 2 * values[:, :-2]
+    ) / (before * after * (before + after))
+    gradient[:, 0] = (values[:, 1] - values[:, 0]) / (positions[:, 1] - positions[:, 0])
+    gradient[:, -1] = (values[:, -1] - values[:, -2]) / (positions[:, -1] - positions[:, -2])
+    return gradient
+
+
+def derivative_signals(frequencies: ArrayLike, amplitudes_matrix: ArrayLike, order: int = 1) -> np.ndarray:
+    """
+    Производная спектров по волновому числу для матрицы спектров (по оси 1), за O(n).
+    - frequencies: общая сетка (n_points,) или своя сетка для каждой строки
+    - order: 1 или 2
+    """
+    matrix = np.atleast_2d(np.asarray(amplitudes_matrix, dtype=float))
+    positions = np.broadcast_to(np.asarray(frequencies, dtype=float), matrix.shape)
+
+    if order not in (1, 2):
+        raise ValueError("Порядок производной должен быть 1 или 2")
+    if matrix.shape[1] < 3:
+        raise ValueError("Для производной нужно не меньше трёх точек")
+    if np.any(np.diff(positions, axis=1) == 0):
+        raise ValueError("Частоты спектра должны быть различными")
+
+    result = matrix
+    for _ in range(order):
+        result = _gradient_rows(result, positions)
+    return result
+
+
+SPIKE_MIN_REPLICATES = 3
+SPIKE_MAX_WIDTH = 5
+
+
+def _modified_z_scores(values: np.ndarray) -> np.ndarray:
+    """
+    Модифицированный z-score по строкам: 0.6745·(x - медиана) / MAD.
+    При MAD = 0 масштабом служит среднее абсолютное отклонение (×1.2533).
+    """
+    median = np.median(values, axis=1, keepdims=True)
+    deviation = np.abs(values - median)
+    scale = np.median(deviation, axis=1, keepdims=True)
+    scale = np.where(scale > 0, scale, 1.2533 * np.mean(deviation, axis=1, keepdims=True))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = 0.6745 * (values - median) / scale
+    return np.where(scale > 0, scores, 0.0)
+
+
+def _replicate_residuals(matrix: np.ndarray) -> np.ndarray:
+    """Отклонение каждого спектра от медианы повторов, приведённой к его смещению и масштабу."""
+    reference = np.median(matrix, axis=0)
+    centered_reference = reference - reference.mean()
+    norm = centered_reference @ centered_reference
+    if norm == 0:
+        return matrix - matrix.mean(axis=1, keepdims=True)
+    row_means = matrix.mean(axis=1, keepdims=True)
+    scales = ((matrix - row_means) @ centered_reference / norm)[:, np.newaxis]
+    return matrix - row_means - scales * centered_reference
+
+
+def _jump_candidates(matrix: np.ndarray, threshold: float) -> np.ndarray:
+    """
+    Точки с резким входом вверх или выходом вниз по z-score первых разностей,
+    а также точки между входом и ближайшим выходом, если всплеск не шире SPIKE_MAX_WIDTH.
+    Первая и последняя точки строк не отмечаются.
+    """
+    n_rows, n_points = matrix.shape
+    scores = _modified_z_scores(np.diff(matrix, axis=1))
+    rise = np.zeros(matrix.shape, dtype=bool)
+    fall = np.zeros(matrix.shape, dtype=bool)
+    rise[:, 1:-1] = scores[:, :-1] > threshold
+    fall[:, 1:-1] = scores[:, 1:] < -threshold
+
+    # Для каждой точки — последний вход вверх не правее неё и первый выход вниз не левее
+    positions = np.broadcast_to(np.arange(n_points), matrix.shape)
+    last_rise = np.maximum.accumulate(np.where(rise, positions, -1), axis=1)
+    next_fall = np.minimum.accumulate(np.where(fall, positions, n_points)[:, ::-1], axis=1)[:, ::-1]
+    # Между входом и точкой не должно быть выхода: первый выход после входа — не левее точки
+    fall_after_rise = np.take_along_axis(next_fall, np.maximum(last_rise, 0), axis=1)
+    inside = (
+        (last_rise >= 0)
+        & (next_fall < n_points)
+        & (fall_after_rise >= positions)
+        & (next_fall - last_rise < SPIKE_MAX_WIDTH)
+    )
+    return rise | fall | inside
+
+
+def _interpolate_masked(matrix: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """
+    Заменяет отмеченные точки линейной интерполяцией по соседним неотмеченным точкам той же строки.
+    Первая и последняя точки строк не должны быть отмечены — тогда интерполяция
+    по развёрнутой матрице не переходит между строками.
+    """
+    flat = matrix.ravel().copy()
+    marked = mask.ravel()
+    positions = np.arange(flat.size)
+    flat[marked] = np.interp(positions[marked], positions[~marked], flat[~marked])
+    return flat.reshape(matrix.shape)
+
+
+def despike_signals(
+    amplitudes_matrix: ArrayLike,
+    threshold: float = 7.0,
+    frequencies: Union[ArrayLike, None] = None,
+    max_passes: int = 3,
+) -> np.ndarray:
+    """
+    Удаление космических всплесков для матрицы спектров (по оси 1).
+    Кандидат — точка, в которую сигнал резко входит вверх или из которой резко
+    выходит вниз: модифицированный z-score первой разности выше threshold.
+    Если передана матрица частот и не меньше SPIKE_MIN_REPLICATES спектров снято
+    на одной сетке, тот же скачок должен быть и в отклонении спектра от медианы
+    повторов: настоящий пик есть во всех повторах и в отклонении сокращается.
+    Отмеченные точки заменяются интерполяцией; проходы повторяются, пока находятся
+    новые точки (после замены может проявиться соседний всплеск), но не больше max_passes.
+    :return: матрица без всплесков; заменённые точки — те, где она отличается от исходной
+    """
+    matrix = np.atleast_2d(np.asarray(amplitudes_matrix, dtype=float))
+
+    if threshold <= 0:
+        raise ValueError("Порог всплесков должен быть положительным")
+    if matrix.shape[1] < 3:
+        return matrix.copy()
+
+    use_replicates = False
+    if frequencies is not None:
+        grid = np.atleast_2d(np.asarray(frequencies, dtype=float))
+        use_replicates = matrix.shape[0] >= SPIKE_MIN_REPLICATES and np.allclose(grid, grid[0])
+
+    cleaned = matrix.copy()
+    for _ in range(max_passes):
+        candidates = _jump_candidates(cleaned, threshold)
+        if use_replicates:
+            candidates &= _jump_candidates(_replicate_residuals(cleaned), threshold)
+        if not candidates.any():
+            break
+        cleaned = _interpolate_masked(cleaned, candidates)
+    return cleaned
+
+
+def moving_average_signals(amplitudes_matrix: ArrayLike, window_size: int) -> np.ndarray:
+    """
+    Скользящее среднее для матрицы спектров (по оси 1) скользящей суммой за O(n).
+    Совпадает с np.convolve(x, ones(w) / w, mode='same'): за краями сигнал дополняется нулями.
+    """
+    matrix = np.atleast_2d(np.asarray(amplitudes_matrix, dtype=float))
+
+    if matrix.size == 0:
+        raise ValueError("Массив амплитуд пуст")
+    if window_size <= 0:
+        raise ValueError("Размер окна должен быть положительным")
+    if window_size > matrix.shape[1]:
+        raise ValueError("Размер окна не может превышать длину сигнала")
+
+    return uniform_filter1d(matrix, window_size, axis=1, mode='constant', cval=0.0)
+
+
+
+def lttb_indices(x: ArrayLike, y: ArrayLike, n_out: int) -> np.ndarray:
+    """
+    Индексы точек, отобранных алгоритмом LTTB (Largest-Triangle-Three-Buckets).
+    Работает сразу для матрицы спектров одинаковой длины.
+    :param x: частоты, форма (n_points,) или (n_spectra, n_points)
+    :param y: амплитуды, форма (n_points,) или (n_spectra, n_points)
+    :param n_out: число точек на выходе (>= 3)
+    :return: матрица индексов (n_spectra, n_out), для одномерного входа — вектор
+    """
+    y_array = np.asarray(y, dtype=float)
+    single = y_array.ndim == 1
+    y_array = np.atleast_2d(y_array)
+    x_array = np.broadcast_to(np.asarray(x, dtype=float), y_array.shape)
+    n_rows, length = y_array.shape
+
+    if n_out < 3:
+        raise ValueError("LTTB требует минимум 3 точки на выходе")
+    if n_out >= length:
+        indices = np.tile(np.arange(length), (n_rows, 1))
+        return indices[0] if single else indices
+
+    # Границы корзин: первая и последняя точки берутся всегда
+    every = (length - 2) / (n_out - 2)
+    edges = (np.floor(np.arange(n_out - 1) * every) + 1).astype(np.int64)
+    edges[-1] = length - 1
+
+    # Средние точки следующих корзин через накопленные суммы
+    next_starts = edges[1:]
+    next_ends = np.append(edges[2:], length)
+    counts = (next_ends - next_starts).astype(float)
+    x_cumsum = np.concatenate([np.zeros((n_rows, 1)), np.cumsum(x_array, axis=1)], axis=1)
+    y_cumsum = np.concatenate([np.zeros((n_rows, 1)), np.cumsum(y_array, axis=1)], axis=1)
+    avg_x = (x_cumsum[:, next_ends] - x_cumsum[:, next_starts]) / counts
+    avg_y = (y_cumsum[:, next_ends] - y_cumsum[:, next_starts]) / counts
+
+    selected = np.empty((n_rows, n_out), dtype=np.int64)
+    selected[:, 0] = 0
+    selected[:, -1] = length - 1
+    rows = np.arange(n_rows)
+    anchor = np.zeros(n_rows, dtype=np.int64)
+    for bucket in range(n_out - 2):
+        lo, hi = edges[bucket], edges[bucket + 1]
+        xa = x_array[rows, anchor][:, np.newaxis]
+        ya = y_array[rows, anchor][:, np.newaxis]
+        area = np.abs(
+            (xa - avg_x[:, bucket, np.newaxis]) * (y_array[:, lo:hi] - ya)
+            - (xa - x_array[:, lo:hi]) * (avg_y[:, bucket, np.newaxis] - ya)
+        )
+        anchor = lo + np.argmax(area, axis=1)
+        selected[:, bucket + 1] = anchor
+
+    return selected[0] if single else selected
+
+
+def minmax_indices(y: ArrayLike, n_buckets: int) -> List[np.ndarray]:
+    """
+    Прореживание min/max: в каждой из n_buckets корзин сохраняются минимум и максимум.
+    :param y: амплитуды, форма (n_points,) или (n_spectra, n_points)
+    :return: список отсортированных массивов индексов для каждого спектра
+    """
+    y_array = np.atleast_2d(np.asarray(y, dtype=float))
+    n_rows, length = y_array.shape
+
+    if n_buckets <= 0:
+        raise ValueError("Число корзин должно быть положительным")
+    if 2 * n_buckets + 2 >= length:
+        return [np.arange(length) for _ in range(n_rows)]
+
+    edges = np.linspace(0, length, n_buckets + 1).astype(np.int64)
+    bucket_size = int(np.max(np.diff(edges)))
+    # Корзины разной длины дополняются повтором последнего элемента (на min/max не влияет)
+    bucket_idx = np.minimum(edges[:-1, np.newaxis] + np.arange(bucket_size), edges[1:, np.newaxis] - 1)
+    values = y_array[:, bucket_idx]
+    positions = np.arange(n_buckets)
+    lows = bucket_idx[positions, np.argmin(values, axis=2)]
+    highs = bucket_idx[positions, np.argmax(values, axis=2)]
+
+    ends = np.tile([0, length - 1], (n_rows, 1))
+    combined = np.concatenate([lows, highs, ends], axis=1)
+    return [np.unique(row) for row in combined]
+
+
+def downsample_for_display(
+    frequencies_list: Sequence[ArrayLike],
+    amplitudes_list: Sequence[ArrayLike],
+    n_points: int,
+    method: str = "lttb",
+    keep_indices: Sequence[ArrayLike] | None = None,
+) -> List[np.ndarray]:
+    """
+    Подбирает индексы точек для отображения каждого спектра примерно в n_points точках.
+    Спектры одинаковой длины обрабатываются одной матрицей.
+    :param method: 'lttb' или 'minmax'
+    :param keep_indices: индексы, которые нужно сохранить обязательно (например, пики)
+    :return: список отсортированных массивов индексов
+    """
+    if method not in ("lttb", "minmax"):
+        raise ValueError(f"Неизвестный метод прореживания: {method}")
+    if n_points < 4:
+        raise ValueError("Слишком малое число точек для отображения")
+
+    result: List[np.ndarray] = [np.empty(0, dtype=np.int64)] * len(amplitudes_list)
+    for length, members in _group_by_length(amplitudes_list).items():
+        if length <= n_points:
+            for position in members:
+                result[position] = np.arange(length)
+            continue
 
+        amplitudes_matrix = np.array([np.asarray(amplitudes_list[pos], dtype=float) for pos in members])
+        if method == "lttb":
+            frequencies_matrix = np.array([np.asarray(frequencies_list[pos], dtype=float) for pos in members])
+            selected = list(lttb_indices(frequencies_matrix, amplitudes_matrix, n_points))
+        else:
+            selected = minmax_indices(amplitudes_matrix, n_points // 2)
+        for position, indices in zip(members, selected):
+            result[position] = indices
+
+    if keep_indices is not None:
+        for position, extra in enumerate(keep_indices):
+            extra_array = np.asarray(extra, dtype=np.int64)
+            if extra_array.size:
+                result[position] = np.union1d(result[position], extra_array)
+
+    return result
@@ -0,0 +1,517 @@
+"""
+Нагрузочное тестирование API: асинхронные виртуальные пользователи повторяют
+типичную сессию работы с интерфейсом.
+
+Сценарий сессии: регистрация и вход, /uploads/lookup и загрузка образцов
+uploads/*.esp, несколько вызовов /process_data с разными параметрами,
+экспорт (ZIP и средний спектр), сохранение и загрузка пресетов, AI-анализ.
+По умолчанию скрипт сам запускает приложение (uvicorn) и локальный
+OpenAI-совместимый mock, на который указывает OPENROUTER_BASE_URL, поэтому
+запросы к модели не уходят наружу. В конце печатается пропускная способность
+и задержки p50/p95/p99 по каждому эндпоинту.
+
+Пример:
+    python load_test.py --users 20 --duration 60 --workers 2
+    python load_test.py --base-url http://127.0.0.1:8000 --users 5 --sessions 3
+
+Требуется пакет httpx.
+"""
+import argparse
+import asyncio
+import glob
+import hashlib
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import httpx  # type: ignore
+except Exception:
+    httpx = None  # type: ignore
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SAMPLES = os.path.join(BASE_DIR, "uploads", "*.esp")
+MOCK_ANALYSIS_TEXT = "Mock analysis: основные пики соответствуют типичным колебаниям органических соединений."
+PRESET_SLOTS = 5
+
+
+def percentile(sorted_values: Sequence[float], fraction: float) -> float:
+    """Перцентиль методом ближайшего ранга по отсортированной выборке."""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(fraction * len(sorted_values) + 0.999999) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+@dataclass
+class EndpointStats:
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+    statuses: Dict[int, int] = field(default_factory=dict)
+
+
+class LoadStats:
+    """Задержки и ошибки по эндпоинтам."""
+
+    def __init__(self) -> None:
+        self.endpoints: Dict[str, EndpointStats] = {}
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+
+    def record(self, name: str, seconds: float, status: Optional[int], ok: bool) -> None:
+        entry = self.endpoints.setdefault(name, EndpointStats())
+        entry.latencies.append(seconds)
+        if status is not None:
+            entry.statuses[status] = entry.statuses.get(status, 0) + 1
+        if not ok:
+            entry.errors += 1
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        endpoints = {}
+        total_requests = 0
+        for name, entry in sorted(self.endpoints.items()):
+            values = sorted(entry.latencies)
+            total_requests += len(values)
+            endpoints[name] = {
+                "requests": len(values),
+                "errors": entry.errors,
+                "statuses": {str(code): count for code, count in sorted(entry.statuses.items())},
+                "throughput_rps": len(values) / elapsed if elapsed > 0 else 0.0,
+                "p50_ms": percentile(values, 0.50) * 1000,
+                "p95_ms": percentile(values, 0.95) * 1000,
+                "p99_ms": percentile(values, 0.99) * 1000,
+                "max_ms": (values[-1] if values else 0.0) * 1000,
+            }
+        return {
+            "elapsed_seconds": elapsed,
+            "requests": total_requests,
+            "throughput_rps": total_requests / elapsed if elapsed > 0 else 0.0,
+            "endpoints": endpoints,
+        }
+
+
+def format_summary(summary: Dict[str, Any]) -> str:
+    header = f"{'endpoint':<28}{'req':>7}{'err':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    lines = [header, "-" * len(header)]
+    for name, row in summary["endpoints"].items():
+        lines.append(
+            f"{name:<28}{row['requests']:>7}{row['errors']:>6}{row['throughput_rps']:>9.2f}"
+            f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}{row['max_ms']:>10.1f}"
+        )
+    lines.append("-" * len(header))
+    lines.append(
+        f"Всего: {summary['requests']} запросов за {summary['elapsed_seconds']:.1f} с "
+        f"({summary['throughput_rps']:.2f} запросов/с)"
+    )
+    return "\n".join(lines)
+
+
+# --- Mock OpenAI-совместимого API -------------------------------------------------
+
+def _completion_body(model: str) -> Dict[str, Any]:
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": MOCK_ANALYSIS_TEXT},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+def _stream_chunks(model: str) -> List[str]:
+    chunk_id = f"chatcmpl-{uuid.uuid4().hex}"
+    chunks = []
+    for word in MOCK_ANALYSIS_TEXT.split(" "):
+        delta = {"id": chunk_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                 "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}]}
+        chunks.append(f"data: {json.dumps(delta, ensure_ascii=False)}\n\n")
+    chunks.append("data: [DONE]\n\n")
+    return chunks
+
+
+async def start_mock_ai(latency: float) -> Tuple[asyncio.AbstractServer, int]:
+    """
+    Минимальный HTTP-сервер с POST .../chat/completions (обычный и потоковый ответ).
+    latency — имитация времени ответа модели в секундах.
+    """
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers: Dict[str, str] = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", "0")))
+                try:
+                    request = json.loads(body or b"{}")
+                except ValueError:
+                    request = {}
+                model = str(request.get("model", "mock"))
+                await asyncio.sleep(latency)
+                if request.get("stream"):
+                    writer.write(
+                        b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                        b"Transfer-Encoding: chunked\r\nConnection: keep-alive\r\n\r\n"
+                    )
+                    for chunk in _stream_chunks(model):
+                        data = chunk.encode("utf-8")
+                        writer.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+                        await writer.drain()
+                    writer.write(b"0\r\n\r\n")
+                else:
+                    payload = json.dumps(_completion_body(model), ensure_ascii=False).encode("utf-8")
+                    writer.write(
+                        b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                        + f"Content-Length: {len(payload)}\r\nConnection: keep-alive\r\n\r\n".encode()
+                        + payload
+                    )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    return server, port
+
+
+# --- Запуск приложения ---------------------------------------------------------------
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def start_app(port: int, workers: int, mock_port: int, state_dir: str, log_path: str) -> asyncio.subprocess.Process:
+    """Запускает uvicorn с отдельной БД, кэшем и каталогом задач в state_dir."""
+    env = dict(os.environ)
+    env.update(
+        {
+            "OPENROUTER_BASE_URL": f"http://127.0.0.1:{mock_port}/v1",
+            "OPENROUTER_API_KEY": "load-test",
+            "USER_DB_PATH": os.path.join(state_dir, "users.db"),
+            "JOB_RESULTS_DIR": os.path.join(state_dir, "job_results"),
+            "SHARED_CACHE_PATH": os.path.join(state_dir, "shared_cache.sqlite3"),
+        }
+    )
+    env.pop("DATABASE_URL", None)
+    log_file = open(log_path, "wb")
+    try:
+        return await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "uvicorn", "app:app",
+            "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers),
+            cwd=BASE_DIR, env=env, stdout=log_file, stderr=asyncio.subprocess.STDOUT,
+        )
+    finally:
+        log_file.close()
+
+
+async def wait_until_ready(base_url: str, timeout: float) -> None:
+    deadline = time.perf_counter() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while True:
+            try:
+                response = await client.get("/test")
+                if response.status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            if time.perf_counter() > deadline:
+                raise RuntimeError(f"Приложение не ответило за {timeout:.0f} с")
+            await asyncio.sleep(0.2)
+
+
+# --- Сценарий пользователя --------------------------------------------------------
+
+def random_processing_params(rng: random.Random) -> Dict[str, Any]:
+    """Параметры, которые пользователь перебирает в интерфейсе."""
+    return {
+        "min_freq": rng.choice([0, 200, 400]),
+        "max_freq": rng.choice([2000, 3200, 10000]),
+        "remove_baseline": rng.random() < 0.8,
+        "apply_smoothing": rng.random() < 0.7,
+        "normalize": rng.random() < 0.5,
+        "find_peaks": rng.random() < 0.7,
+        "calculate_boxplot": rng.random() < 0.3,
+        "calculate_mean_std": rng.random() < 0.6,
+        "lam": int(10 ** rng.uniform(2, 6)),
+        "p": round(10 ** rng.uniform(-3, -1.3), 4),
+        "window_length": rng.choice(range(5, 52, 2)),
+        "polyorder": rng.randint(1, 3),
+        "width": rng.randint(1, 10),
+        "prominence": rng.randint(1, 5),
+        "display_width": rng.choice([None, 900, 1200, 1600]),
+    }
+
+
+class VirtualUser:
+    """Один пользователь со своими cookie; все запросы проходят через timed()."""
+
+    def __init__(self, index: int, base_url: str, samples: List[Tuple[str, bytes, str]], options: argparse.Namespace,
+                 stats: LoadStats, rng: random.Random) -> None:
+        self.index = index
+        self.samples = samples
+        self.options = options
+        self.stats = stats
+        self.rng = rng
+        self.username = f"load_{options.run_id}_{index}"
+        self.password = "load-test-password"
+        self.registered = False
+        self.client = httpx.AsyncClient(base_url=base_url, timeout=options.timeout, follow_redirects=False)
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+    async def timed(self, name: str, send: Callable[[], Awaitable["httpx.Response"]],
+                    expected: Sequence[int] = (200,),
+                    validate: Optional[Callable[["httpx.Response"], bool]] = None) -> Optional["httpx.Response"]:
+        started = time.perf_counter()
+        try:
+            response = await send()
+            # Тело читается целиком: потоковые ответы (экспорт) учитываются полностью
+            await response.aread()
+        except httpx.HTTPError:
+            self.stats.record(name, time.perf_counter() - started, None, False)
+            return None
+        ok = response.status_code in expected and (validate is None or validate(response))
+        self.stats.record(name, time.perf_counter() - started, response.status_code, ok)
+        return response
+
+    async def login(self) -> bool:
+        if not self.registered:
+            form = {"username": self.username, "password": self.password, "confirm_password": self.password}
+            response = await self.timed("POST /register", lambda: self.client.post("/register", data=form),
+                                        expected=(303,))
+            self.registered = response is not None and response.status_code == 303
+            if not self.registered:
+                return False
+        response = await self.timed(
+            "POST /login",
+            lambda: self.client.post("/login", data={"username": self.username, "password": self.password}),
+            expected=(303,),
+        )
+        return response is not None and response.status_code == 303
+
+    async def upload(self) -> Optional[Dict[str, Any]]:
+        """Как клиент: сначала /uploads/lookup по SHA-256, затем загрузка только неизвестных файлов."""
+        count = self.rng.randint(1, len(self.samples))
+        chosen = self.rng.sample(self.samples, count)
+        response = await self.timed(
+            "POST /uploads/lookup",
+            lambda: self.client.post("/uploads/lookup", json={"hashes": [digest for _, _, digest in chosen]}),
+        )
+        if response is None or response.status_code != 200:
+            return None
+        lookup = response.json()
+        spectra = dict(lookup["known"])
+        missing = [sample for sample in chosen if sample[2] in set(lookup["missing"])]
+        if missing:
+            files = [("files", (name, content, "application/octet-stream")) for name, content, _ in missing]
+            response = await self.timed("POST /upload_files", lambda: self.client.post("/upload_files", files=files))
+            if response is None or response.status_code != 200:
+                return None
+            uploaded = response.json()
+            for digest, freqs, amps in zip(uploaded["hashes"], uploaded["frequencies"], uploaded["amplitudes"]):
+                spectra[digest] = {"frequencies": freqs, "amplitudes": amps}
+        return {
+            "names": [name for name, _, _ in chosen],
+            "frequencies": [spectra[digest]["frequencies"] for _, _, digest in chosen],
+            "amplitudes": [spectra[digest]["amplitudes"] for _, _, digest in chosen],
+        }
+
+    async def session(self) -> None:
+        if not await self.login():
+            return
+        await self.timed("GET /", lambda: self.client.get("/"))
+        await self.timed("GET /presets/bulk", lambda: self.client.get("/presets/bulk"))
+
+        data = await self.upload()
+        if data is None:
+            return
+
+        params: Dict[str, Any] = {}
+        result: Optional[Dict[str, Any]] = None
+        for _ in range(self.options.iterations):
+            params = random_processing_params(self.rng)
+            body = {"frequencies": data["frequencies"], "amplitudes": data["amplitudes"], **params}
+            response = await self.timed("POST /process_data", lambda: self.client.post("/process_data", json=body))
+            if response is not None and response.status_code == 200:
+                result = response.json()
+            await asyncio.sleep(self.rng.uniform(0, self.options.think_time))
+
+        if result is None:
+            return
+
+        if self.rng.random() < self.options.export_ratio:
+            # Экспорт выполняется в полном разрешении, как при нажатии кнопки в интерфейсе
+            full_params = dict(params, display_width=None)
+            body = {"frequencies": data["frequencies"], "amplitudes": data["amplitudes"], **full_params}
+            response = await self.timed("POST /process_data", lambda: self.client.post("/process_data", json=body))
+            if response is not None and response.status_code == 200:
+                result = response.json()
+            export_body = {
+                "frequencies": result["frequencies"],
+                "amplitudes": result["processed_amplitudes"],
+                "fileNames": data["names"],
+                "params": full_params,
+            }
+            await self.timed("POST /export_processed_data",
+                             lambda: self.client.post("/export_processed_data", json=export_body))
+            if result.get("mean_amplitude"):
+                mean_body = {
+                    "frequencies": result["mean_frequencies"],
+                    "mean_amplitude": result["mean_amplitude"],
+                    "params": full_params,
+                }
+                await self.timed("POST /export_mean_spectrum",
+                                 lambda: self.client.post("/export_mean_spectrum", json=mean_body))
+
+        slot = self.rng.randint(1, PRESET_SLOTS)
+        preset = {"name": f"Нагрузка {self.index}", "payload": params}
+        await self.timed("POST /presets/{slot}", lambda: self.client.post(f"/presets/{slot}", json=preset))
+        await self.timed("GET /presets/{slot}", lambda: self.client.get(f"/presets/{slot}"))
+
+        if self.rng.random() < self.options.ai_ratio and result["processed_amplitudes"]:
+            ai_body = {
+                "frequencies": result["frequencies"][0],
+                "amplitudes": result["processed_amplitudes"][0],
+                "processing_params": params,
+            }
+            # Ошибка модели возвращается с кодом 200 и success=false
+            await self.timed("POST /analyze_spectrum", lambda: self.client.post("/analyze_spectrum", json=ai_body),
+                             validate=lambda response: bool(response.json().get("success")))
+
+        await self.timed("POST /logout", lambda: self.client.post("/logout"), expected=(303,))
+
+
+async def run_user(user: VirtualUser, deadline: Optional[float], sessions: Optional[int]) -> None:
+    done = 0
+    try:
+        while (sessions is None or done < sessions) and (deadline is None or time.perf_counter() < deadline):
+            await user.session()
+            done += 1
+    finally:
+        await user.close()
+
+
+def load_samples(pattern: str) -> List[Tuple[str, bytes, str]]:
+    samples = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path, "rb") as handle:
+            content = handle.read()
+        samples.append((os.path.basename(path), content, hashlib.sha256(content).hexdigest()))
+    return samples
+
+
+async def run(options: argparse.Namespace) -> Dict[str, Any]:
+    samples = load_samples(options.samples)
+    if not samples:
+        raise RuntimeError(f"Нет файлов по шаблону {options.samples}")
+
+    mock_server = None
+    app_process = None
+    state_dir = None
+    base_url = options.base_url
+    try:
+        if base_url is None:
+            mock_server, mock_port = await start_mock_ai(options.ai_latency)
+            state_dir = tempfile.mkdtemp(prefix="load_test_")
+            port = options.port or _free_port()
+            base_url = f"http://127.0.0.1:{port}"
+            log_path = os.path.join(state_dir, "server.log")
+            app_process = await start_app(port, options.workers, mock_port, state_dir, log_path)
+            print(f"Приложение запущено на {base_url} (лог: {log_path})", file=sys.stderr)
+        await wait_until_ready(base_url, options.startup_timeout)
+
+        stats = LoadStats()
+        deadline = None if options.sessions else time.perf_counter() + options.duration
+        users = [
+            VirtualUser(index, base_url, samples, options, stats, random.Random(options.seed + index))
+            for index in range(options.users)
+        ]
+
+        async def staggered(user: VirtualUser) -> None:
+            # Пользователи подключаются равномерно в течение ramp-up, а не одновременно
+            await asyncio.sleep(options.ramp_up * user.index / max(options.users, 1))
+            await run_user(user, deadline, options.sessions)
+
+        await asyncio.gather(*(staggered(user) for user in users))
+        stats.finished = time.perf_counter()
+        return stats.summary()
+    finally:
+        if app_process is not None and app_process.returncode is None:
+            app_process.terminate()
+            try:
+                await asyncio.wait_for(app_process.wait(), timeout=15)
+            except asyncio.TimeoutError:
+                app_process.kill()
+        if mock_server is not None:
+            mock_server.close()
+            await mock_server.wait_closed()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Нагрузочное тестирование API обработки спектров")
+    parser.add_argument("--base-url", help="адрес уже запущенного приложения; без него запускается локальный uvicorn")
+    parser.add_argument("--port", type=int, default=None, help="порт локального приложения (по умолчанию свободный)")
+    parser.add_argument("--workers", type=int, default=1, help="число воркеров uvicorn локального приложения")
+    parser.add_argument("--users", type=int, default=10, help="число одновременных виртуальных пользователей")
+    parser.add_argument("--duration", type=float, default=60.0, help="длительность теста, с")
+    parser.add_argument("--sessions", type=int, default=None, help="число сессий на пользователя (вместо --duration)")
+    parser.add_argument("--ramp-up", type=float, default=5.0, help="время подключения всех пользователей, с")
+    parser.add_argument("--iterations", type=int, default=5, help="вызовов /process_data за сессию")
+    parser.add_argument("--think-time", type=float, default=1.0, help="максимальная пауза между вызовами, с")
+    parser.add_argument("--export-ratio", type=float, default=0.5, help="доля сессий с экспортом")
+    parser.add_argument("--ai-ratio", type=float, default=0.2, help="доля сессий с AI-анализом")
+    parser.add_argument("--ai-latency", type=float, default=1.0, help="задержка ответа mock-модели, с")
+    parser.add_argument("--samples", default=DEFAULT_SAMPLES, help="шаблон файлов для загрузки")
+    parser.add_argument("--timeout", type=float, default=120.0, help="таймаут одного запроса, с")
+    parser.add_argument("--startup-timeout", type=float, default=60.0, help="ожидание запуска приложения, с")
+    parser.add_argument("--seed", type=int, default=0, help="зерно генератора параметров")
+    parser.add_argument("--json", dest="json_path", help="сохранить сводку в JSON-файл")
+    return parser
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    options = build_parser().parse_args(argv)
+    if httpx is None:
+        print("Для нагрузочного теста установите пакет httpx", file=sys.stderr)
+        return 2
+    options.run_id = uuid.uuid4().hex[:8]
+
+    summary = asyncio.run(run(options))
+    print(format_summary(summary))
+    if options.json_path:
+        with open(options.json_path, "w", encoding="utf-8") as handle:
+            json.dump(summary, handle, ensure_ascii=False, indent=2)
+    failed = sum(row["errors"] for row in summary["endpoints"].values())
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,275 @@
+from typing import Any, Callable, Dict, List, Optional
+
+from pydantic import BaseModel
+
+
+DISPLAY_POINTS_PER_PIXEL = 1
+SMOOTHING_METHODS = ("savgol", "whittaker")
+
+# Поля пресета интерфейса (id элементов управления), названные не так, как параметры обработки
+PRESET_FIELD_ALIASES = {
+    "peak_width": "width",
+    "peak_prominence": "prominence",
+}
+
+
+class ProcessDataRequest(BaseModel):
+    frequencies: List[List[float]]
+    amplitudes: List[List[float]]
+    min_freq: Optional[float] = 0
+    max_freq: Optional[float] = 10000
+    remove_spikes: Optional[bool] = False
+    spike_threshold: Optional[float] = 7.0  # порог модифицированного z-score скачков
+    remove_baseline: Optional[bool] = False
+    baseline_method: Optional[str] = "als"  # als | arpls | airpls
+    auto_lam: Optional[bool] = False  # подбирать lam базовой линии для каждого спектра
+    apply_smoothing: Optional[bool] = False
+    smoothing_method: Optional[str] = "savgol"  # savgol | whittaker
+    normalize: Optional[bool] = False
+    find_peaks: Optional[bool] = False
+    calculate_boxplot: Optional[bool] = False
+    calculate_mean_std: Optional[bool] = False
+    width: Optional[int] = 1
+    prominence: Optional[int] = 1
+    lam: Optional[int] = 1000
+    p: Optional[float] = 0.001
+    window_length: Optional[int] = 25
+    polyorder: Optional[int] = 1
+    smoothing_lam: Optional[float] = 100  # сила сглаживания Уиттекера
+    derivative: Optional[int] = 0  # 0 — без производной, 1 или 2 — порядок производной по волновому числу
+    show_moving_average: Optional[bool] = False
+    moving_average_window: Optional[int] = 10
+    display_width: Optional[int] = None  # ширина графика в пикселях; None — полное разрешение
+    lod_method: Optional[str] = "lttb"
+
+
+class ProcessingCancelled(Exception):
+    """Расчёт прерван: его результат устарел из-за более нового запроса."""
+
+
+def process_spectra(
+    payload: ProcessDataRequest,
+    is_cancelled: Optional[Callable[[], bool]] = None,
+    progress: Optional[Callable[[float], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Конвейер обработки спектров (синхронный: в веб-приложении выполняется в пуле потоков,
+    в пакетной обработке — в процессах-воркерах).
+    is_cancelled проверяется между спектрами и этапами: при True расчёт
+    прерывается исключением ProcessingCancelled; progress получает долю выполненной работы.
+    Индексы пиков (peaks, peaks_info[].index) относятся к возвращаемой сетке частот;
+    при display_width в peaks_info есть и source_index — индекс в полном разрешении.
+    """
+    # numpy/scipy загружаются при первой обработке, а не при запуске веб-приложения
+    import numpy as np
+
+    from data_processing import (
+        apply_batched,
+        calculate_boxplot_stats,
+        calculate_mean_std,
+        derivative_signals,
+        despike_signals,
+        downsample_for_display,
+        estimate_baseline,
+        filter_frequency_range,
+        find_signal_peaks,
+        moving_average_signals,
+        normalize_snv,
+        select_baseline_lam,
+        smooth_signals,
+        whittaker_smooth_signals,
+    )
+
+    total = max(len(payload.amplitudes), 1)
+
+    def checkpoint(done: float) -> None:
+        if is_cancelled is not None and is_cancelled():
+            raise ProcessingCancelled()
+        if progress is not None:
+            progress(done)
+
+    # Получаем данные из запроса
+    frequencies_list = payload.frequencies
+    amplitudes_list = payload.amplitudes
+
+    # Обработка данных
+    freq_arrays = []
+    amp_arrays = []
+    peaks_list = []
+    peaks_values_list = []
+    peaks_info_list = []
+    baseline_lams = []
+    spikes_list = []
+
+    for frequencies, amplitudes in zip(frequencies_list, amplitudes_list):
+        # Конвертируем в numpy arrays и фильтруем по частотам
+        freq_array, amp_array = filter_frequency_range(
+            np.array(frequencies), np.array(amplitudes), payload.min_freq, payload.max_freq
+        )
+        freq_arrays.append(freq_array)
+        amp_arrays.append(amp_array)
+
+    # Удаление всплесков до базовой линии: спектры одной сетки сравниваются между собой
+    if payload.remove_spikes:
+        despiked = apply_batched(
+            amp_arrays,
+            lambda matrix, freq_matrix: despike_signals(matrix, payload.spike_threshold, freq_matrix),
+            frequencies_list=freq_arrays,
+        )
+        for freq_array, amp_array, clean_array in zip(freq_arrays, amp_arrays, despiked):
+            replaced = np.flatnonzero(clean_array != amp_array)
+            spikes_list.append([
+                {'frequency': float(freq_array[idx]), 'amplitude': float(amp_array[idx])}
+                for idx in replaced
+            ])
+        amp_arrays = despiked
+
+    for position, amp_array in enumerate(amp_arrays):
+        # Базовая линия — основная часть работы (до 70%)
+        checkpoint(0.7 * position / total)
+
+        # Удаление базовой линии (lam задан пользователем или подбирается для спектра)
+        if payload.remove_baseline:
+            if payload.auto_lam:
+                baselines, lams = select_baseline_lam([amp_array], payload.baseline_method, payload.p)
+                amp_array -= baselines[0]
+                baseline_lams.append(lams[0])
+            else:
+                amp_array -= estimate_baseline(amp_array, payload.baseline_method, payload.lam, payload.p)
+                baseline_lams.append(float(payload.lam))
+
+    # Сглаживание и производные: спектры одинаковой длины обрабатываются одной матрицей
+    if payload.apply_smoothing:
+        if payload.smoothing_method not in SMOOTHING_METHODS:
+            raise ValueError(f"Неизвестный метод сглаживания: {payload.smoothing_method}")
+        if payload.smoothing_method == "whittaker":
+            amp_arrays = apply_batched(
+                amp_arrays,
+                lambda matrix: whittaker_smooth_signals(matrix, payload.smoothing_lam),
+            )
+        else:
+            amp_arrays = apply_batched(
+                amp_arrays,
+                lambda matrix: smooth_signals(matrix, payload.window_length, payload.polyorder),
+            )
+
+    if payload.derivative:
+        amp_arrays = apply_batched(
+            amp_arrays,
+            lambda matrix, freq_matrix: derivative_signals(freq_matrix, matrix, payload.derivative),
+            frequencies_list=freq_arrays,
+        )
+
+    checkpoint(0.75)
+    for index, (freq_array, amp_array) in enumerate(zip(freq_arrays, amp_arrays)):
+        checkpoint(0.75 + 0.2 * index / total)
+        # Нормализация
+        if payload.normalize:
+            amp_array = normalize_snv(amp_array)
+            amp_arrays[index] = amp_array
+
+        # Поиск пиков
+        peaks = np.array([], dtype=int)
+        peaks_info = []
+        if payload.find_peaks:
+            peaks, _ = find_signal_peaks(amp_array, width=payload.width, prominence=payload.prominence)
+            for order, peak_idx in enumerate(peaks, start=1):
+                peaks_info.append({
+                    'index': int(peak_idx),
+                    'order': order,
+                    'frequency': float(freq_array[peak_idx]),
+                    'amplitude': float(amp_array[peak_idx])
+                })
+
+        # Сохраняем результаты
+        peaks_list.append(np.asarray(peaks, dtype=int))
+        peaks_values_list.append(amp_array[peaks].tolist() if len(peaks) > 0 else [])
+        peaks_info_list.append(peaks_info)
+
+    checkpoint(0.95)
+
+    # Расчет статистики
+    boxplot_stats = []
+    if payload.calculate_boxplot and len(amp_arrays) > 0:
+        boxplot_stats = calculate_boxplot_stats(amp_arrays)
+
+    mean_amplitude, std_amplitude = np.array([]), np.array([])
+    if payload.calculate_mean_std and len(amp_arrays) > 0:
+        mean_amplitude, std_amplitude = calculate_mean_std(amp_arrays)
+
+    moving_averages = []
+    if payload.show_moving_average:
+        moving_averages = apply_batched(
+            amp_arrays,
+            lambda matrix: moving_average_signals(matrix, payload.moving_average_window),
+        )
+
+    # Режим отображения: прореживаем каждую кривую под ширину графика в пикселях.
+    # Пики сохраняются всегда, их индексы (peaks и peaks_info[].index) пересчитываются
+    # в прореженную сетку; индекс в полном разрешении остаётся в peaks_info[].source_index.
+    display_info = None
+    mean_frequencies = freq_arrays[0] if freq_arrays else np.array([])
+    if payload.display_width:
+        if payload.display_width <= 0:
+            raise ValueError("display_width должен быть положительным")
+        n_points = payload.display_width * DISPLAY_POINTS_PER_PIXEL
+        display_indices = downsample_for_display(
+            freq_arrays, amp_arrays, n_points, payload.lod_method, keep_indices=peaks_list
+        )
+        display_info = {
+            'method': payload.lod_method,
+            'width': payload.display_width,
+            'original_points': [int(arr.size) for arr in amp_arrays],
+            'display_points': [int(idx.size) for idx in display_indices],
+        }
+        peaks_list = [np.searchsorted(idx, peaks) for idx, peaks in zip(display_indices, peaks_list)]
+        for peaks_info, display_peaks in zip(peaks_info_list, peaks_list):
+            for info, display_index in zip(peaks_info, display_peaks):
+                info['source_index'] = info['index']
+                info['index'] = int(display_index)
+        moving_averages = [avg[idx] for avg, idx in zip(moving_averages, display_indices)]
+        freq_arrays = [arr[idx] for arr, idx in zip(freq_arrays, display_indices)]
+        amp_arrays = [arr[idx] for arr, idx in zip(amp_arrays, display_indices)]
+        if mean_amplitude.size:
+            mean_idx = downsample_for_display([mean_frequencies], [mean_amplitude], n_points, payload.lod_method)[0]
+            mean_frequencies = mean_frequencies[mean_idx]
+            mean_amplitude = mean_amplitude[mean_idx]
+            std_amplitude = std_amplitude[mean_idx]
+
+    return {
+        'frequencies': [arr.tolist() for arr in freq_arrays],
+        'processed_amplitudes': [arr.tolist() for arr in amp_arrays],
+        'peaks': [peaks.tolist() for peaks in peaks_list],
+        'peaks_values': peaks_values_list,
+        'peaks_info': peaks_info_list,
+        'mean_amplitude': mean_amplitude.tolist(),
+        'mean_frequencies': mean_frequencies.tolist() if mean_amplitude.size else [],
+        'boxplot_stats': boxplot_stats,
+        'std_amplitude': std_amplitude.tolist(),
+        'baseline_lam': baseline_lams,
+        'spikes': spikes_list,
+        'moving_averages': [avg.tolist() for avg in moving_averages],
+        'display': display_info
+    }
+
+
+def preset_to_params(preset: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Параметры обработки из пресета.
+    Принимает ответ GET /presets/{slot} ({"payload": {...}}), сохранённое состояние
+    элементов управления или готовый словарь параметров ProcessDataRequest.
+    Пустые значения и неизвестные поля отбрасываются.
+    """
+    fields = preset.get("payload", preset)
+    if not isinstance(fields, dict):
+        raise ValueError("Пресет должен быть JSON-объектом")
+
+    known = set(ProcessDataRequest.model_fields) - {"frequencies", "amplitudes"}
+    params: Dict[str, Any] = {}
+    for name, value in fields.items():
+        name = PRESET_FIELD_ALIASES.get(name, name)
+        if name in known and value not in ("", None):
+            params[name] = value
+    # Проверяем типы сразу, а не при обработке первого файла
+    validated = ProcessDataRequest.model_validate({"frequencies": [], "amplitudes": [], **params})
+    return {name: getattr(validated, name) for name in params}
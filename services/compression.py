@@ -0,0 +1,196 @@
+import gzip
+import zlib
+from typing import Any, Dict, Optional
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli  # type: ignore
+except Exception:
+    brotli = None  # type: ignore
+
+
+# Уже сжатые или потоковые форматы: повторное сжатие бесполезно или ломает поток
+EXCLUDED_CONTENT_TYPES = (
+    "text/event-stream",
+    "application/zip",
+    "application/gzip",
+    "image/",
+    "font/woff",
+)
+
+# Тела крупнее этого порога сжимаются в пуле потоков, чтобы не блокировать event loop
+THREAD_MINIMUM_SIZE = 256 * 1024
+
+
+def parse_accept_encoding(accept_encoding: str) -> Dict[str, float]:
+    """
+    Разбирает Accept-Encoding в словарь «кодировка → q».
+    Пробелы вокруг ';' и '=' допускаются; элемент с некорректным q считается
+    неприемлемым (q=0). Если кодировка указана несколько раз, берётся наибольший q.
+    """
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        coding, *params = [item.strip() for item in part.split(";")]
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() != "q":
+                continue
+            try:
+                quality = float(value.strip())
+            except ValueError:
+                quality = 0.0
+            if not 0.0 <= quality <= 1.0:
+                quality = 0.0
+        coding = coding.lower()
+        weights[coding] = max(quality, weights.get(coding, 0.0))
+    return weights
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Выбирает кодировку ответа с наибольшим q среди поддерживаемых: br (если установлен
+    brotli) и gzip; при равных q предпочитается br. Кодировки с q=0 не используются;
+    не указанные явно получают q от '*', если он есть.
+    """
+    weights = parse_accept_encoding(accept_encoding)
+    wildcard = weights.get("*", 0.0)
+    supported = ("br", "gzip") if brotli is not None else ("gzip",)
+    best: Optional[str] = None
+    best_quality = 0.0
+    for coding in supported:
+        quality = weights.get(coding, wildcard)
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def compress_body(body: bytes, encoding: str, gzip_level: int = 6, brotli_quality: int = 5) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=brotli_quality)
+    return gzip.compress(body, compresslevel=gzip_level, mtime=0)
+
+
+class StreamCompressor:
+    """Инкрементальное сжатие для ответов, отдаваемых несколькими сообщениями (файлы статики)."""
+
+    def __init__(self, encoding: str, gzip_level: int = 6, brotli_quality: int = 5) -> None:
+        self._compressor: Any
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        self._is_brotli = encoding == "br"
+
+    def compress(self, chunk: bytes) -> bytes:
+        if self._is_brotli:
+            return self._compressor.process(chunk)
+        return self._compressor.compress(chunk)
+
+    def finish(self) -> bytes:
+        return self._compressor.finish() if self._is_brotli else self._compressor.flush()
+
+
+class CompressionMiddleware:
+    """
+    Сжатие ответов gzip/brotli для тел не меньше minimum_size байт.
+    Ответ одним сообщением (JSON, HTML) сжимается целиком; ответ из нескольких
+    сообщений (файлы статики) — потоково. SSE и уже сжатые форматы не трогаем.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 5,
+    ) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Optional[Message] = None
+        passthrough = False
+        stream: Optional[StreamCompressor] = None
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal start_message, passthrough, stream
+
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or passthrough or start_message is None:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if stream is not None:
+                chunk = stream.compress(body) if body else b""
+                if not more_body:
+                    chunk += stream.finish()
+                await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+                return
+
+            headers = MutableHeaders(raw=start_message["headers"])
+            size = int(headers["content-length"]) if more_body and "content-length" in headers else len(body)
+            if start_message["status"] == 206 or not self._should_compress(headers, size):
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            if more_body:
+                stream = StreamCompressor(encoding, self.gzip_level, self.brotli_quality)
+                self._mark_encoded(headers, encoding)
+                del headers["Content-Length"]
+                start_message["headers"] = headers.raw
+                await send(start_message)
+                await send({"type": "http.response.body", "body": stream.compress(body), "more_body": True})
+                return
+
+            compressed = await self._compress(body, encoding)
+            self._mark_encoded(headers, encoding)
+            headers["Content-Length"] = str(len(compressed))
+            start_message["headers"] = headers.raw
+            await send(start_message)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
+
+    def _should_compress(self, headers: MutableHeaders, size: int) -> bool:
+        if size < self.minimum_size or "content-encoding" in headers:
+            return False
+        content_type = headers.get("content-type", "").lower()
+        return not any(content_type.startswith(excluded) for excluded in EXCLUDED_CONTENT_TYPES)
+
+    async def _compress(self, body: bytes, encoding: str) -> bytes:
+        if len(body) >= THREAD_MINIMUM_SIZE:
+            return await run_in_threadpool(compress_body, body, encoding, self.gzip_level, self.brotli_quality)
+        return compress_body(body, encoding, self.gzip_level, self.brotli_quality)
+
+    @staticmethod
+    def _mark_encoded(headers: MutableHeaders, encoding: str) -> None:
+        headers["Content-Encoding"] = encoding
+        headers.add_vary_header("Accept-Encoding")
+        # Байты ответа изменились, поэтому сильный ETag становится слабым
+        etag = headers.get("etag")
+        if etag and not etag.startswith("W/"):
+            headers["ETag"] = f"W/{etag}"
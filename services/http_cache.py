@@ -0,0 +1,100 @@
+import hashlib
+import os
+from typing import Dict, Optional, Tuple
+
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+from starlette.types import Scope
+
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+
+class StaticFingerprints:
+    """
+    Отпечатки содержимого статических файлов для URL вида /static/app.js?v=<hash>.
+    Хэш пересчитывается только при изменении mtime/размера файла.
+    """
+
+    def __init__(self, directory: str, url_prefix: str = "/static") -> None:
+        self.directory = directory
+        self.url_prefix = url_prefix.rstrip("/")
+        self._cache: Dict[str, Tuple[float, int, str]] = {}
+
+    def fingerprint(self, path: str) -> Optional[str]:
+        full_path = os.path.join(self.directory, path)
+        try:
+            stat = os.stat(full_path)
+        except OSError:
+            return None
+
+        cached = self._cache.get(path)
+        if cached and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+            return cached[2]
+
+        digest = hashlib.sha256()
+        with open(full_path, "rb") as handle:
+            for chunk in iter(lambda: handle.read(64 * 1024), b""):
+                digest.update(chunk)
+        fingerprint = digest.hexdigest()[:12]
+        self._cache[path] = (stat.st_mtime, stat.st_size, fingerprint)
+        return fingerprint
+
+    def url(self, path: str) -> str:
+        path = path.lstrip("/")
+        fingerprint = self.fingerprint(path)
+        base = f"{self.url_prefix}/{path}"
+        return f"{base}?v={fingerprint}" if fingerprint else base
+
+
+class FingerprintedStaticFiles(StaticFiles):
+    """
+    StaticFiles с долгим кэшированием: запросы с актуальным ?v=<hash> получают
+    immutable-заголовки, остальные — no-cache с проверкой по ETag/Last-Modified.
+    """
+
+    def __init__(self, *args, fingerprints: StaticFingerprints, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.fingerprints = fingerprints
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        response = await super().get_response(path, scope)
+        if response.status_code in (200, 304):
+            version = Request(scope).query_params.get("v")
+            if version and version == self.fingerprints.fingerprint(path):
+                response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+            else:
+                response.headers["Cache-Control"] = REVALIDATE_CACHE_CONTROL
+        return response
+
+
+def compute_etag(*parts: bytes) -> str:
+    """Слабый ETag по содержимому (слабый — так как тело может сжиматься по-разному)."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part)
+        digest.update(b"\x00")
+    return f'W/"{digest.hexdigest()[:32]}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Проверяет заголовок If-None-Match (сравнение слабое, как требует RFC 9110)."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    normalized = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == normalized:
+            return True
+    return False
+
+
+def not_modified(etag: str, cache_control: str = REVALIDATE_CACHE_CONTROL) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
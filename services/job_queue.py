@@ -0,0 +1,292 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, NamedTuple, Optional
+
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = ("succeeded", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    """Задача отменена пользователем."""
+
+
+class JobResult(NamedTuple):
+    content: bytes
+    media_type: str
+    filename: str
+
+
+class JobContext:
+    """
+    Контекст выполняющейся задачи: прогресс (запись в БД не чаще progress_interval)
+    и признак отмены, который задача проверяет на контрольных точках.
+    """
+
+    def __init__(self, manager: "JobManager", job_id: str, cancel_event: threading.Event) -> None:
+        self._manager = manager
+        self.job_id = job_id
+        self._cancel_event = cancel_event
+        self._last_report = 0.0
+
+    def is_cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def report(self, progress: float, message: Optional[str] = None) -> None:
+        if self.is_cancelled():
+            raise JobCancelled()
+        now = time.monotonic()
+        if now - self._last_report < self._manager.progress_interval and progress < 1.0:
+            return
+        self._last_report = now
+        self._manager._update(self.job_id, progress=round(min(max(progress, 0.0), 1.0), 4), message=message)
+
+
+JobFunction = Callable[[JobContext], JobResult]
+
+
+class JobManager:
+    """
+    Фоновые задачи обработки и экспорта.
+    Задачи выполняются в ограниченном пуле потоков; состояние хранится в таблице
+    processing_jobs, результаты — файлами в results_dir.
+
+    Менеджер есть в каждом воркере uvicorn. Задача принадлежит воркеру, который её
+    принял (instance_id): он раз в monitor_interval обновляет heartbeat_at своих
+    незавершённых задач и забирает запросы отмены (cancel_requested), поступившие
+    через другие воркеры. Задачи, чья отметка старше stale_after, считаются
+    прерванными — их воркер упал или был перезапущен.
+    """
+
+    def __init__(
+        self,
+        get_connection: Callable[[], Any],
+        results_dir: str,
+        max_workers: int = 2,
+        result_ttl_seconds: int = 24 * 60 * 60,
+        progress_interval: float = 0.5,
+        monitor_interval: float = 1.0,
+        stale_after: float = 30.0,
+    ) -> None:
+        if max_workers <= 0:
+            raise ValueError("max_workers must be positive")
+        if stale_after <= monitor_interval:
+            raise ValueError("stale_after must exceed monitor_interval")
+        self._get_connection = get_connection
+        self.results_dir = results_dir
+        self.result_ttl_seconds = result_ttl_seconds
+        self.progress_interval = progress_interval
+        self.monitor_interval = monitor_interval
+        self.stale_after = stale_after
+        self.instance_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._futures: Dict[str, Future] = {}
+        self._cancel_events: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._monitor: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Помечает прерванные задачи и запускает поток отметок и отмены (вызывается при старте воркера)."""
+        self.recover_interrupted()
+        if self._monitor is None:
+            self._monitor = threading.Thread(target=self._monitor_loop, name="job-monitor", daemon=True)
+            self._monitor.start()
+
+    def submit(self, owner: str, kind: str, func: JobFunction) -> str:
+        self.purge_expired()
+        job_id = uuid.uuid4().hex
+        now = datetime.utcnow().isoformat()
+        conn = self._get_connection()
+        try:
+            conn.execute(
+                """
+                INSERT INTO processing_jobs
+                    (job_id, owner, kind, status, progress, created_at, updated_at, instance_id, heartbeat_at)
+                VALUES (?, ?, ?, 'queued', 0, ?, ?, ?, ?)
+                """,
+                (job_id, owner, kind, now, now, self.instance_id, now),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+        cancel_event = threading.Event()
+        with self._lock:
+            self._cancel_events[job_id] = cancel_event
+            self._futures[job_id] = self._executor.submit(self._run, job_id, func, cancel_event)
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        conn = self._get_connection()
+        try:
+            row = conn.execute("SELECT * FROM processing_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return dict(row) if row is not None else None
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Отменяет задачу в очереди сразу, выполняющуюся — на ближайшей контрольной точке.
+        Запрос отмены сохраняется в БД, поэтому задачу другого воркера отменит её
+        воркер при следующем опросе.
+        """
+        conn = self._get_connection()
+        try:
+            cursor = conn.execute(
+                "UPDATE processing_jobs SET cancel_requested = 1 WHERE job_id = ? AND status IN ('queued', 'running')",
+                (job_id,),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        requested = cursor.rowcount > 0
+        return self._cancel_local(job_id) or requested
+
+    def _cancel_local(self, job_id: str) -> bool:
+        with self._lock:
+            cancel_event = self._cancel_events.get(job_id)
+            future = self._futures.get(job_id)
+        if cancel_event is None:
+            return False
+        cancel_event.set()
+        if future is not None and future.cancel():
+            self._finish(job_id, "cancelled", error="Отменено до запуска")
+            self._forget(job_id)
+        return True
+
+    def recover_interrupted(self) -> None:
+        """Незавершённые задачи, воркер которых давно не обновлял отметку, помечаются как неудачные."""
+        now = datetime.utcnow()
+        threshold = (now - timedelta(seconds=self.stale_after)).isoformat()
+        conn = self._get_connection()
+        try:
+            conn.execute(
+                """
+                UPDATE processing_jobs SET status = 'failed', error = ?, updated_at = ?, finished_at = ?
+                WHERE status IN ('queued', 'running')
+                    AND (heartbeat_at IS NULL OR heartbeat_at < ?)
+                    AND (instance_id IS NULL OR instance_id != ?)
+                """,
+                ("Прервано перезапуском сервера", now.isoformat(), now.isoformat(), threshold, self.instance_id),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _monitor_loop(self) -> None:
+        recovered_at = time.monotonic()
+        while not self._stopped.wait(self.monitor_interval):
+            try:
+                self._heartbeat()
+                if time.monotonic() - recovered_at >= self.stale_after:
+                    recovered_at = time.monotonic()
+                    self.recover_interrupted()
+            except Exception:
+                logger.exception("Job monitor iteration failed")
+
+    def _heartbeat(self) -> None:
+        """Обновляет отметку своих задач и применяет запросы отмены, пришедшие через другие воркеры."""
+        with self._lock:
+            local_jobs = list(self._cancel_events)
+        if not local_jobs:
+            return
+        conn = self._get_connection()
+        try:
+            conn.execute(
+                "UPDATE processing_jobs SET heartbeat_at = ? WHERE instance_id = ? AND status IN ('queued', 'running')",
+                (datetime.utcnow().isoformat(), self.instance_id),
+            )
+            conn.commit()
+            rows = conn.execute(
+                "SELECT job_id FROM processing_jobs WHERE instance_id = ? AND cancel_requested = 1 AND status IN ('queued', 'running')",
+                (self.instance_id,),
+            ).fetchall()
+        finally:
+            conn.close()
+        for row in rows:
+            self._cancel_local(row["job_id"])
+
+    def purge_expired(self) -> None:
+        """Удаляет завершённые задачи старше result_ttl_seconds вместе с файлами результатов."""
+        threshold = (datetime.utcnow() - timedelta(seconds=self.result_ttl_seconds)).isoformat()
+        conn = self._get_connection()
+        try:
+            rows = conn.execute(
+                "SELECT job_id, result_path FROM processing_jobs WHERE status IN ('succeeded', 'failed', 'cancelled') AND updated_at < ?",
+                (threshold,),
+            ).fetchall()
+            for row in rows:
+                if row["result_path"] and os.path.exists(row["result_path"]):
+                    os.remove(row["result_path"])
+                conn.execute("DELETE FROM processing_jobs WHERE job_id = ?", (row["job_id"],))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def shutdown(self) -> None:
+        self._stopped.set()
+        with self._lock:
+            events = list(self._cancel_events.values())
+        for event in events:
+            event.set()
+        self._executor.shutdown(wait=False)
+
+    def _run(self, job_id: str, func: JobFunction, cancel_event: threading.Event) -> None:
+        try:
+            if cancel_event.is_set():
+                raise JobCancelled()
+            self._update(job_id, status="running")
+            result = func(JobContext(self, job_id, cancel_event))
+            if cancel_event.is_set():
+                raise JobCancelled()
+            os.makedirs(self.results_dir, exist_ok=True)
+            path = os.path.join(self.results_dir, f"{job_id}.bin")
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as handle:
+                handle.write(result.content)
+            os.replace(tmp_path, path)
+            self._finish(
+                job_id,
+                "succeeded",
+                progress=1.0,
+                result_path=path,
+                result_media_type=result.media_type,
+                result_filename=result.filename,
+            )
+        except JobCancelled:
+            self._finish(job_id, "cancelled", error="Отменено пользователем")
+        except Exception as exc:
+            logger.exception("Job %s failed", job_id)
+            self._finish(job_id, "failed", error=str(exc))
+        finally:
+            self._forget(job_id)
+
+    def _forget(self, job_id: str) -> None:
+        with self._lock:
+            self._futures.pop(job_id, None)
+            self._cancel_events.pop(job_id, None)
+
+    def _finish(self, job_id: str, status: str, **fields: Any) -> None:
+        self._update(job_id, status=status, finished_at=datetime.utcnow().isoformat(), **fields)
+
+    def _update(self, job_id: str, **fields: Any) -> None:
+        fields = {name: value for name, value in fields.items() if value is not None}
+        fields["updated_at"] = datetime.utcnow().isoformat()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        conn = self._get_connection()
+        try:
+            conn.execute(
+                f"UPDATE processing_jobs SET {assignments} WHERE job_id = ?",
+                (*fields.values(), job_id),
+            )
+            conn.commit()
+        finally:
+            conn.close()
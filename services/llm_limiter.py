@@ -0,0 +1,146 @@
+import asyncio
+import inspect
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+
+
+T = TypeVar("T")
+
+def retryable_errors() -> Tuple[type, ...]:
+    """Ошибки, после которых запрос повторяется (openai импортируется при первом обращении, а не при запуске)."""
+    from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+
+    return (APIConnectionError, APITimeoutError, InternalServerError, RateLimitError, asyncio.TimeoutError)
+
+
+class LLMQueueTimeout(Exception):
+    """Запрос не дождался свободного слота для обращения к модели."""
+
+
+class LLMStreamTimeout(Exception):
+    """Потоковый ответ модели не завершился за отведённое время."""
+
+
+class LLMCallLimiter:
+    """
+    Глобальное ограничение числа одновременных запросов к LLM.
+    Запросы сверх лимита ждут в очереди; каждый вызов получает таймаут и
+    повторяется с экспоненциальной задержкой при временных ошибках.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        queue_timeout: float,
+        request_timeout: float,
+        max_retries: int,
+        backoff_base: float,
+    ) -> None:
+        if max_concurrency <= 0:
+            raise ValueError("max_concurrency must be positive")
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.request_timeout = request_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._waiting = 0
+        self._active = 0
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Создаём семафор внутри работающего event loop (в Python 3.9 он привязывается к loop при создании)
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    @property
+    def queue_depth(self) -> int:
+        return self._waiting
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Занимает слот на время обращения к модели.
+        Возвращает словарь статистики очереди: queue_depth (сколько запросов ждали
+        перед этим), wait_time (сек.) и attempts (заполняется в call_with_retry).
+        """
+        semaphore = self._get_semaphore()
+        stats: Dict[str, Any] = {"queue_depth": self._waiting, "wait_time": 0.0, "attempts": 0}
+        started = time.perf_counter()
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise LLMQueueTimeout(f"No free AI slot within {self.queue_timeout:.0f} s")
+        finally:
+            self._waiting -= 1
+        stats["wait_time"] = round(time.perf_counter() - started, 4)
+        self._active += 1
+        try:
+            yield stats
+        finally:
+            self._active -= 1
+            semaphore.release()
+
+    async def call_with_retry(self, call: Callable[[], Awaitable[T]], stats: Dict[str, Any]) -> T:
+        """Выполняет вызов с таймаутом и повторами при временных ошибках."""
+        attempt = 0
+        while True:
+            attempt += 1
+            stats["attempts"] = attempt
+            try:
+                return await asyncio.wait_for(call(), timeout=self.request_timeout)
+            except retryable_errors():
+                if attempt > self.max_retries:
+                    raise
+                delay = self.backoff_base * (2 ** (attempt - 1))
+                await asyncio.sleep(delay + random.uniform(0, self.backoff_base))
+
+    async def iterate_stream(self, stream: Any) -> AsyncIterator[Any]:
+        """
+        Перебирает фрагменты потокового ответа с общим сроком request_timeout:
+        зависший посреди ответа поток не держит слот бесконечно. По истечении
+        срока поток закрывается и бросается LLMStreamTimeout.
+        """
+        deadline = time.monotonic() + self.request_timeout
+        iterator = stream.__aiter__()
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                chunk = await asyncio.wait_for(iterator.__anext__(), timeout=remaining)
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                close = getattr(stream, "close", None)
+                if close is not None:
+                    closing = close()
+                    if inspect.isawaitable(closing):
+                        await closing
+                raise LLMStreamTimeout(f"AI response was not completed within {self.request_timeout:.0f} s")
+            yield chunk
+
+    async def run(self, call: Callable[[], Awaitable[T]]) -> Tuple[T, Dict[str, Any]]:
+        """Ожидает слот, выполняет вызов с повторами и возвращает (результат, статистика)."""
+        async with self.slot() as stats:
+            result = await self.call_with_retry(call, stats)
+        return result, stats
+
+
+def get_llm_limiter() -> LLMCallLimiter:
+    return LLMCallLimiter(
+        max_concurrency=int(os.getenv("AI_MAX_CONCURRENCY", "4")),
+        queue_timeout=float(os.getenv("AI_QUEUE_TIMEOUT", "120")),
+        request_timeout=float(os.getenv("AI_REQUEST_TIMEOUT", "180")),
+        max_retries=int(os.getenv("AI_MAX_RETRIES", "2")),
+        backoff_base=float(os.getenv("AI_RETRY_BACKOFF", "1.0")),
+    )
@@ -1,17 +1,28 @@
 import os
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 from dotenv import load_dotenv
-from openai import OpenAI
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
 
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 load_dotenv(BASE_DIR / ".env")
 
+DEFAULT_OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+
 
-def get_openrouter_client() -> OpenAI:
+def get_openrouter_client() -> "AsyncOpenAI":
     api_key = os.getenv("OPENROUTER_API_KEY")
     if not api_key:
         raise RuntimeError("OPENROUTER_API_KEY is not configured")
 
-    return OpenAI(base_url="https://openrouter.ai/api/v1", api_key=api_key)
+    # openai импортируется только при создании клиента: это заметная часть времени запуска
+    from openai import AsyncOpenAI
+
+    # OPENROUTER_BASE_URL позволяет направить запросы на локальный OpenAI-совместимый mock-сервер
+    base_url = os.getenv("OPENROUTER_BASE_URL", DEFAULT_OPENROUTER_BASE_URL)
+    # Повторы и таймауты выполняет services.llm_limiter, поэтому встроенные повторы клиента отключены
+    return AsyncOpenAI(base_url=base_url, api_key=api_key, max_retries=0)
@@ -0,0 +1,155 @@
+import inspect
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional
+
+
+class RateLimitExceeded(Exception):
+    """Бюджет пользователя исчерпан; retry_after — через сколько секунд его хватит на запрос."""
+
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(f"Rate limit exceeded, retry after {retry_after:.1f} s")
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class RateLimitBackend(ABC):
+    """
+    Хранилище корзин токенов «ключ → (токены, время обновления)».
+    Реализации должны быть потокобезопасными и выполнять take атомарно.
+    Реализация без какого-либо из абстрактных методов не создаётся (TypeError).
+    """
+
+    @abstractmethod
+    def take(self, key: str, cost: float, rate: float, capacity: float, required: float) -> float:
+        """
+        Пополняет корзину по времени (rate токенов в секунду, не больше capacity).
+        Если в ней не меньше required токенов, списывает cost (баланс может уйти
+        в минус) и возвращает 0; иначе ничего не списывает и возвращает число
+        секунд до накопления required токенов.
+        """
+
+    @abstractmethod
+    def reset(self, key: Optional[str] = None) -> None:
+        ...
+
+
+class NullRateLimitBackend(RateLimitBackend):
+    """Ограничение отключено."""
+
+    def take(self, key: str, cost: float, rate: float, capacity: float, required: float) -> float:
+        return 0.0
+
+    def reset(self, key: Optional[str] = None) -> None:
+        pass
+
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    """
+    Корзины в памяти процесса: у каждого воркера uvicorn свой бюджет.
+    Корзины, которые успели бы заполниться целиком, периодически удаляются —
+    новая корзина создаётся полной, так что результат не меняется.
+    """
+
+    PRUNE_INTERVAL = 1024
+
+    def __init__(self) -> None:
+        # ключ -> [токены, время обновления, момент полного заполнения]
+        self._buckets: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+        self._operations = 0
+
+    def take(self, key: str, cost: float, rate: float, capacity: float, required: float) -> float:
+        now = time.monotonic()
+        with self._lock:
+            self._operations += 1
+            if self._operations % self.PRUNE_INTERVAL == 0:
+                self._prune(now)
+
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                tokens = capacity
+            else:
+                tokens = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+            if tokens < required:
+                self._store(key, tokens, now, rate, capacity)
+                return (required - tokens) / rate
+            self._store(key, tokens - cost, now, rate, capacity)
+            return 0.0
+
+    def _store(self, key: str, tokens: float, now: float, rate: float, capacity: float) -> None:
+        self._buckets[key] = [tokens, now, now + (capacity - tokens) / rate]
+
+    def _prune(self, now: float) -> None:
+        expired = [key for key, bucket in self._buckets.items() if bucket[2] <= now]
+        for key in expired:
+            del self._buckets[key]
+
+    def reset(self, key: Optional[str] = None) -> None:
+        with self._lock:
+            if key is None:
+                self._buckets.clear()
+            else:
+                self._buckets.pop(key, None)
+
+
+class WorkRateLimiter:
+    """
+    Ограничение объёма работы на пользователя по алгоритму корзины токенов.
+    Стоимость запроса — объём работы (для спектров — число точек по всем спектрам),
+    бюджет пополняется со скоростью rate единиц в секунду и копится до capacity.
+    Запрос дороже capacity пропускается при полной корзине и уводит баланс в минус,
+    поэтому следующий запрос ждёт, пока долг не погасится.
+    """
+
+    def __init__(self, backend: RateLimitBackend, scope: str, rate: float, capacity: float) -> None:
+        if rate <= 0 or capacity <= 0:
+            raise ValueError("rate and capacity must be positive")
+        self.backend = backend
+        self.scope = scope
+        self.rate = rate
+        self.capacity = capacity
+
+    def _key(self, key: str) -> str:
+        return f"{self.scope}:{key}"
+
+    def acquire(self, key: str, cost: float) -> None:
+        """Списывает cost до выполнения работы или бросает RateLimitExceeded."""
+        required = min(max(cost, 0.0), self.capacity)
+        retry_after = self.backend.take(self._key(key), cost, self.rate, self.capacity, required)
+        if retry_after > 0:
+            raise RateLimitExceeded(retry_after)
+
+    def charge(self, key: str, cost: float) -> None:
+        """Списывает cost после выполнения работы, объём которой заранее неизвестен."""
+        self.backend.take(self._key(key), cost, self.rate, self.capacity, -math.inf)
+
+
+RateLimitBackendFactory = Callable[..., RateLimitBackend]
+
+_BACKEND_FACTORIES: Dict[str, RateLimitBackendFactory] = {
+    "memory": lambda **_: MemoryRateLimitBackend(),
+    "none": lambda **_: NullRateLimitBackend(),
+}
+
+
+def register_rate_limit_backend(name: str, factory: RateLimitBackendFactory) -> None:
+    """
+    Регистрирует реализацию хранилища корзин (например, общую для узлов) под именем для RATE_LIMIT_BACKEND.
+    Класс с нереализованными методами отклоняется сразу, а не при первом запросе.
+    """
+    if inspect.isabstract(factory):
+        raise TypeError(f"Rate limit backend {name} does not implement all RateLimitBackend methods")
+    _BACKEND_FACTORIES[name] = factory
+
+
+def create_rate_limit_backend(name: str, **options: Any) -> RateLimitBackend:
+    factory = _BACKEND_FACTORIES.get(name)
+    if factory is None:
+        raise ValueError(f"Unknown rate limit backend: {name}")
+    return factory(**options)
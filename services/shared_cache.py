@@ -0,0 +1,265 @@
+import inspect
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class CacheBackend(ABC):
+    """
+    Интерфейс общего кэша «ключ → байты».
+    Реализации должны быть потокобезопасными; значения ограничены по суммарному
+    размеру, при переполнении вытесняются давно не использованные записи.
+    Реализация без какого-либо из абстрактных методов не создаётся (TypeError).
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> bool:
+        """Сохраняет значение; возвращает False, если оно не помещается в кэш."""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        ...
+
+    @abstractmethod
+    def clear(self) -> None:
+        ...
+
+    def contains(self, key: str) -> bool:
+        return self.get(key) is not None
+
+
+class NullCacheBackend(CacheBackend):
+    """Кэш отключён."""
+
+    def get(self, key: str) -> Optional[bytes]:
+        return None
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> bool:
+        return False
+
+    def delete(self, key: str) -> None:
+        pass
+
+    def clear(self) -> None:
+        pass
+
+
+class MemoryCacheBackend(CacheBackend):
+    """LRU-кэш в памяти процесса (один воркер, тесты)."""
+
+    def __init__(self, max_bytes: int) -> None:
+        if max_bytes <= 0:
+            raise ValueError("max_bytes must be positive")
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[bytes, Optional[float]]]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> bool:
+        if len(value) > self.max_bytes:
+            return False
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, expires_at)
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+        return True
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[0])
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """
+    Кэш в файле SQLite, общий для всех воркеров uvicorn на одном узле.
+    Режим WAL позволяет читать параллельно с записью; суммарный размер значений
+    ведётся триггерами в той же транзакции, поэтому ограничение max_bytes
+    соблюдается при записи из нескольких процессов. Соединение открывается
+    при первом обращении — отдельное для каждого потока.
+    """
+
+    # accessed_at обновляется не чаще раза в этот интервал, чтобы чтения не превращались в записи
+    ACCESS_RESOLUTION = 1.0
+
+    def __init__(self, path: str, max_bytes: int, mmap_bytes: int = 64 * 1024 * 1024) -> None:
+        if max_bytes <= 0:
+            raise ValueError("max_bytes must be positive")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.mmap_bytes = mmap_bytes
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            # Чтение через mmap: страницы файла делятся между процессами через кэш ОС
+            conn.execute(f"PRAGMA mmap_size={int(self.mmap_bytes)}")
+            self._ensure_schema(conn)
+            self._local.conn = conn
+        return conn
+
+    def _ensure_schema(self, conn: sqlite3.Connection) -> None:
+        with self._schema_lock:
+            if self._schema_ready:
+                return
+            conn.executescript(
+                """
+                BEGIN IMMEDIATE;
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires_at REAL,
+                    accessed_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_cache_entries_accessed ON cache_entries(accessed_at);
+                CREATE TABLE IF NOT EXISTS cache_meta (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    total_size INTEGER NOT NULL
+                );
+                INSERT OR IGNORE INTO cache_meta (id, total_size) VALUES (1, 0);
+                CREATE TRIGGER IF NOT EXISTS cache_entries_insert AFTER INSERT ON cache_entries BEGIN
+                    UPDATE cache_meta SET total_size = total_size + NEW.size WHERE id = 1;
+                END;
+                CREATE TRIGGER IF NOT EXISTS cache_entries_delete AFTER DELETE ON cache_entries BEGIN
+                    UPDATE cache_meta SET total_size = total_size - OLD.size WHERE id = 1;
+                END;
+                CREATE TRIGGER IF NOT EXISTS cache_entries_update AFTER UPDATE OF size ON cache_entries BEGIN
+                    UPDATE cache_meta SET total_size = total_size - OLD.size + NEW.size WHERE id = 1;
+                END;
+                COMMIT;
+                """
+            )
+            self._schema_ready = True
+
+    def get(self, key: str) -> Optional[bytes]:
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT value, expires_at, accessed_at FROM cache_entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires_at, accessed_at = row
+        now = time.time()
+        if expires_at is not None and expires_at <= now:
+            conn.execute("DELETE FROM cache_entries WHERE key = ? AND expires_at <= ?", (key, now))
+            return None
+        if now - accessed_at >= self.ACCESS_RESOLUTION:
+            conn.execute("UPDATE cache_entries SET accessed_at = ? WHERE key = ?", (now, key))
+        return bytes(value)
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> bool:
+        size = len(value)
+        if size > self.max_bytes:
+            return False
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                """
+                INSERT INTO cache_entries (key, value, size, expires_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    value = excluded.value,
+                    size = excluded.size,
+                    expires_at = excluded.expires_at,
+                    accessed_at = excluded.accessed_at
+                """,
+                (key, sqlite3.Binary(value), size, expires_at, now),
+            )
+            self._evict(conn, now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return True
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        (total,) = conn.execute("SELECT total_size FROM cache_meta WHERE id = 1").fetchone()
+        if total <= self.max_bytes:
+            return
+        conn.execute("DELETE FROM cache_entries WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        (total,) = conn.execute("SELECT total_size FROM cache_meta WHERE id = 1").fetchone()
+        excess = total - self.max_bytes
+        victims = []
+        for key, size in conn.execute("SELECT key, size FROM cache_entries ORDER BY accessed_at"):
+            if excess <= 0:
+                break
+            victims.append((key,))
+            excess -= size
+        conn.executemany("DELETE FROM cache_entries WHERE key = ?", victims)
+
+    def delete(self, key: str) -> None:
+        self._connection().execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        self._connection().execute("DELETE FROM cache_entries")
+
+
+CacheFactory = Callable[..., CacheBackend]
+
+_BACKEND_FACTORIES: Dict[str, CacheFactory] = {
+    "sqlite": lambda path, max_bytes, **_: SQLiteCacheBackend(path, max_bytes),
+    "memory": lambda max_bytes, **_: MemoryCacheBackend(max_bytes),
+    "none": lambda **_: NullCacheBackend(),
+}
+
+
+def register_cache_backend(name: str, factory: CacheFactory) -> None:
+    """
+    Регистрирует реализацию кэша (например, сетевую) под именем для SHARED_CACHE_BACKEND.
+    Класс с нереализованными методами отклоняется сразу, а не при первом обращении.
+    """
+    if inspect.isabstract(factory):
+        raise TypeError(f"Cache backend {name} does not implement all CacheBackend methods")
+    _BACKEND_FACTORIES[name] = factory
+
+
+def create_cache_backend(name: str, **options: Any) -> CacheBackend:
+    factory = _BACKEND_FACTORIES.get(name)
+    if factory is None:
+        raise ValueError(f"Unknown cache backend: {name}")
+    return factory(**options)
@@ -0,0 +1,91 @@
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional, TypeVar
+
+from starlette.concurrency import run_in_threadpool
+
+
+T = TypeVar("T")
+
+
+class SupersedingRunner:
+    """
+    Выполняет синхронные расчёты в пуле потоков так, что актуален только последний.
+    Новый submit() отменяет предыдущий расчёт: поток получает сигнал через
+    функцию is_cancelled и должен сам прерваться на ближайшей контрольной точке.
+    """
+
+    def __init__(self) -> None:
+        self._cancel_event: Optional[threading.Event] = None
+        self._task: Optional["asyncio.Future"] = None
+        self.generation = 0
+
+    def submit(self, func: Callable[[Callable[[], bool]], T]) -> "asyncio.Future[T]":
+        """Запускает func(is_cancelled), отменяя предыдущий расчёт."""
+        self.cancel()
+        cancel_event = threading.Event()
+        self._cancel_event = cancel_event
+        self.generation += 1
+        task = asyncio.ensure_future(run_in_threadpool(func, cancel_event.is_set))
+        task.add_done_callback(_consume_exception)
+        self._task = task
+        return task
+
+    def is_current(self, generation: int) -> bool:
+        return generation == self.generation
+
+    def cancel(self) -> None:
+        if self._cancel_event is not None:
+            self._cancel_event.set()
+        self._cancel_event = None
+        self._task = None
+
+
+def _consume_exception(task: "asyncio.Future") -> None:
+    # Результат отменённого расчёта никто не ждёт: забираем исключение, чтобы не было предупреждений
+    if not task.cancelled():
+        task.exception()
+
+
+class RequestCoalescer:
+    """
+    Объединение запросов в пределах сессии.
+    Одинаковый (по ключу) запрос, пока расчёт идёт, ждёт тот же результат;
+    новый отличающийся запрос той же сессии отменяет предыдущий расчёт.
+    """
+
+    def __init__(self, max_sessions: int = 1024) -> None:
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, _SessionSlot]" = OrderedDict()
+
+    def _slot(self, session_id: str) -> "_SessionSlot":
+        slot = self._sessions.pop(session_id, None)
+        if slot is None:
+            slot = _SessionSlot()
+            while len(self._sessions) >= self.max_sessions:
+                self._sessions.popitem(last=False)
+        self._sessions[session_id] = slot
+        return slot
+
+    async def run(self, session_id: str, key: str, func: Callable[[Callable[[], bool]], T]) -> T:
+        slot = self._slot(session_id)
+        future = slot.future
+        if future is None or slot.key != key or future.done():
+            future = slot.runner.submit(func)
+            slot.key = key
+            slot.future = future
+        try:
+            # shield: отключение одного из ожидающих клиентов не отменяет общий расчёт
+            return await asyncio.shield(future)
+        finally:
+            if slot.future is future and future.done():
+                slot.key = None
+                slot.future = None
+
+
+class _SessionSlot:
+    def __init__(self) -> None:
+        self.runner = SupersedingRunner()
+        self.key: Optional[str] = None
+        self.future: Optional["asyncio.Future"] = None
@@ -0,0 +1,81 @@
+import hashlib
+import re
+import struct
+import sys
+from array import array
+from typing import List, Optional, Tuple
+
+from services.shared_cache import CacheBackend
+
+
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+# Заголовок записи: число точек спектра; далее частоты и амплитуды как float64 (little-endian)
+_HEADER = struct.Struct("<Q")
+
+
+def sha256_hex(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def is_sha256(value: str) -> bool:
+    return bool(SHA256_PATTERN.match(value))
+
+
+def _encode_spectrum(frequencies: List[float], amplitudes: List[float]) -> bytes:
+    values = array("d", frequencies)
+    values.extend(amplitudes)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return _HEADER.pack(len(frequencies)) + values.tobytes()
+
+
+def _decode_spectrum(blob: bytes) -> Tuple[List[float], List[float]]:
+    (count,) = _HEADER.unpack_from(blob)
+    values = array("d")
+    values.frombytes(blob[_HEADER.size:])
+    if sys.byteorder == "big":
+        values.byteswap()
+    if len(values) != 2 * count:
+        raise ValueError("Повреждённая запись кэша")
+    data = values.tolist()
+    return data[:count], data[count:]
+
+
+class ParsedUploadStore:
+    """
+    Уже распарсенные файлы по SHA-256 исходных байтов.
+    Хранятся в общем кэше (см. services.shared_cache) в бинарном виде,
+    поэтому доступны всем воркерам и вытесняются при превышении лимита размера;
+    вытесненный файл клиент просто загрузит повторно.
+    """
+
+    KEY_PREFIX = "parsed:"
+
+    def __init__(self, cache: CacheBackend) -> None:
+        self.cache = cache
+
+    def _key(self, digest: str) -> str:
+        if not is_sha256(digest):
+            raise ValueError(f"Некорректный SHA-256: {digest}")
+        return self.KEY_PREFIX + digest
+
+    def contains(self, digest: str) -> bool:
+        return is_sha256(digest) and self.cache.contains(self._key(digest))
+
+    def get(self, digest: str) -> Optional[Tuple[List[float], List[float]]]:
+        if not is_sha256(digest):
+            return None
+        blob = self.cache.get(self._key(digest))
+        if blob is None:
+            return None
+        try:
+            return _decode_spectrum(blob)
+        except (struct.error, ValueError):
+            self.cache.delete(self._key(digest))
+            return None
+
+    def put(self, digest: str, frequencies: List[float], amplitudes: List[float]) -> None:
+        if len(frequencies) != len(amplitudes):
+            raise ValueError("Число частот и амплитуд не совпадает")
+        self.cache.set(self._key(digest), _encode_spectrum(frequencies, amplitudes))
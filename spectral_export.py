@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import io
+import json
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+
+from data_processing import ArrayLike, iter_formatted_rows, stack_spectra
+
+try:
+    import h5py  # type: ignore
+except Exception:
+    h5py = None  # type: ignore
+
+try:
+    import pyarrow as pa  # type: ignore
+    import pyarrow.parquet as pq  # type: ignore
+except Exception:
+    pa = None  # type: ignore
+    pq = None  # type: ignore
+
+
+# Формат -> (расширение файла, MIME-тип)
+EXPORT_FORMATS: Dict[str, Tuple[str, str]] = {
+    "npz": (".npz", "application/octet-stream"),
+    "hdf5": (".h5", "application/x-hdf5"),
+    "parquet": (".parquet", "application/vnd.apache.parquet"),
+}
+
+
+PROCESSED_METADATA_FILENAME = "processing_metadata.txt"
+MEAN_SPECTRUM_FILENAME = "mean_spectrum.csv"
+
+
+def processed_entry_name(original_name: str, index: int) -> str:
+    """Имя файла обработанного спектра: <имя без расширения>_processed.txt."""
+    base_name = f"spectrum_{index + 1}" if not original_name else original_name.split('.')[0]
+    return f"{base_name}_processed.txt"
+
+
+def format_params_header(params: Dict[str, Any]) -> str:
+    return "".join(f"# {param}: {value}\n" for param, value in params.items())
+
+
+def iter_processed_spectrum_text(
+    original_name: str,
+    frequencies: ArrayLike,
+    amplitudes: ArrayLike,
+    params: Dict[str, Any],
+) -> Iterator[str]:
+    """Текст обработанного спектра (формат файлов ZIP-экспорта) блоками."""
+    header = "# Processed spectral data (after transformations)\n"
+    header += f"# Original file: {original_name}\n"
+    header += "# Processing parameters:\n"
+    header += format_params_header(params)
+    header += "# Wavenumber (cm⁻¹)\tIntensity (a.u.)\n"
+    yield header
+    yield from iter_formatted_rows([frequencies, amplitudes], "%r\t%r\n")
+
+
+def processing_metadata_text(params: Dict[str, Any], export_date: Optional[datetime] = None) -> str:
+    """Содержимое processing_metadata.txt."""
+    export_date = export_date or datetime.now()
+    meta_content = "# Processing metadata\n"
+    meta_content += f"# Export date: {export_date.strftime('%Y-%m-%d %H:%M:%S')}\n"
+    meta_content += "# Applied transformations:\n"
+    if params.get('remove_spikes'):
+        meta_content += "# - Spike removal applied\n"
+    if params.get('remove_baseline'):
+        meta_content += "# - Baseline removal applied\n"
+    if params.get('apply_smoothing'):
+        meta_content += "# - Smoothing applied\n"
+    if params.get('normalize'):
+        meta_content += "# - Normalization applied\n"
+    meta_content += "# Parameters:\n"
+    meta_content += format_params_header(params)
+    return meta_content
+
+
+def iter_mean_spectrum_csv(
+    frequencies: ArrayLike,
+    mean_amplitude: ArrayLike,
+    params: Dict[str, Any],
+) -> Iterator[str]:
+    """
+    CSV среднего спектра: строка метаданных, заголовок и строки frequency,mean_amplitude.
+    Как и прежний экспорт, после последней строки перевода строки нет.
+    """
+    metadata_lines = ["# Metadata"]
+    for param, value in params.items():
+        metadata_lines.append(f"# {param}: {value}")
+    yield "; ".join(metadata_lines) + "\n#frequency,mean_amplitude\n"
+    previous: Optional[str] = None
+    for chunk in iter_formatted_rows([frequencies, mean_amplitude], "%r,%r\n"):
+        if previous is not None:
+            yield previous
+        previous = chunk
+    if previous:
+        yield previous[:-1]
+
+
+class ExportFormatUnavailable(RuntimeError):
+    """Для формата не установлена необязательная зависимость."""
+
+
+def available_formats() -> Dict[str, bool]:
+    return {
+        "npz": True,
+        "hdf5": h5py is not None,
+        "parquet": pa is not None,
+    }
+
+
+def _metadata_json(file_names: Sequence[str], params: Dict[str, Any], lengths: np.ndarray) -> str:
+    return json.dumps(
+        {
+            "file_names": list(file_names),
+            "lengths": lengths.tolist(),
+            "params": params,
+        },
+        ensure_ascii=False,
+        default=str,
+    )
+
+
+def _write_npz(
+    frequencies: np.ndarray,
+    amplitudes: np.ndarray,
+    lengths: np.ndarray,
+    file_names: Sequence[str],
+    params: Dict[str, Any],
+) -> bytes:
+    buffer = io.BytesIO()
+    np.savez(
+        buffer,
+        frequencies=frequencies,
+        amplitudes=amplitudes,
+        lengths=lengths,
+        file_names=np.array(list(file_names), dtype=str),
+        metadata=np.array(_metadata_json(file_names, params, lengths)),
+    )
+    return buffer.getvalue()
+
+
+def _write_hdf5(
+    frequencies: np.ndarray,
+    amplitudes: np.ndarray,
+    lengths: np.ndarray,
+    file_names: Sequence[str],
+    params: Dict[str, Any],
+) -> bytes:
+    if h5py is None:
+        raise ExportFormatUnavailable("Для экспорта в HDF5 установите пакет h5py")
+
+    buffer = io.BytesIO()
+    with h5py.File(buffer, "w") as handle:
+        handle.create_dataset("frequencies", data=frequencies)
+        handle.create_dataset("amplitudes", data=amplitudes, chunks=True)
+        handle.create_dataset("lengths", data=lengths)
+        handle.create_dataset("file_names", data=list(file_names), dtype=h5py.string_dtype())
+        handle.attrs["metadata"] = _metadata_json(file_names, params, lengths)
+    return buffer.getvalue()
+
+
+def _write_parquet(
+    frequencies: np.ndarray,
+    amplitudes: np.ndarray,
+    lengths: np.ndarray,
+    file_names: Sequence[str],
+    params: Dict[str, Any],
+) -> bytes:
+    """
+    Одна строка на спектр; частоты и амплитуды — столбцы фиксированной длины,
+    поэтому матрица читается обратно без копирования через flatten().reshape().
+    """
+    if pa is None:
+        raise ExportFormatUnavailable("Для экспорта в Parquet установите пакет pyarrow")
+
+    n_spectra, n_points = amplitudes.shape
+    if frequencies.ndim == 1:
+        frequencies = np.broadcast_to(frequencies, amplitudes.shape)
+    list_type = pa.list_(pa.float64(), n_points)
+    table = pa.table(
+        {
+            "file_name": pa.array(list(file_names), type=pa.string()),
+            "length": pa.array(lengths),
+            "frequencies": pa.FixedSizeListArray.from_arrays(
+                pa.array(np.ascontiguousarray(frequencies).ravel()), type=list_type
+            ),
+            "amplitudes": pa.FixedSizeListArray.from_arrays(pa.array(amplitudes.ravel()), type=list_type),
+        }
+    )
+    table = table.replace_schema_metadata({"metadata": _metadata_json(file_names, params, lengths)})
+
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression="zstd")
+    return buffer.getvalue()
+
+
+_WRITERS: Dict[str, Callable[..., bytes]] = {
+    "npz": _write_npz,
+    "hdf5": _write_hdf5,
+    "parquet": _write_parquet,
+}
+
+
+def export_spectra_matrix(
+    fmt: str,
+    frequencies_list: Sequence[ArrayLike],
+    amplitudes_list: Sequence[ArrayLike],
+    file_names: Sequence[str],
+    params: Optional[Dict[str, Any]] = None,
+) -> bytes:
+    """
+    Экспорт набора спектров одной матрицей в бинарный/колоночный формат.
+    :param fmt: 'npz', 'hdf5' или 'parquet'
+    :return: содержимое файла
+    """
+    writer = _WRITERS.get(fmt)
+    if writer is None:
+        raise ValueError(f"Неизвестный формат экспорта: {fmt}")
+    if len(file_names) != len(amplitudes_list):
+        raise ValueError("Число имён файлов и спектров не совпадает")
+
+    frequencies, amplitudes, lengths = stack_spectra(frequencies_list, amplitudes_list)
+    return writer(frequencies, amplitudes, lengths, file_names, params or {})
@@ -0,0 +1,276 @@
+from __future__ import annotations
+
+import json
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy.signal import find_peaks
+
+from data_processing import ArrayLike
+
+
+SUPPORTED_METRICS = ("pearson", "cosine")
+
+
+def _normalize_rows(matrix: np.ndarray, metric: str) -> np.ndarray:
+    """
+    Нормирует строки матрицы так, чтобы скалярное произведение строк давало
+    корреляцию Пирсона (metric='pearson') или косинусное сходство (metric='cosine').
+    Строки с нулевой нормой обнуляются.
+    """
+    if metric not in SUPPORTED_METRICS:
+        raise ValueError(f"Неизвестная метрика: {metric}")
+
+    rows = np.asarray(matrix, dtype=np.float64)
+    if metric == "pearson":
+        rows = rows - rows.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(rows, axis=1, keepdims=True)
+    safe_norms = np.where(norms > 0, norms, 1.0)
+    normalized = np.where(norms > 0, rows / safe_norms, 0.0)
+    return np.ascontiguousarray(normalized, dtype=np.float32)
+
+
+class SpectralLibrary:
+    """
+    Библиотека эталонных спектров.
+    Эталоны хранятся передискретизированными на общую сетку волновых чисел в одной
+    непрерывной матрице (n_references × n_grid); поиск top-k выполняется одним
+    матричным произведением с нормированной матрицей. Дополнительный инвертированный
+    индекс по положениям пиков позволяет заранее отсечь заведомо непохожие эталоны.
+    """
+
+    def __init__(
+        self,
+        grid: ArrayLike,
+        peak_tolerance: float = 8.0,
+        peak_prominence: float = 0.05,
+    ) -> None:
+        grid_array = np.asarray(grid, dtype=np.float64)
+        if grid_array.ndim != 1 or grid_array.size < 2:
+            raise ValueError("Сетка должна быть одномерным массивом минимум из двух точек")
+        if np.any(np.diff(grid_array) <= 0):
+            raise ValueError("Сетка должна строго возрастать")
+        if peak_tolerance <= 0:
+            raise ValueError("peak_tolerance должен быть положительным")
+
+        self.grid = grid_array
+        self.peak_tolerance = float(peak_tolerance)
+        self.peak_prominence = float(peak_prominence)
+        self.names: List[str] = []
+        self.metadata: List[Dict[str, Any]] = []
+        self._matrix = np.empty((0, grid_array.size), dtype=np.float32)
+        self._normalized: Dict[str, np.ndarray] = {}
+        self._peak_positions: List[np.ndarray] = []
+        # Инвертированный индекс: все пики всех эталонов, отсортированные по положению
+        self._index_positions: Optional[np.ndarray] = None
+        self._index_owners: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_range(cls, min_freq: float, max_freq: float, step: float, **kwargs: Any) -> "SpectralLibrary":
+        if step <= 0 or max_freq <= min_freq:
+            raise ValueError("Некорректные параметры сетки библиотеки")
+        return cls(np.arange(min_freq, max_freq + step / 2, step), **kwargs)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._matrix
+
+    def resample(self, frequencies: ArrayLike, amplitudes: ArrayLike) -> np.ndarray:
+        """Передискретизирует спектр на сетку библиотеки (за пределами диапазона — крайние значения)."""
+        freq = np.asarray(frequencies, dtype=np.float64)
+        ampl = np.asarray(amplitudes, dtype=np.float64)
+        if freq.size == 0 or freq.size != ampl.size:
+            raise ValueError("Массивы частот и амплитуд пусты или имеют разную длину")
+
+        order = np.argsort(freq, kind="stable")
+        return np.interp(self.grid, freq[order], ampl[order])
+
+    def _coverage(self, frequencies: ArrayLike) -> np.ndarray:
+        freq = np.asarray(frequencies, dtype=np.float64)
+        return (self.grid >= freq.min()) & (self.grid <= freq.max())
+
+    def _detect_peaks(self, row: np.ndarray, grid: np.ndarray) -> np.ndarray:
+        span = float(row.max() - row.min())
+        if span <= 0:
+            return np.empty(0, dtype=np.float64)
+        peaks, _ = find_peaks(row, prominence=self.peak_prominence * span)
+        return grid[peaks]
+
+    def add_references(
+        self,
+        references: Sequence[Tuple[str, ArrayLike, ArrayLike, Optional[Dict[str, Any]]]],
+    ) -> List[int]:
+        """
+        Добавляет эталоны (name, frequencies, amplitudes, metadata) одним блоком.
+        :return: индексы добавленных эталонов
+        """
+        if not references:
+            return []
+
+        rows = np.empty((len(references), self.grid.size), dtype=np.float32)
+        for row_index, (_, frequencies, amplitudes, _) in enumerate(references):
+            rows[row_index] = self.resample(frequencies, amplitudes)
+
+        start = len(self.names)
+        self._matrix = np.ascontiguousarray(np.vstack([self._matrix, rows]))
+        self._normalized.clear()
+
+        for offset, (name, _, _, metadata) in enumerate(references):
+            self.names.append(str(name))
+            self.metadata.append(dict(metadata or {}))
+            self._peak_positions.append(self._detect_peaks(rows[offset].astype(np.float64), self.grid))
+        self._index_positions = None
+        self._index_owners = None
+
+        return list(range(start, start + len(references)))
+
+    def add_reference(
+        self,
+        name: str,
+        frequencies: ArrayLike,
+        amplitudes: ArrayLike,
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> int:
+        return self.add_references([(name, frequencies, amplitudes, metadata)])[0]
+
+    def normalized_matrix(self, metric: str = "pearson") -> np.ndarray:
+        """Нормированная матрица эталонов на всей сетке (кэшируется до изменения библиотеки)."""
+        if metric not in self._normalized:
+            self._normalized[metric] = _normalize_rows(self._matrix, metric)
+        return self._normalized[metric]
+
+    def _peak_index(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self._index_positions is None or self._index_owners is None:
+            counts = [positions.size for positions in self._peak_positions]
+            if sum(counts):
+                positions = np.concatenate(self._peak_positions)
+                owners = np.repeat(np.arange(len(counts)), counts)
+            else:
+                positions = np.empty(0, dtype=np.float64)
+                owners = np.empty(0, dtype=np.int64)
+            order = np.argsort(positions, kind="stable")
+            self._index_positions = positions[order]
+            self._index_owners = owners[order]
+        return self._index_positions, self._index_owners
+
+    def prefilter_by_peaks(self, peak_positions: ArrayLike, min_shared_peaks: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Отбирает эталоны, у которых есть хотя бы min_shared_peaks пиков в пределах
+        peak_tolerance от пиков запроса.
+        :return: кортеж (индексы эталонов, число совпавших пиков)
+        """
+        positions, owners = self._peak_index()
+        query_peaks = np.asarray(peak_positions, dtype=np.float64)
+        lower = np.searchsorted(positions, query_peaks - self.peak_tolerance, side="left")
+        upper = np.searchsorted(positions, query_peaks + self.peak_tolerance, side="right")
+
+        shared = np.zeros(len(self.names), dtype=np.int64)
+        for start, stop in zip(lower, upper):
+            if stop > start:
+                shared[np.unique(owners[start:stop])] += 1
+
+        candidates = np.flatnonzero(shared >= max(1, min_shared_peaks))
+        return candidates, shared[candidates]
+
+    def search(
+        self,
+        frequencies: ArrayLike,
+        amplitudes: ArrayLike,
+        top_k: int = 5,
+        metric: str = "pearson",
+        prefilter: bool = False,
+        min_shared_peaks: int = 1,
+    ) -> Dict[str, Any]:
+        """
+        Ищет top_k наиболее похожих эталонов.
+        Сходство считается только на участке сетки, покрытом спектром запроса.
+        """
+        if metric not in SUPPORTED_METRICS:
+            raise ValueError(f"Неизвестная метрика: {metric}")
+        if top_k <= 0:
+            raise ValueError("top_k должен быть положительным")
+
+        query = self.resample(frequencies, amplitudes)
+        coverage = self._coverage(frequencies)
+        if not np.any(coverage):
+            raise ValueError("Спектр не пересекается с сеткой библиотеки")
+
+        query_peaks = self._detect_peaks(query[coverage], self.grid[coverage])
+        if len(self.names) == 0:
+            return {"matches": [], "candidates": 0, "library_size": 0, "query_peaks": query_peaks.tolist()}
+
+        if prefilter:
+            candidate_ids, shared_counts = self.prefilter_by_peaks(query_peaks, min_shared_peaks)
+        else:
+            candidate_ids = np.arange(len(self.names))
+            shared_counts = None
+
+        if candidate_ids.size == 0:
+            return {"matches": [], "candidates": 0, "library_size": len(self.names), "query_peaks": query_peaks.tolist()}
+
+        if np.all(coverage):
+            references = self.normalized_matrix(metric)[candidate_ids]
+            query_vector = _normalize_rows(query[np.newaxis, :], metric)[0]
+        else:
+            references = _normalize_rows(self._matrix[np.ix_(candidate_ids, np.flatnonzero(coverage))], metric)
+            query_vector = _normalize_rows(query[coverage][np.newaxis, :], metric)[0]
+
+        scores = references @ query_vector
+        k = min(top_k, scores.size)
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind="stable")]
+
+        matches = []
+        for position in best:
+            ref_id = int(candidate_ids[position])
+            match = {
+                "id": ref_id,
+                "name": self.names[ref_id],
+                "score": float(scores[position]),
+                "metadata": self.metadata[ref_id],
+            }
+            if shared_counts is not None:
+                match["shared_peaks"] = int(shared_counts[position])
+            matches.append(match)
+
+        return {
+            "matches": matches,
+            "candidates": int(candidate_ids.size),
+            "library_size": len(self.names),
+            "query_peaks": query_peaks.tolist(),
+        }
+
+    def save(self, path: str) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as handle:
+            np.savez(
+                handle,
+                grid=self.grid,
+                matrix=self._matrix,
+                names=np.array(self.names, dtype=str),
+                metadata=np.array(json.dumps(self.metadata, ensure_ascii=False)),
+                settings=np.array([self.peak_tolerance, self.peak_prominence]),
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "SpectralLibrary":
+        with np.load(path, allow_pickle=False) as data:
+            peak_tolerance, peak_prominence = data["settings"].tolist()
+            library = cls(data["grid"], peak_tolerance=peak_tolerance, peak_prominence=peak_prominence)
+            matrix = data["matrix"]
+            names = data["names"].tolist()
+            metadata = json.loads(str(data["metadata"]))
+
+        library.add_references([
+            (name, library.grid, row, meta)
+            for name, row, meta in zip(names, matrix, metadata)
+        ])
+        return library
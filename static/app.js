@@ -12,6 +12,13 @@ let peakTableData = null;
 let draggedFiles = [];
 let latestMeanAmplitude = [];
 const PRESET_DEFAULT_NAME = 'Свободно';
+// Настройки отрисовки: при большом общем числе точек линии рисуются через WebGL (scattergl)
+const plotSettings = {
+    webglPointThreshold: 20000
+};
+// Последние отрисованные трассы по uid: неизменившиеся массивы переиспользуются,
+// чтобы Plotly.react перерисовывал только трассы с новыми данными
+let plotTraceCache = new Map();
 let presetState = {};
 let presetsLocked = false;
 console.log('app.js loaded successfully');
@@ -153,14 +160,21 @@ async function refreshPresetSlots() {
         return;
     }
     try {
-        const response = await fetch('/presets', { credentials: 'include' });
-        if (redirectIfUnauthorized(response, 'Войдите, чтобы сохранять пресеты.')) {
-            lockPresetPanel('Войдите, чтобы сохранять пресеты.');
-            presetState = {};
-            return;
+        // Все пресеты вместе с параметрами: один запрос на страницу, браузер перепроверяет его по ETag
+        const items = [];
+        let after = 0;
+        while (after !== null) {
+            const response = await fetch(`/presets/bulk?after=${after}`, { credentials: 'include' });
+            if (redirectIfUnauthorized(response, 'Войдите, чтобы сохранять пресеты.')) {
+                lockPresetPanel('Войдите, чтобы сохранять пресеты.');
+                presetState = {};
+                return;
+            }
+            const data = await response.json();
+            items.push(...(Array.isArray(data.items) ? data.items : []));
+            after = typeof data.next_after === 'number' ? data.next_after : null;
         }
-        const data = await response.json();
-        renderPresetSlots(Array.isArray(data) ? data : []);
+        renderPresetSlots(items);
         unlockPresetPanel();
         hideAuthBanner();
         updatePresetsHint('Пресет сохранён.');
@@ -510,18 +524,74 @@ function truncateFileName(name, length = 20) {
     return name.length > length ? name.slice(0, length - 3) + '...' : name;
 }
 
-function plotCombinedSpectrum(allFrequencies, allAmplitudes, fileNames, allPeaks, mean_amplitude, std_amplitude, showOnlyMeanStd, boxplotStats, title, movingAverages = []) {
+// Поэлементное сравнение двух массивов чисел
+function arraysEqual(a, b) {
+    if (a === b) {
+        return true;
+    }
+    if (!a || !b || a.length !== b.length) {
+        return false;
+    }
+    for (let i = 0; i < a.length; i++) {
+        if (a[i] !== b[i]) {
+            return false;
+        }
+    }
+    return true;
+}
+
+// Стабильные идентификаторы спектров: имя файла и порядковый номер среди одноимённых
+function buildSpectrumKeys(fileNames, count) {
+    const seen = {};
+    const keys = [];
+    for (let i = 0; i < count; i++) {
+        const name = fileNames[i] || `Файл ${i + 1}`;
+        seen[name] = (seen[name] || 0) + 1;
+        keys.push(`${name}#${seen[name]}`);
+    }
+    return keys;
+}
+
+// Подставляет прежние ссылки на массивы x/y, если данные трассы не изменились
+function reuseUnchangedTraceData(plotData) {
+    const nextCache = new Map();
+    plotData.forEach((trace) => {
+        const previous = plotTraceCache.get(trace.uid);
+        if (previous) {
+            ['x', 'y'].forEach((key) => {
+                if (arraysEqual(previous[key], trace[key])) {
+                    trace[key] = previous[key];
+                }
+            });
+        }
+        nextCache.set(trace.uid, trace);
+    });
+    plotTraceCache = nextCache;
+}
+
+// Очищает график и кэш трасс
+function purgeSpectrumPlot() {
+    Plotly.purge('spectrum_plot');
+    document.getElementById('spectrum_plot').innerHTML = '';
+    plotTraceCache = new Map();
+}
+
+function plotCombinedSpectrum(allFrequencies, allAmplitudes, fileNames, allPeaks, mean_amplitude, std_amplitude, showOnlyMeanStd, boxplotStats, title, movingAverages = [], meanFrequencies = null) {
     const plotData = [];
     const lineColors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b'];
+    const spectrumKeys = buildSpectrumKeys(fileNames, allFrequencies.length);
+    const totalPoints = allFrequencies.reduce((sum, freq) => sum + freq.length, 0);
+    const lineType = totalPoints > plotSettings.webglPointThreshold ? 'scattergl' : 'scatter';
 
     
     // Линейные графики для каждого файла
     if (!showOnlyMeanStd) {
         for (let i = 0; i < allFrequencies.length; i++) {
             plotData.push({
+                uid: `spectrum:${spectrumKeys[i]}`,
                 x: allFrequencies[i],
                 y: allAmplitudes[i],
-                type: 'scatter',
+                type: lineType,
                 mode: 'lines',
                 name: truncateFileName(fileNames[i]) || `Файл ${i + 1}`,
                 line: { 
@@ -544,6 +614,7 @@ function plotCombinedSpectrum(allFrequencies, allAmplitudes, fileNames, allPeaks
                 const peakY = allPeaks[i].map(index => allAmplitudes[i][index]);
 
                 plotData.push({
+                    uid: `peaks:${spectrumKeys[i]}`,
                     x: peakX,
                     y: peakY,
                     type: 'scatter',
@@ -568,9 +639,10 @@ function plotCombinedSpectrum(allFrequencies, allAmplitudes, fileNames, allPeaks
             // Скользящая средняя (если есть)
             if (movingAverages && movingAverages[i] && movingAverages[i].length > 0) {
                 plotData.push({
+                    uid: `moving-average:${spectrumKeys[i]}`,
                     x: allFrequencies[i],
                     y: movingAverages[i],
-                    type: 'scatter',
+                    type: lineType,
                     mode: 'lines',
                     name: `Ср. ${truncateFileName(fileNames[i])}`,
                     line: { 
@@ -595,11 +667,14 @@ function plotCombinedSpectrum(allFrequencies, allAmplitudes, fileNames, allPeaks
 
     // Среднее значение и стандартное отклонение
     if (mean_amplitude && mean_amplitude.length > 0 && std_amplitude && std_amplitude.length > 0) {
+        // При прореживании сервер присылает собственную сетку частот для среднего спектра
+        const meanX = meanFrequencies && meanFrequencies.length === mean_amplitude.length ? meanFrequencies : allFrequencies[0];
         plotData.push(
             {
-                x: allFrequencies[0],
+                uid: 'mean',
+                x: meanX,
                 y: mean_amplitude,
-                type: 'scatter',
+                type: lineType,
                 mode: 'lines',
                 name: 'Среднее значение',
                 line: { color: 'red', width: 3 },
@@ -611,9 +686,10 @@ function plotCombinedSpectrum(allFrequencies, allAmplitudes, fileNames, allPeaks
                 }
             },
             {
-                x: allFrequencies[0],
+                uid: 'mean-plus-sigma',
+                x: meanX,
                 y: mean_amplitude.map((m, idx) => m + std_amplitude[idx]),
-                type: 'scatter',
+                type: lineType,
                 mode: 'lines',
                 name: 'Среднее + 1σ',
                 line: { color: 'orange', width: 2, dash: 'dot' },
@@ -625,9 +701,10 @@ function plotCombinedSpectrum(allFrequencies, allAmplitudes, fileNames, allPeaks
                 }
             },
             {
-                x: allFrequencies[0],
+                uid: 'mean-minus-sigma',
+                x: meanX,
                 y: mean_amplitude.map((m, idx) => m - std_amplitude[idx]),
-                type: 'scatter',
+                type: lineType,
                 mode: 'lines',
                 name: 'Среднее - 1σ',
                 line: { color: 'orange', width: 2, dash: 'dot' },
@@ -651,6 +728,7 @@ function plotCombinedSpectrum(allFrequencies, allAmplitudes, fileNames, allPeaks
         }
 
         plotData.push({
+            uid: 'boxplot',
             y: allAmplitudes.flat(),
             x: positions.flatMap((pos, idx) => Array(allAmplitudes[idx].length).fill(pos)),
             type: 'box',
@@ -686,26 +764,62 @@ function plotCombinedSpectrum(allFrequencies, allAmplitudes, fileNames, allPeaks
             yanchor: 'top',
             xanchor: 'left'
         },
-        margin: { l: 60, r: 150, b: 60, t: 80, pad: 4 }
+        margin: { l: 60, r: 150, b: 60, t: 80, pad: 4 },
+        // Сохраняем масштаб и скрытые пользователем трассы между обновлениями
+        uirevision: 'spectra'
     };
 
-    Plotly.newPlot('spectrum_plot', plotData, layout, { responsive: true }).then(function() {
+    reuseUnchangedTraceData(plotData);
+    Plotly.react('spectrum_plot', plotData, layout, { responsive: true }).then(function() {
         initLegendHover();
     });
 }
 
-async function uploadFiles() {
-    if (draggedFiles.length === 0) {
-        alert('Пожалуйста, выберите файлы для загрузки');
-        return;
+// SHA-256 содержимого файла в hex (для загрузки по хэшам)
+async function hashFile(file) {
+    const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+    return Array.from(new Uint8Array(digest), (byte) => byte.toString(16).padStart(2, '0')).join('');
+}
+
+// Загружает файлы спектров: сначала отправляет SHA-256, затем передаёт только файлы,
+// которых ещё нет на сервере. Возвращает { files, frequencies, amplitudes } в исходном порядке
+// или null, если требуется авторизация.
+async function uploadSpectraFiles(files) {
+    let hashes = null;
+    if (window.crypto && crypto.subtle) {
+        try {
+            hashes = await Promise.all(files.map(hashFile));
+        } catch (error) {
+            console.warn('Не удалось вычислить SHA-256, файлы будут загружены целиком', error);
+        }
     }
 
-    const formData = new FormData();
-    for (let file of draggedFiles) {
-        formData.append('files', file);
+    let known = {};
+    let filesToUpload = files;
+    if (hashes) {
+        const lookupResponse = await fetch('/uploads/lookup', {
+            credentials: 'include',
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ hashes }),
+        });
+        if (redirectIfUnauthorized(lookupResponse)) {
+            return null;
+        }
+        if (lookupResponse.ok) {
+            const lookup = await lookupResponse.json();
+            known = lookup.known || {};
+            filesToUpload = files.filter((file, index) => !(hashes[index] in known));
+        }
     }
 
-    try {
+    let uploaded = { files: [], hashes: [], frequencies: [], amplitudes: [] };
+    if (filesToUpload.length > 0) {
+        const formData = new FormData();
+        for (let file of filesToUpload) {
+            formData.append('files', file);
+        }
+
         const response = await fetch('/upload_files', {
             credentials: 'include',
             method: 'POST',
@@ -713,14 +827,45 @@ async function uploadFiles() {
         });
 
         if (redirectIfUnauthorized(response)) {
-            return;
+            return null;
         }
 
         if (!response.ok) {
             throw new Error(`Ошибка сервера: ${response.status}`);
         }
 
-        const result = await response.json();
+        uploaded = await response.json();
+    }
+
+    if (!hashes || !Array.isArray(uploaded.hashes)) {
+        return uploaded;
+    }
+
+    const spectraByHash = { ...known };
+    uploaded.hashes.forEach((hash, index) => {
+        spectraByHash[hash] = {
+            frequencies: uploaded.frequencies[index],
+            amplitudes: uploaded.amplitudes[index]
+        };
+    });
+    return {
+        files: files.map((file) => file.name),
+        frequencies: hashes.map((hash) => spectraByHash[hash].frequencies),
+        amplitudes: hashes.map((hash) => spectraByHash[hash].amplitudes)
+    };
+}
+
+async function uploadFiles() {
+    if (draggedFiles.length === 0) {
+        alert('Пожалуйста, выберите файлы для загрузки');
+        return;
+    }
+
+    try {
+        const result = await uploadSpectraFiles(draggedFiles);
+        if (!result) {
+            return;
+        }
 
         if (result.frequencies && result.amplitudes) {
             // Заменяем данные полностью
@@ -818,8 +963,7 @@ function removeUploadedFile(index) {
 function rebuildPlot() {
     if (allFrequencies.length === 0) {
         // Если файлов нет, очищаем график
-        Plotly.purge('spectrum_plot');
-        document.getElementById('spectrum_plot').innerHTML = '';
+        purgeSpectrumPlot();
         return;
     }
     
@@ -842,105 +986,661 @@ document.addEventListener('DOMContentLoaded', function() {
     updateUploadedFilesList();
 });
 
-// Основной цикл обработки: отправляем параметры на бэкенд и обновляем визуализацию
-async function processAndPlot() {
-    console.log("Обработка данных...");
+// Результат обработки в полном разрешении (для экспорта при включённом прореживании)
+let fullResolutionResult = null;
 
-    if (allFrequencies.length === 0 || allAmplitudes.length === 0) {
-        alert("Данные не загружены. Сначала загрузите файлы.");
-        return;
+// Ширина графика в пикселях для серверного прореживания или null для полного разрешения
+function getDisplayWidth() {
+    const checkbox = document.getElementById('display_downsample');
+    const plot = document.getElementById('spectrum_plot');
+    if (!checkbox || !checkbox.checked || !plot) {
+        return null;
     }
+    return Math.max(200, Math.round(plot.clientWidth || window.innerWidth));
+}
 
-    try {
-        const getNumberValue = (id, defaultValue) => {
-            const val = document.getElementById(id).value;
-            return val === '' ? defaultValue : Number(val);
-        };
+// Возвращает результат обработки без прореживания, при необходимости повторно запрашивая сервер
+async function ensureFullResolutionResult() {
+    if (fullResolutionResult) {
+        return fullResolutionResult;
+    }
+    const params = { ...processedData.params, display_width: null };
+    const result = await requestServerProcessing(params, { stream: 'export' });
+    if (!result) {
+        throw new Error('Требуется авторизация');
+    }
+    fullResolutionResult = result;
+    return fullResolutionResult;
+}
 
-        const params = {
-            frequencies: allFrequencies,
-            amplitudes: allAmplitudes,
-            remove_baseline: document.getElementById('remove_baseline').checked,
-            apply_smoothing: document.getElementById('apply_smoothing').checked,
-            normalize: document.getElementById('normalize').checked,
-            find_peaks: document.getElementById('find_peaks').checked,
-            calculate_mean_std: document.getElementById('calculate_mean_std').checked,
-            calculate_boxplot: document.getElementById('calculate_boxplot').checked,
-            lam: getNumberValue('lam', 1000),
-            p: getNumberValue('p', 0.001),
-            window_length: getNumberValue('window_length', 25),
-            polyorder: getNumberValue('polyorder', 2),
-            width: getNumberValue('peak_width', 1),
-            prominence: getNumberValue('peak_prominence', 1),
-            min_freq: getNumberValue('min_freq', 0),
-            max_freq: getNumberValue('max_freq', 10000),
-            show_moving_average: document.getElementById('show_moving_average').checked,
-            moving_average_window: getNumberValue('moving_average_window', 10)
-        };
+// Собирает параметры обработки из элементов управления (формат запроса /process_data)
+function collectProcessingParams() {
+    const getNumberValue = (id, defaultValue) => {
+        const val = document.getElementById(id).value;
+        return val === '' ? defaultValue : Number(val);
+    };
 
-        const response = await fetch('/process_data', {
-            credentials: 'include',
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify(params),
-        });
+    return {
+        frequencies: allFrequencies,
+        amplitudes: allAmplitudes,
+        remove_spikes: document.getElementById('remove_spikes').checked,
+        spike_threshold: getNumberValue('spike_threshold', 7),
+        remove_baseline: document.getElementById('remove_baseline').checked,
+        baseline_method: document.getElementById('baseline_method').value || 'als',
+        auto_lam: document.getElementById('auto_lam').checked,
+        apply_smoothing: document.getElementById('apply_smoothing').checked,
+        normalize: document.getElementById('normalize').checked,
+        find_peaks: document.getElementById('find_peaks').checked,
+        calculate_mean_std: document.getElementById('calculate_mean_std').checked,
+        calculate_boxplot: document.getElementById('calculate_boxplot').checked,
+        lam: getNumberValue('lam', 1000),
+        p: getNumberValue('p', 0.001),
+        window_length: getNumberValue('window_length', 25),
+        polyorder: getNumberValue('polyorder', 2),
+        smoothing_method: document.getElementById('smoothing_method').value || 'savgol',
+        smoothing_lam: getNumberValue('smoothing_lam', 100),
+        derivative: getNumberValue('derivative', 0),
+        width: getNumberValue('peak_width', 1),
+        prominence: getNumberValue('peak_prominence', 1),
+        min_freq: getNumberValue('min_freq', 0),
+        max_freq: getNumberValue('max_freq', 10000),
+        show_moving_average: document.getElementById('show_moving_average').checked,
+        moving_average_window: getNumberValue('moving_average_window', 10),
+        display_width: getDisplayWidth(),
+        lod_method: 'lttb'
+    };
+}
 
-        if (redirectIfUnauthorized(response)) {
+// Последние ответы /process_data с их ETag: повторный запрос с теми же параметрами
+// отправляется с If-None-Match и при 304 берётся из этого кэша
+const processingResponseCache = new Map();
+const PROCESSING_CACHE_LIMIT = 4;
+
+// Идентификатор вкладки: сервер отменяет устаревший расчёт только в пределах потока «вкладка + назначение»
+const PROCESSING_TAB_ID = Math.random().toString(36).slice(2, 12);
+
+// Отправляет параметры на сервер; возвращает null, если требуется авторизация.
+// signal (AbortController) позволяет прервать запрос, ставший неактуальным;
+// stream разделяет независимые запросы (отображение, экспорт, проверка паритета).
+async function requestServerProcessing(params, { signal, stream = 'display' } = {}) {
+    const body = JSON.stringify(params);
+    const cached = processingResponseCache.get(body);
+    const headers = {
+        'Content-Type': 'application/json',
+        'X-Processing-Stream': `${PROCESSING_TAB_ID}:${stream}`,
+    };
+    if (cached) {
+        headers['If-None-Match'] = cached.etag;
+    }
+
+    const response = await fetch('/process_data', {
+        credentials: 'include',
+        method: 'POST',
+        headers,
+        body,
+        signal,
+    });
+
+    if (redirectIfUnauthorized(response)) {
+        return null;
+    }
+
+    if (response.status === 304 && cached) {
+        return cached.result;
+    }
+
+    // Расчёт заменён более новым запросом того же потока — для вызывающего это отмена, а не ошибка
+    if (response.status === 409) {
+        const error = new Error('Запрос заменён более новым');
+        error.name = 'AbortError';
+        throw error;
+    }
+
+    if (response.status === 429) {
+        const retryAfter = response.headers.get('Retry-After') || '?';
+        throw new Error(`Превышен лимит обработки, повторите через ${retryAfter} с.`);
+    }
+
+    if (!response.ok) {
+        const errorText = await response.text();
+        throw new Error(`Ошибка сервера: ${response.status} ${errorText}`);
+    }
+
+    const result = await response.json();
+    const etag = response.headers.get('ETag');
+    if (etag) {
+        processingResponseCache.delete(body);
+        processingResponseCache.set(body, { etag, result });
+        if (processingResponseCache.size > PROCESSING_CACHE_LIMIT) {
+            processingResponseCache.delete(processingResponseCache.keys().next().value);
+        }
+    }
+    return result;
+}
+
+// ===== Локальный предпросмотр в Web Worker =====
+// Диапазон частот, SNV, скользящее среднее и среднее/СКО считаются в браузере;
+// базовая линия, Савицкий-Голай и поиск пиков — только на сервере.
+let previewWorker = null;
+let previewRequestId = 0;
+const previewCallbacks = new Map();
+let previewDebounceTimer = null;
+
+// Лениво создаёт воркер предпросмотра; null, если браузер не поддерживает Web Worker
+function getPreviewWorker() {
+    if (previewWorker || typeof Worker === 'undefined') {
+        return previewWorker;
+    }
+    // URL с отпечатком содержимого задаётся шаблоном, чтобы воркер кэшировался как остальная статика
+    const workerUrlMeta = document.querySelector('meta[name="preview-worker-url"]');
+    previewWorker = new Worker(workerUrlMeta ? workerUrlMeta.content : '/static/preview_worker.js');
+    previewWorker.onmessage = (event) => {
+        const { id, result, error } = event.data;
+        const callbacks = previewCallbacks.get(id);
+        if (!callbacks) {
             return;
         }
+        previewCallbacks.delete(id);
+        if (error) {
+            callbacks.reject(new Error(error));
+        } else {
+            callbacks.resolve(result);
+        }
+    };
+    return previewWorker;
+}
 
-        if (!response.ok) {
-            const errorText = await response.text();
-            throw new Error(`Ошибка сервера: ${response.status} ${errorText}`);
+// Можно ли обойтись без сервера при текущих параметрах
+function canPreviewLocally(params) {
+    return !params.remove_spikes
+        && !params.remove_baseline
+        && !params.apply_smoothing
+        && !params.derivative
+        && !params.find_peaks
+        && !params.calculate_boxplot
+        && getPreviewWorker() !== null;
+}
+
+// Выполняет дешёвые преобразования в воркере и возвращает результат в формате /process_data
+function runPreviewInWorker(params) {
+    const worker = getPreviewWorker();
+    const id = ++previewRequestId;
+    const frequencies = params.frequencies.map((arr) => Float64Array.from(arr));
+    const amplitudes = params.amplitudes.map((arr) => Float64Array.from(arr));
+    const transfer = [...frequencies, ...amplitudes].map((arr) => arr.buffer);
+
+    return new Promise((resolve, reject) => {
+        previewCallbacks.set(id, { resolve, reject });
+        worker.postMessage({
+            id,
+            frequencies,
+            amplitudes,
+            params: {
+                min_freq: params.min_freq,
+                max_freq: params.max_freq,
+                normalize: params.normalize,
+                calculate_mean_std: params.calculate_mean_std,
+                show_moving_average: params.show_moving_average,
+                moving_average_window: params.moving_average_window
+            }
+        }, transfer);
+    }).then((result) => ({
+        frequencies: result.frequencies.map((arr) => Array.from(arr)),
+        processed_amplitudes: result.processed_amplitudes.map((arr) => Array.from(arr)),
+        peaks: params.frequencies.map(() => []),
+        peaks_values: params.frequencies.map(() => []),
+        peaks_info: params.frequencies.map(() => []),
+        mean_amplitude: Array.from(result.mean_amplitude),
+        mean_frequencies: Array.from(result.mean_frequencies),
+        std_amplitude: Array.from(result.std_amplitude),
+        boxplot_stats: [],
+        moving_averages: result.moving_averages.map((arr) => Array.from(arr)),
+        display: null,
+        preview: true
+    }));
+}
+
+// Сравнивает локальный предпросмотр с эталонным ответом сервера (включается параметром ?preview_parity=1)
+async function checkPreviewParity(params, localResult, tolerance = 1e-9) {
+    const serverResult = await requestServerProcessing({ ...params, display_width: null }, { stream: 'parity' });
+    if (!serverResult) {
+        return null;
+    }
+    const maxDiff = (a, b) => {
+        if (a.length !== b.length) {
+            return Infinity;
         }
+        let diff = 0;
+        for (let i = 0; i < a.length; i++) {
+            diff = Math.max(diff, Math.abs(a[i] - b[i]) / Math.max(1, Math.abs(b[i])));
+        }
+        return diff;
+    };
+    const report = {};
+    ['frequencies', 'processed_amplitudes', 'moving_averages'].forEach((key) => {
+        const local = localResult[key] || [];
+        const remote = serverResult[key] || [];
+        report[key] = local.length !== remote.length
+            ? Infinity
+            : local.reduce((worst, arr, idx) => Math.max(worst, maxDiff(arr, remote[idx])), 0);
+    });
+    ['mean_amplitude', 'std_amplitude'].forEach((key) => {
+        report[key] = maxDiff(localResult[key] || [], serverResult[key] || []);
+    });
+    const ok = Object.values(report).every((diff) => diff <= tolerance);
+    (ok ? console.info : console.warn)('Паритет предпросмотра с сервером:', ok ? 'OK' : 'РАСХОЖДЕНИЕ', report);
+    return { ok, report };
+}
 
-        const result = await response.json();
+// Показывает lam, подобранные сервером для базовой линии (диапазон по спектрам)
+function updateAutoLamHint(result, params) {
+    const hint = document.getElementById('auto_lam_hint');
+    if (!hint) {
+        return;
+    }
+    const lams = Array.isArray(result.baseline_lam) ? result.baseline_lam : [];
+    if (!params.remove_baseline || !params.auto_lam || lams.length === 0) {
+        hint.hidden = true;
+        return;
+    }
+    const low = Math.min(...lams);
+    const high = Math.max(...lams);
+    hint.textContent = low === high
+        ? `Подобранный lam: ${low.toExponential(1)}`
+        : `Подобранный lam: ${low.toExponential(1)} – ${high.toExponential(1)}`;
+    hint.hidden = false;
+}
 
-        processedData = {
+// Показывает, сколько точек заменено при удалении всплесков
+function updateSpikesHint(result, params) {
+    const hint = document.getElementById('spikes_hint');
+    if (!hint) {
+        return;
+    }
+    const spikes = Array.isArray(result.spikes) ? result.spikes : [];
+    if (!params.remove_spikes || spikes.length === 0) {
+        hint.hidden = true;
+        return;
+    }
+    const total = spikes.reduce((sum, points) => sum + points.length, 0);
+    const affected = spikes.filter((points) => points.length > 0).length;
+    hint.textContent = `Заменено точек: ${total} (спектров со всплесками: ${affected} из ${spikes.length})`;
+    hint.hidden = false;
+}
+
+// Отрисовывает результат обработки (серверный или локальный) и обновляет состояние
+function renderProcessingResult(result, params) {
+    updateAutoLamHint(result, params);
+    updateSpikesHint(result, params);
+    processedData = {
+        frequencies: result.frequencies,
+        amplitudes: result.processed_amplitudes,
+        fileNames: fileNames, // Используем текущие fileNames
+        params: params,
+        downsampled: Boolean(result.display)
+    };
+    fullResolutionResult = result.display ? null : result;
+
+    const peaksInfo = Array.isArray(result.peaks_info) ? result.peaks_info : [];
+
+    if (Array.isArray(result.peaks) || hasAnyPeakInfo(peaksInfo)) {
+        // Кэшируем подготовленные данные по пикам, чтобы переиспользовать их при переключении чекбоксов
+        peakTableData = {
             frequencies: result.frequencies,
             amplitudes: result.processed_amplitudes,
-            fileNames: fileNames, // Используем текущие fileNames
-            params: params
+            peaks: Array.isArray(result.peaks) ? result.peaks : [],
+            peaksInfo,
+            fileNames: [...fileNames]
         };
+    } else {
+        peakTableData = null;
+    }
+
+    plotCombinedSpectrum(
+        result.frequencies,
+        result.processed_amplitudes,
+        fileNames, // Используем текущие fileNames
+        result.peaks || [],
+        result.mean_amplitude || [],
+        result.std_amplitude || [],
+        document.getElementById('show_only_mean_std').checked,
+        result.boxplot_stats || [],
+        "Обработанные спектры (" + result.frequencies.length + " файлов)",
+        result.moving_averages || [],
+        result.mean_frequencies || null
+    );
+    
+    window.latestMeanAmplitude = result.mean_amplitude;
+    updatePeakTableVisibility();
+}
 
-        const peaksInfo = Array.isArray(result.peaks_info) ? result.peaks_info : [];
+// ===== Фоновые задачи для больших наборов спектров =====
+// Крупные наборы обрабатываются и экспортируются через очередь /jobs с прогрессом,
+// чтобы не упираться в таймауты прокси хостинга
+const JOB_SPECTRA_THRESHOLD = 100;
+const JOB_POLL_INTERVAL_MS = 700;
+let activeJobId = null;
 
-        if (Array.isArray(result.peaks) || hasAnyPeakInfo(peaksInfo)) {
-            // Кэшируем подготовленные данные по пикам, чтобы переиспользовать их при переключении чекбоксов
-            peakTableData = {
-                frequencies: result.frequencies,
-                amplitudes: result.processed_amplitudes,
-                peaks: Array.isArray(result.peaks) ? result.peaks : [],
-                peaksInfo,
-                fileNames: [...fileNames]
-            };
-        } else {
-            peakTableData = null;
+function shouldUseBackgroundJob() {
+    return allFrequencies.length >= JOB_SPECTRA_THRESHOLD;
+}
+
+function showJobProgress(label, progress) {
+    const container = document.getElementById('job_progress');
+    if (!container) {
+        return;
+    }
+    const percent = Math.round((progress || 0) * 100);
+    container.hidden = false;
+    container.querySelector('.job-progress__bar').style.width = `${percent}%`;
+    container.querySelector('.job-progress__label').textContent = `${label}: ${percent}%`;
+}
+
+function hideJobProgress() {
+    const container = document.getElementById('job_progress');
+    if (container) {
+        container.hidden = true;
+    }
+}
+
+// Ставит задачу и ждёт её завершения.
+// Возвращает { response } с результатом, { cancelled: true } или { available: false } без входа в систему.
+async function runBackgroundJob(kind, payload, label) {
+    const submitResponse = await fetch(`/jobs/${kind}`, {
+        credentials: 'include',
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(payload),
+    });
+    if (submitResponse.status === 401) {
+        return { available: false };
+    }
+    if (!submitResponse.ok) {
+        const errorText = await submitResponse.text();
+        throw new Error(`Ошибка сервера: ${submitResponse.status} ${errorText}`);
+    }
+
+    let job = await submitResponse.json();
+    activeJobId = job.job_id;
+    try {
+        while (!['succeeded', 'failed', 'cancelled'].includes(job.status)) {
+            showJobProgress(label, job.progress);
+            await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+            const statusResponse = await fetch(`/jobs/${job.job_id}`, { credentials: 'include' });
+            if (!statusResponse.ok) {
+                throw new Error(`Ошибка сервера: ${statusResponse.status}`);
+            }
+            job = await statusResponse.json();
         }
+    } finally {
+        activeJobId = null;
+        hideJobProgress();
+    }
 
-        plotCombinedSpectrum(
-            result.frequencies,
-            result.processed_amplitudes,
-            fileNames, // Используем текущие fileNames
-            result.peaks || [],
-            result.mean_amplitude || [],
-            result.std_amplitude || [],
-            document.getElementById('show_only_mean_std').checked,
-            result.boxplot_stats || [],
-            "Обработанные спектры (" + result.frequencies.length + " файлов)",
-            result.moving_averages || []
-        );
-        
-        window.latestMeanAmplitude = result.mean_amplitude;
-        updatePeakTableVisibility();
+    if (job.status === 'cancelled') {
+        return { cancelled: true };
+    }
+    if (job.status === 'failed') {
+        throw new Error(job.error || 'Фоновая задача завершилась с ошибкой');
+    }
+
+    const resultResponse = await fetch(job.result_url, { credentials: 'include' });
+    if (!resultResponse.ok) {
+        throw new Error(`Ошибка сервера: ${resultResponse.status}`);
+    }
+    return { response: resultResponse };
+}
 
+async function cancelActiveJob() {
+    if (!activeJobId) {
+        return;
+    }
+    try {
+        await fetch(`/jobs/${activeJobId}`, { credentials: 'include', method: 'DELETE' });
     } catch (error) {
+        console.error('Не удалось отменить задачу', error);
+    }
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+    const cancelButton = document.querySelector('.job-progress__cancel');
+    if (cancelButton) {
+        cancelButton.addEventListener('click', cancelActiveJob);
+    }
+});
+
+// Поколение текущей обработки: отрисовывается только результат последнего вызова processAndPlot
+let processingGeneration = 0;
+let processingAbortController = null;
+
+// Основной цикл обработки: дешёвые конвейеры считаем локально, остальное — на бэкенде
+async function processAndPlot() {
+    console.log("Обработка данных...");
+
+    if (allFrequencies.length === 0 || allAmplitudes.length === 0) {
+        alert("Данные не загружены. Сначала загрузите файлы.");
+        return;
+    }
+
+    // Предыдущий запрос к серверу больше не нужен — прерываем его
+    const generation = ++processingGeneration;
+    if (processingAbortController) {
+        processingAbortController.abort();
+    }
+    const controller = new AbortController();
+    processingAbortController = controller;
+
+    try {
+        const params = collectProcessingParams();
+        let result = null;
+
+        if (canPreviewLocally(params)) {
+            try {
+                result = await runPreviewInWorker(params);
+                if (new URLSearchParams(window.location.search).has('preview_parity')) {
+                    checkPreviewParity(params, result).catch((error) => console.error('Проверка паритета не удалась', error));
+                }
+            } catch (previewError) {
+                // Ошибки и пограничные случаи разбирает сервер — он остаётся эталоном
+                console.warn('Локальный предпросмотр недоступен, обработка на сервере:', previewError.message);
+                result = null;
+            }
+        }
+
+        if (!result && shouldUseBackgroundJob()) {
+            const job = await runBackgroundJob('process', params, 'Обработка');
+            if (job.cancelled) {
+                return;
+            }
+            if (job.response) {
+                result = await job.response.json();
+            }
+        }
+
+        if (!result) {
+            result = await requestServerProcessing(params, { signal: controller.signal });
+            if (!result) {
+                return;
+            }
+        }
+
+        if (generation !== processingGeneration) {
+            return;
+        }
+        renderProcessingResult(result, params);
+
+    } catch (error) {
+        // Прерванный или устаревший запрос — не ошибка для пользователя
+        if (error.name === 'AbortError' || generation !== processingGeneration) {
+            return;
+        }
         console.error("Ошибка:", error);
         alert("Ошибка обработки: " + error.message);
+    } finally {
+        if (processingAbortController === controller) {
+            processingAbortController = null;
+        }
+    }
+}
+
+// Мгновенный предпросмотр при изменении дешёвых параметров (только если сервер не нужен)
+function initPreviewControls() {
+    const previewFieldIds = ['min_freq', 'max_freq', 'normalize', 'show_moving_average', 'moving_average_window', 'calculate_mean_std', 'show_only_mean_std'];
+    const schedulePreview = () => {
+        if (processedData.frequencies.length === 0 || allFrequencies.length === 0) {
+            return;
+        }
+        if (!canPreviewLocally(collectProcessingParams())) {
+            return;
+        }
+        clearTimeout(previewDebounceTimer);
+        previewDebounceTimer = setTimeout(processAndPlot, 150);
+    };
+    previewFieldIds.forEach((id) => {
+        const field = document.getElementById(id);
+        if (field) {
+            field.addEventListener('input', schedulePreview);
+            field.addEventListener('change', schedulePreview);
+        }
+    });
+}
+
+// ===== Живая обработка через WebSocket =====
+// Спектры отправляются на сервер один раз, дальше при изменении параметров
+// базовой линии, сглаживания и пиков уходят только дельты. Устаревшие расчёты сервер прерывает сам.
+const LIVE_PARAM_FIELD_IDS = ['spike_threshold', 'baseline_method', 'auto_lam', 'lam', 'p', 'window_length', 'polyorder', 'smoothing_method', 'smoothing_lam', 'derivative', 'peak_width', 'peak_prominence'];
+let liveSession = null;
+let liveDebounceTimer = null;
+
+// Параметры без самих спектров (их сессия хранит на сервере)
+function withoutSpectra(params) {
+    const { frequencies, amplitudes, ...rest } = params;
+    return rest;
+}
+
+function closeLiveSession() {
+    if (liveSession) {
+        liveSession.socket.close();
+        liveSession = null;
+    }
+}
+
+// Открывает сессию и привязывает к ней текущие спектры
+function openLiveSession(params) {
+    closeLiveSession();
+    const protocol = window.location.protocol === 'https:' ? 'wss' : 'ws';
+    const socket = new WebSocket(`${protocol}://${window.location.host}/ws/process`);
+    const session = {
+        socket,
+        seq: 1,
+        frequencies: allFrequencies,
+        amplitudes: allAmplitudes,
+        params: withoutSpectra(params)
+    };
+
+    socket.addEventListener('open', () => {
+        socket.send(JSON.stringify({
+            type: 'load',
+            seq: session.seq,
+            frequencies: session.frequencies,
+            amplitudes: session.amplitudes,
+            params: session.params
+        }));
+    });
+    socket.addEventListener('message', (event) => {
+        const message = JSON.parse(event.data);
+        // Отрисовываем только ответ на последнее изменение
+        if (message.seq !== session.seq || liveSession !== session) {
+            return;
+        }
+        if (message.type === 'result') {
+            renderProcessingResult(message.result, {
+                ...session.params,
+                frequencies: session.frequencies,
+                amplitudes: session.amplitudes
+            });
+        } else if (message.type === 'error') {
+            console.warn('Живая обработка:', message.detail);
+        }
+    });
+    socket.addEventListener('close', () => {
+        if (liveSession === session) {
+            liveSession = null;
+        }
+    });
+
+    liveSession = session;
+}
+
+// Отправляет изменившиеся параметры; при смене набора спектров открывает новую сессию
+function sendLiveDelta() {
+    const params = collectProcessingParams();
+    if (!liveSession || liveSession.frequencies !== allFrequencies || liveSession.amplitudes !== allAmplitudes) {
+        openLiveSession(params);
+        return;
+    }
+    if (liveSession.socket.readyState !== WebSocket.OPEN) {
+        liveSession.params = withoutSpectra(params);
+        return;
+    }
+
+    const next = withoutSpectra(params);
+    const delta = {};
+    Object.keys(next).forEach((key) => {
+        if (next[key] !== liveSession.params[key]) {
+            delta[key] = next[key];
+        }
+    });
+    if (Object.keys(delta).length === 0) {
+        return;
+    }
+    liveSession.params = next;
+    liveSession.seq += 1;
+    liveSession.socket.send(JSON.stringify({ type: 'params', seq: liveSession.seq, delta }));
+}
+
+// Живое обновление включается после первой обработки и только для серверного конвейера
+function initLiveProcessingControls() {
+    if (typeof WebSocket === 'undefined') {
+        return;
     }
+    const scheduleLiveUpdate = () => {
+        if (processedData.frequencies.length === 0 || allFrequencies.length === 0) {
+            return;
+        }
+        if (canPreviewLocally(collectProcessingParams())) {
+            return;
+        }
+        clearTimeout(liveDebounceTimer);
+        liveDebounceTimer = setTimeout(sendLiveDelta, 50);
+    };
+    LIVE_PARAM_FIELD_IDS.forEach((id) => {
+        const field = document.getElementById(id);
+        if (field) {
+            field.addEventListener('input', scheduleLiveUpdate);
+        }
+    });
 }
 
+document.addEventListener('DOMContentLoaded', function() {
+    initPreviewControls();
+    initLiveProcessingControls();
+});
+
 // Формирует архив с обработанными спектрами и инициирует скачивание
+const EXPORT_FILE_EXTENSIONS = {
+    zip: '.zip',
+    npz: '.npz',
+    hdf5: '.h5',
+    parquet: '.parquet'
+};
+
+function getExportFormat() {
+    const select = document.getElementById('export_format');
+    const format = select ? select.value : 'zip';
+    return Object.prototype.hasOwnProperty.call(EXPORT_FILE_EXTENSIONS, format) ? format : 'zip';
+}
+
 async function downloadProcessedData() {
     if (processedData.frequencies.length === 0) {
         alert("Нет обработанных данных для сохранения. Сначала обработайте файлы.");
@@ -948,24 +1648,53 @@ async function downloadProcessedData() {
     }
 
     try {
-        const response = await fetch('/export_processed_data', {
-            credentials: 'include',
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify(processedData),
-        });
+        // Экспорт всегда в полном разрешении, даже если график был прорежен
+        let exportData = processedData;
+        if (processedData.downsampled) {
+            const fullResult = await ensureFullResolutionResult();
+            exportData = {
+                ...processedData,
+                frequencies: fullResult.frequencies,
+                amplitudes: fullResult.processed_amplitudes
+            };
+        }
 
-        if (redirectIfUnauthorized(response, 'Войдите, чтобы выгружать данные.')) {
-            return;
+        const format = getExportFormat();
+        let response = null;
+        if (format === 'zip' && shouldUseBackgroundJob()) {
+            const job = await runBackgroundJob('export', exportData, 'Экспорт');
+            if (job.cancelled) {
+                return;
+            }
+            response = job.response || null;
         }
 
-        if (!response.ok) throw new Error('Ошибка экспорта');
+        if (!response) {
+            // Бинарные форматы — одна матрица спектров для NumPy/pandas/MATLAB
+            const url = format === 'zip' ? '/export_processed_data' : '/export_processed_matrix';
+            const body = format === 'zip' ? exportData : { ...exportData, format };
+            response = await fetch(url, {
+                credentials: 'include',
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify(body),
+            });
+
+            if (redirectIfUnauthorized(response, 'Войдите, чтобы выгружать данные.')) {
+                return;
+            }
+
+            if (!response.ok) {
+                const error = await response.json().catch(() => ({}));
+                throw new Error(error.detail || 'Ошибка экспорта');
+            }
+        }
 
         const blob = await response.blob();
         const url = window.URL.createObjectURL(blob);
         const a = document.createElement('a');
         a.href = url;
-        a.download = 'processed_spectra.zip';
+        a.download = `processed_spectra${EXPORT_FILE_EXTENSIONS[format]}`;
         document.body.appendChild(a);
         a.click();
         a.remove();
@@ -983,12 +1712,19 @@ async function downloadMeanSpectrum() {
     }
 
     const params = {
+        remove_spikes: document.getElementById('remove_spikes').checked,
+        spike_threshold: document.getElementById('spike_threshold').value || "7",
         remove_baseline: document.getElementById('remove_baseline').checked,
+        baseline_method: document.getElementById('baseline_method').value || "als",
+        auto_lam: document.getElementById('auto_lam').checked,
         lam: document.getElementById('lam').value || "1000",
         p: document.getElementById('p').value || "0.001",
         apply_smoothing: document.getElementById('apply_smoothing').checked,
         window_length: document.getElementById('window_length').value || "25",
         polyorder: document.getElementById('polyorder').value || "1",
+        smoothing_method: document.getElementById('smoothing_method').value || "savgol",
+        smoothing_lam: document.getElementById('smoothing_lam').value || "100",
+        derivative: document.getElementById('derivative').value || "0",
         normalize: document.getElementById('normalize').checked,
         find_peaks: document.getElementById('find_peaks').checked,
         peak_width: document.getElementById('peak_width').value || "1",
@@ -1005,6 +1741,11 @@ async function downloadMeanSpectrum() {
             mean_amplitude: window.latestMeanAmplitude,
             params: params
         };
+        if (processedData.downsampled) {
+            const fullResult = await ensureFullResolutionResult();
+            exportParams.frequencies = fullResult.mean_frequencies;
+            exportParams.mean_amplitude = fullResult.mean_amplitude;
+        }
 
         const response = await fetch('/export_mean_spectrum', {
             credentials: 'include',
@@ -1358,28 +2099,12 @@ async function addMoreFiles() {
         return;
     }
 
-    const formData = new FormData();
-    for (let file of draggedFiles) {
-        formData.append('files', file);
-    }
-
     try {
-        const response = await fetch('/upload_files', {
-            credentials: 'include',
-            method: 'POST',
-            body: formData,
-        });
-
-        if (redirectIfUnauthorized(response)) {
+        const result = await uploadSpectraFiles(draggedFiles);
+        if (!result) {
             return;
         }
 
-        if (!response.ok) {
-            throw new Error(`Ошибка сервера: ${response.status}`);
-        }
-
-        const result = await response.json();
-
         if (result.frequencies && result.amplitudes) {
             // Добавляем новые данные к существующим
             const newFrequencies = result.frequencies.map(arr => arr.map(Number));
@@ -1426,6 +2151,7 @@ function clearAllSpectra() {
     }
     
     if (confirm(`Очистить все ${allFrequencies.length} спектров?`)) {
+        closeLiveSession();
         // Очищаем все массивы данных
         allFrequencies = [];
         allAmplitudes = [];
@@ -1441,8 +2167,7 @@ function clearAllSpectra() {
         updatePeakTableVisibility();
         
         // Очищаем график
-        Plotly.purge('spectrum_plot');
-        document.getElementById('spectrum_plot').innerHTML = '';
+        purgeSpectrumPlot();
         
         // Очищаем список загруженных файлов
         const uploadedFilesContainer = document.getElementById('uploaded-files-container');
@@ -1506,7 +2231,10 @@ async function analyzeWithAI() {
 
         // Собираем параметры обработки
         const processingParams = {
+            remove_spikes: document.getElementById('remove_spikes').checked,
+            spike_threshold: document.getElementById('spike_threshold').value || 7,
             remove_baseline: document.getElementById('remove_baseline').checked,
+            baseline_method: document.getElementById('baseline_method').value || 'als',
             apply_smoothing: document.getElementById('apply_smoothing').checked,
             normalize: document.getElementById('normalize').checked,
             min_freq: document.getElementById('min_freq').value || 0,
@@ -1514,10 +2242,13 @@ async function analyzeWithAI() {
             lam: document.getElementById('lam').value || 1000,
             p: document.getElementById('p').value || 0.001,
             window_length: document.getElementById('window_length').value || 25,
-            polyorder: document.getElementById('polyorder').value || 1
+            polyorder: document.getElementById('polyorder').value || 1,
+            smoothing_method: document.getElementById('smoothing_method').value || 'savgol',
+            smoothing_lam: document.getElementById('smoothing_lam').value || 100,
+            derivative: document.getElementById('derivative').value || 0
         };
 
-        const response = await fetch('/analyze_spectrum', {
+        const response = await fetch('/analyze_spectrum/stream', {
             credentials: 'include',
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
@@ -1528,20 +2259,65 @@ async function analyzeWithAI() {
             }),
         });
 
-        const result = await response.json();
-
-        if (result.success) {
-            // Показываем результат анализа
-            showAIAnalysis(result.analysis);
-        } else {
-            alert("Ошибка анализа: " + result.analysis);
+        if (!response.ok) {
+            const error = await response.json().catch(() => ({}));
+            throw new Error(error.detail || `Ошибка сервера: ${response.status}`);
         }
+
+        // Текст анализа дописывается в окно по мере поступления токенов
+        const output = openAIAnalysisModal();
+        await readServerSentEvents(response, (eventName, data) => {
+            if (eventName === 'token') {
+                output.textContent += data.text;
+            } else if (eventName === 'error') {
+                output.textContent += (output.textContent ? '\n\n' : '') + data.analysis;
+            }
+        });
     } catch (error) {
         console.error("Ошибка:", error);
         alert("Ошибка при анализе: " + error.message);
     }
 }
 
+// Читает поток Server-Sent Events из ответа fetch и передаёт каждое событие обработчику
+async function readServerSentEvents(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    const dispatch = (rawEvent) => {
+        let eventName = 'message';
+        const dataLines = [];
+        rawEvent.split('\n').forEach((line) => {
+            if (line.startsWith('event:')) {
+                eventName = line.slice(6).trim();
+            } else if (line.startsWith('data:')) {
+                dataLines.push(line.slice(5).trimStart());
+            }
+        });
+        if (dataLines.length) {
+            onEvent(eventName, JSON.parse(dataLines.join('\n')));
+        }
+    };
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) {
+            break;
+        }
+        buffer += decoder.decode(value, { stream: true });
+        let boundary = buffer.indexOf('\n\n');
+        while (boundary !== -1) {
+            dispatch(buffer.slice(0, boundary));
+            buffer = buffer.slice(boundary + 2);
+            boundary = buffer.indexOf('\n\n');
+        }
+    }
+    if (buffer.trim()) {
+        dispatch(buffer);
+    }
+}
+
 // Показывает результат AI-анализа в модальном окне
 function showAIAnalysis(analysisText) {
     // Создаем модальное окно для отображения анализа
@@ -1764,6 +2540,15 @@ async function savePreset(slot) {
 
 async function loadPreset(slot) {
     try {
+        // Параметры уже получены массовым запросом /presets/bulk
+        const cached = presetState[slot];
+        if (cached && cached.payload) {
+            applyPresetPayload(cached.payload);
+            updatePresetsHint(RU.PRESET_LOADED(cached.name));
+            hideAuthBanner();
+            await processAndPlot();
+            return;
+        }
         const response = await fetch(`/presets/${slot}`, { credentials: 'include' });
         if (redirectIfUnauthorized(response, RU.AUTH_REQUIRED_PRESETS)) {
             lockPresetPanel(RU.AUTH_REQUIRED_PRESETS);
@@ -1814,7 +2599,8 @@ async function deletePreset(slot) {
     }
 }
 
-function showAIAnalysis(analysisText) {
+// Создаёт модальное окно AI-анализа и возвращает элемент для вывода текста
+function openAIAnalysisModal() {
     const modal = document.createElement('div');
     modal.style.position = 'fixed';
     modal.style.top = '50%';
@@ -1831,7 +2617,7 @@ function showAIAnalysis(analysisText) {
     modal.style.color = '#2d3748';
     modal.innerHTML = `
         <h2>Анализ AI</h2>
-        <div style="margin: 15px 0; white-space: pre-wrap; max-height: 60vh; overflow-y: auto;">${analysisText}</div>
+        <div class="ai-analysis-text" style="margin: 15px 0; white-space: pre-wrap; max-height: 60vh; overflow-y: auto;"></div>
         <div style="text-align: center;">
             <button onclick="this.parentElement.parentElement.remove()" style="padding: 8px 16px; background: #f56565; color: white; border: none; border-radius: 4px; cursor: pointer;">
                 Закрыть
@@ -1839,6 +2625,11 @@ function showAIAnalysis(analysisText) {
         </div>
     `;
     document.body.appendChild(modal);
+    return modal.querySelector('.ai-analysis-text');
+}
+
+function showAIAnalysis(analysisText) {
+    openAIAnalysisModal().textContent = analysisText;
 }
 
 // Fix drag overlay text if present
@@ -0,0 +1,168 @@
+// Web Worker для мгновенного предпросмотра дешёвых преобразований.
+// Повторяет семантику data_processing.py (filter_frequency_range, normalize_snv,
+// calculate_moving_average, calculate_mean_std); эталоном остаётся сервер.
+
+// Фильтрация диапазона частот [minFreq, maxFreq]
+function filterFrequencyRange(frequencies, amplitudes, minFreq, maxFreq) {
+    if (frequencies.length === 0 || amplitudes.length === 0) {
+        throw new Error('Пустые массивы частот или амплитуд');
+    }
+    if (minFreq > maxFreq) {
+        throw new Error('min_freq не может быть больше max_freq');
+    }
+    let count = 0;
+    for (let i = 0; i < frequencies.length; i++) {
+        if (frequencies[i] >= minFreq && frequencies[i] <= maxFreq) {
+            count += 1;
+        }
+    }
+    if (count === 0) {
+        throw new Error(`Нет точек в диапазоне от ${minFreq} до ${maxFreq}`);
+    }
+    const filteredFrequencies = new Float64Array(count);
+    const filteredAmplitudes = new Float64Array(count);
+    let j = 0;
+    for (let i = 0; i < frequencies.length; i++) {
+        if (frequencies[i] >= minFreq && frequencies[i] <= maxFreq) {
+            filteredFrequencies[j] = frequencies[i];
+            filteredAmplitudes[j] = amplitudes[i];
+            j += 1;
+        }
+    }
+    return [filteredFrequencies, filteredAmplitudes];
+}
+
+// Нормализация SNV: (x - mean) / std, std — по генеральной совокупности (как np.std)
+function normalizeSnv(amplitudes) {
+    const n = amplitudes.length;
+    if (n === 0) {
+        throw new Error('Массив амплитуд пуст');
+    }
+    let sum = 0;
+    for (let i = 0; i < n; i++) {
+        sum += amplitudes[i];
+    }
+    const mean = sum / n;
+    let squares = 0;
+    for (let i = 0; i < n; i++) {
+        const diff = amplitudes[i] - mean;
+        squares += diff * diff;
+    }
+    const std = Math.sqrt(squares / n);
+    if (std === 0) {
+        throw new Error('Стандартное отклонение равно нулю — нормализация невозможна');
+    }
+    const result = new Float64Array(n);
+    for (let i = 0; i < n; i++) {
+        result[i] = (amplitudes[i] - mean) / std;
+    }
+    return result;
+}
+
+// Скользящее среднее, эквивалентное np.convolve(x, ones(w) / w, mode='same')
+function movingAverage(amplitudes, windowSize) {
+    const n = amplitudes.length;
+    if (n === 0) {
+        throw new Error('Массив амплитуд пуст');
+    }
+    if (windowSize <= 0) {
+        throw new Error('Размер окна должен быть положительным');
+    }
+    if (windowSize > n) {
+        throw new Error('Размер окна не может превышать длину сигнала');
+    }
+    const prefix = new Float64Array(n + 1);
+    for (let i = 0; i < n; i++) {
+        prefix[i + 1] = prefix[i] + amplitudes[i];
+    }
+    // mode='same' центрирует полную свёртку со сдвигом (w - 1) // 2; за краями — нули
+    const offset = Math.floor((windowSize - 1) / 2);
+    const result = new Float64Array(n);
+    for (let i = 0; i < n; i++) {
+        const hi = Math.min(n - 1, i + offset);
+        const lo = Math.max(0, i + offset - windowSize + 1);
+        result[i] = (prefix[hi + 1] - prefix[lo]) / windowSize;
+    }
+    return result;
+}
+
+// Среднее и стандартное отклонение по спектрам (по оси 0)
+function meanStd(amplitudesList) {
+    const length = amplitudesList[0].length;
+    if (amplitudesList.some((amplitudes) => amplitudes.length !== length)) {
+        throw new Error('Спектры разной длины — среднее считается на сервере');
+    }
+    const count = amplitudesList.length;
+    const mean = new Float64Array(length);
+    const std = new Float64Array(length);
+    amplitudesList.forEach((amplitudes) => {
+        for (let i = 0; i < length; i++) {
+            mean[i] += amplitudes[i];
+        }
+    });
+    for (let i = 0; i < length; i++) {
+        mean[i] /= count;
+    }
+    amplitudesList.forEach((amplitudes) => {
+        for (let i = 0; i < length; i++) {
+            const diff = amplitudes[i] - mean[i];
+            std[i] += diff * diff;
+        }
+    });
+    for (let i = 0; i < length; i++) {
+        std[i] = Math.sqrt(std[i] / count);
+    }
+    return [mean, std];
+}
+
+// Повторяет ветки process_data для случая без базовой линии, сглаживания и поиска пиков
+function processPreview(request) {
+    const params = request.params;
+    const frequencies = [];
+    const amplitudes = [];
+
+    request.frequencies.forEach((rawFrequencies, index) => {
+        let [freq, ampl] = filterFrequencyRange(rawFrequencies, request.amplitudes[index], params.min_freq, params.max_freq);
+        if (params.normalize) {
+            ampl = normalizeSnv(ampl);
+        }
+        frequencies.push(freq);
+        amplitudes.push(ampl);
+    });
+
+    let meanAmplitude = new Float64Array(0);
+    let stdAmplitude = new Float64Array(0);
+    if (params.calculate_mean_std && amplitudes.length > 0) {
+        [meanAmplitude, stdAmplitude] = meanStd(amplitudes);
+    }
+
+    const movingAverages = params.show_moving_average
+        ? amplitudes.map((ampl) => movingAverage(ampl, params.moving_average_window))
+        : [];
+
+    return {
+        frequencies,
+        processed_amplitudes: amplitudes,
+        moving_averages: movingAverages,
+        mean_amplitude: meanAmplitude,
+        std_amplitude: stdAmplitude,
+        mean_frequencies: meanAmplitude.length ? frequencies[0] : new Float64Array(0)
+    };
+}
+
+self.onmessage = function(event) {
+    const { id } = event.data;
+    try {
+        const result = processPreview(event.data);
+        const transfer = [
+            ...result.frequencies,
+            ...result.processed_amplitudes,
+            ...result.moving_averages,
+            result.mean_amplitude,
+            result.std_amplitude
+        ].map((array) => array.buffer);
+        self.postMessage({ id, result }, Array.from(new Set(transfer)));
+    } catch (error) {
+        self.postMessage({ id, error: error.message });
+    }
+};
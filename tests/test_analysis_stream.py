@@ -0,0 +1,184 @@
+"""
+Потоковый AI-анализ /analyze_spectrum/stream против локального OpenAI-совместимого
+mock-сервера (OPENROUTER_BASE_URL): последовательность SSE-событий, событие error
+при недоступной модели и при зависшем посреди ответа потоке.
+"""
+import asyncio
+import importlib
+import json
+import os
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+from load_test import MOCK_ANALYSIS_TEXT, _stream_chunks
+
+
+class MockAI:
+    """
+    Mock OpenAI-совместимого API в отдельном потоке со своим event loop.
+    stall_after — после скольких фрагментов потоковый ответ зависает (None — не зависает).
+    """
+
+    def __init__(self) -> None:
+        self.stall_after = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self._server = asyncio.run_coroutine_threadsafe(
+            asyncio.start_server(self._handle, "127.0.0.1", 0), self._loop
+        ).result()
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                if not await reader.readline():
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = json.loads(await reader.readexactly(int(headers.get("content-length", "0"))) or b"{}")
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                    b"Transfer-Encoding: chunked\r\nConnection: keep-alive\r\n\r\n"
+                )
+                for position, chunk in enumerate(_stream_chunks(str(body.get("model", "mock")))):
+                    if self.stall_after is not None and position == self.stall_after:
+                        await asyncio.sleep(3600)
+                    data = chunk.encode("utf-8")
+                    writer.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+                    await writer.drain()
+                writer.write(b"0\r\n\r\n")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    def close(self) -> None:
+        async def shutdown():
+            self._server.close()
+            for task in asyncio.all_tasks():
+                if task is not asyncio.current_task():
+                    task.cancel()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+@pytest.fixture(scope="module")
+def mock_ai():
+    server = MockAI()
+    yield server
+    server.close()
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory, mock_ai):
+    from fastapi.testclient import TestClient
+
+    state_dir = tmp_path_factory.mktemp("state")
+    env = {
+        "USER_DB_PATH": str(state_dir / "users.db"),
+        "JOB_RESULTS_DIR": str(state_dir / "jobs"),
+        "SHARED_CACHE_BACKEND": "memory",
+        "SPECTRAL_LIBRARY_PATH": str(state_dir / "library.npz"),
+        "OPENROUTER_API_KEY": "test",
+        "OPENROUTER_BASE_URL": f"http://127.0.0.1:{mock_ai.port}/v1",
+        "AI_MAX_RETRIES": "0",
+        "RATE_LIMIT_AI_BURST": "100",
+    }
+    previous = {name: os.environ.get(name) for name in env}
+    os.environ.update(env)
+    try:
+        # Настройки читаются при импорте app, поэтому уже загруженный модуль перезагружается
+        app_module = importlib.reload(sys.modules["app"]) if "app" in sys.modules else importlib.import_module("app")
+        with TestClient(app_module.app) as test_client:
+            yield app_module, test_client
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def _spectrum(seed):
+    # Разные спектры — разные ключи кэша анализа, каждый запрос идёт в модель
+    rng = np.random.default_rng(seed)
+    frequencies = np.linspace(400, 3500, 800)
+    amplitudes = sum(
+        height * np.exp(-0.5 * ((frequencies - center) / 12) ** 2)
+        for center, height in zip(rng.uniform(600, 3300, 6), rng.uniform(0.3, 1.0, 6))
+    ) + 0.01 * rng.random(frequencies.size)
+    return {
+        "frequencies": frequencies.tolist(),
+        "amplitudes": amplitudes.tolist(),
+        "processing_params": {"seed": seed},
+    }
+
+
+def _read_events(response):
+    """Разбирает тело text/event-stream на список (событие, данные)."""
+    events = []
+    for block in response.text.split("\n\n"):
+        if not block.strip():
+            continue
+        fields = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def test_stream_event_sequence(client):
+    _, test_client = client
+    payload = _spectrum(1)
+
+    response = test_client.post("/analyze_spectrum/stream", json=payload)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = _read_events(response)
+    names = [name for name, _ in events]
+    assert names[0] == "meta" and names[1] == "queue" and names[-1] == "done"
+    assert set(names[2:-1]) == {"token"}
+    assert events[0][1]["cached"] is False
+    assert events[1][1]["attempts"] == 1
+    assert "".join(data["text"] for name, data in events if name == "token") == MOCK_ANALYSIS_TEXT + " "
+    assert events[-1][1] == {"success": True}
+
+    # Повторный запрос отдаётся из кэша одним фрагментом
+    cached = _read_events(test_client.post("/analyze_spectrum/stream", json=payload))
+    assert [name for name, _ in cached] == ["meta", "token", "done"]
+    assert cached[0][1]["cached"] is True
+    assert cached[1][1]["text"] == MOCK_ANALYSIS_TEXT + " "
+
+
+def test_stream_reports_unavailable_model(client, monkeypatch):
+    app_module, test_client = client
+    monkeypatch.setenv("OPENROUTER_BASE_URL", "http://127.0.0.1:9/v1")
+    monkeypatch.setattr(app_module, "_ai_client", None)
+
+    events = _read_events(test_client.post("/analyze_spectrum/stream", json=_spectrum(2)))
+    assert [name for name, _ in events] == ["meta", "error"]
+    assert events[-1][1]["success"] is False
+
+
+def test_stream_deadline(client, mock_ai, monkeypatch):
+    app_module, test_client = client
+    monkeypatch.setattr(app_module, "_ai_client", None)
+    monkeypatch.setattr(app_module.llm_limiter, "request_timeout", 1.0)
+    monkeypatch.setattr(mock_ai, "stall_after", 2)
+
+    events = _read_events(test_client.post("/analyze_spectrum/stream", json=_spectrum(3)))
+    names = [name for name, _ in events]
+    assert names == ["meta", "queue", "token", "token", "error"]
+    assert events[-1][1]["success"] is False
+    assert "within 1 s" in events[-1][1]["analysis"]
+    assert app_module.llm_limiter.active == 0
@@ -0,0 +1,68 @@
+"""Выбор кодировки ответа по заголовку Accept-Encoding."""
+import pytest
+
+from services import compression
+from services.compression import choose_encoding, parse_accept_encoding
+
+
+@pytest.fixture
+def with_brotli(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", object())
+
+
+@pytest.fixture
+def without_brotli(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+
+
+@pytest.mark.parametrize(
+    "header",
+    [
+        "gzip;q=0",
+        "gzip;q=0.0",
+        "gzip; q=0",
+        "gzip ; q = 0",
+        "gzip;q=0.000",
+        "gzip;Q=0",
+        "gzip;q=abc",
+        "gzip;q=2",
+        "identity",
+        "",
+    ],
+)
+def test_gzip_not_acceptable(without_brotli, header):
+    assert choose_encoding(header) is None
+
+
+@pytest.mark.parametrize(
+    "header",
+    ["br;q=0, gzip", "br; q=0.0, gzip", "br;q=0.000 , gzip;q=0.5", "gzip, br;q=0"],
+)
+def test_br_refused_falls_back_to_gzip(with_brotli, header):
+    assert choose_encoding(header) == "gzip"
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("gzip, br", "br"),
+        ("gzip;q=1.0, br;q=0.5", "gzip"),
+        ("gzip;q=0.4, br;q=0.8", "br"),
+        ("br;q=0, gzip;q=0", None),
+        ("*", "br"),
+        ("*;q=0.5, br;q=0", "gzip"),
+        ("*;q=0", None),
+        ("deflate, gzip;q=0.1", "gzip"),
+    ],
+)
+def test_highest_quality_wins(with_brotli, header, expected):
+    assert choose_encoding(header) == expected
+
+
+def test_br_ignored_without_brotli(without_brotli):
+    assert choose_encoding("br, gzip;q=0.1") == "gzip"
+    assert choose_encoding("br") is None
+
+
+def test_parse_accept_encoding():
+    assert parse_accept_encoding("GZIP ; q = 0.5, br, gzip;q=0.7") == {"gzip": 0.7, "br": 1.0}
@@ -0,0 +1,120 @@
+"""
+Паритет локального предпросмотра (static/preview_worker.js) с сервером.
+Воркер выполняется в node на примерах из uploads/*.esp, результат сравнивается
+с processing_pipeline.process_spectra при тех же параметрах.
+"""
+import glob
+import json
+import os
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+
+from data_processing import decode_spectral_bytes, parse_any_spectral_file
+from processing_pipeline import ProcessDataRequest, process_spectra
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKER_PATH = os.path.join(ROOT, "static", "preview_worker.js")
+TOLERANCE = 1e-9
+
+# Воркер загружается в отдельный контекст с заглушкой self; ответ postMessage печатается как JSON
+NODE_HARNESS = r"""
+const fs = require('fs');
+const vm = require('vm');
+const request = JSON.parse(fs.readFileSync(0, 'utf8'));
+const context = { self: {} };
+context.self.postMessage = (message) => {
+    process.stdout.write(JSON.stringify(message, (key, value) =>
+        ArrayBuffer.isView(value) ? Array.from(value) : value));
+};
+vm.createContext(context);
+vm.runInContext(fs.readFileSync(process.argv[1], 'utf8'), context);
+context.self.onmessage({ data: request });
+"""
+
+PARAM_CASES = [
+    {"min_freq": 0, "max_freq": 10000},
+    {"min_freq": 500, "max_freq": 1800},
+    {"min_freq": 400, "max_freq": 2000, "normalize": True},
+    {"min_freq": 0, "max_freq": 10000, "show_moving_average": True, "moving_average_window": 10},
+    {"min_freq": 600, "max_freq": 1700, "normalize": True, "show_moving_average": True, "moving_average_window": 7},
+    {"min_freq": 0, "max_freq": 10000, "calculate_mean_std": True},
+    {
+        "min_freq": 450,
+        "max_freq": 2200,
+        "normalize": True,
+        "calculate_mean_std": True,
+        "show_moving_average": True,
+        "moving_average_window": 25,
+    },
+]
+
+COMPARED_KEYS = ("frequencies", "processed_amplitudes", "moving_averages", "mean_amplitude", "std_amplitude")
+
+
+def _load_samples():
+    frequencies, amplitudes = [], []
+    for path in sorted(glob.glob(os.path.join(ROOT, "uploads", "*.esp"))):
+        with open(path, "rb") as handle:
+            freqs, amps = parse_any_spectral_file(decode_spectral_bytes(handle.read()))
+        frequencies.append(freqs)
+        amplitudes.append(amps)
+    return frequencies, amplitudes
+
+
+def _run_worker(frequencies, amplitudes, params):
+    request = {"id": 1, "frequencies": frequencies, "amplitudes": amplitudes, "params": params}
+    completed = subprocess.run(
+        ["node", "-e", NODE_HARNESS, WORKER_PATH],
+        input=json.dumps(request),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    message = json.loads(completed.stdout)
+    assert "error" not in message, message.get("error")
+    return message["result"]
+
+
+def _max_difference(local, server):
+    if isinstance(server, list) and server and isinstance(server[0], list):
+        assert len(local) == len(server)
+        return max((_max_difference(a, b) for a, b in zip(local, server)), default=0.0)
+    local_array = np.asarray(local, dtype=float)
+    server_array = np.asarray(server, dtype=float)
+    assert local_array.shape == server_array.shape
+    if server_array.size == 0:
+        return 0.0
+    scale = max(1.0, float(np.max(np.abs(server_array))))
+    return float(np.max(np.abs(local_array - server_array))) / scale
+
+
+@pytest.fixture(scope="module")
+def samples():
+    frequencies, amplitudes = _load_samples()
+    if not frequencies:
+        pytest.skip("Нет примеров uploads/*.esp")
+    return frequencies, amplitudes
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="Для проверки воркера нужен node")
+@pytest.mark.parametrize("params", PARAM_CASES)
+def test_preview_worker_matches_server(samples, params):
+    frequencies, amplitudes = samples
+    full_params = {
+        "normalize": False,
+        "calculate_mean_std": False,
+        "show_moving_average": False,
+        "moving_average_window": 10,
+        **params,
+    }
+
+    local = _run_worker(frequencies, amplitudes, full_params)
+    server = process_spectra(ProcessDataRequest(frequencies=frequencies, amplitudes=amplitudes, **full_params))
+
+    for key in COMPARED_KEYS:
+        difference = _max_difference(local[key], server[key])
+        assert difference <= TOLERANCE, f"{key}: расхождение {difference:.3e}"
@@ -0,0 +1,86 @@
+"""
+Текстовые экспорты, форматируемые блоками (iter_formatted_rows), совпадают байт в байт
+с прежними реализациями на f-строках.
+"""
+import numpy as np
+import pytest
+
+from data_processing import format_spectral_data, iter_formatted_rows
+from spectral_export import iter_mean_spectrum_csv, iter_processed_spectrum_text
+
+
+PARAMS = {"remove_baseline": True, "lam": 100000.0, "window_length": 11}
+
+
+# Прежние реализации (до блочного форматирования) — эталон вывода
+def legacy_format_spectral_data(frequencies, amplitudes):
+    return "\n".join(f"{freq:.2f}\t{ampl:.6f}" for freq, ampl in zip(frequencies, amplitudes))
+
+
+def legacy_processed_entry(name, frequencies, amplitudes, params):
+    content = "# Processed spectral data (after transformations)\n"
+    content += f"# Original file: {name}\n"
+    content += "# Processing parameters:\n"
+    for param, value in params.items():
+        content += f"# {param}: {value}\n"
+    content += "# Wavenumber (cm⁻¹)\tIntensity (a.u.)\n"
+    for wavenumber, intensity in zip(frequencies, amplitudes):
+        content += f"{wavenumber}\t{intensity}\n"
+    return content
+
+
+def legacy_mean_csv(frequencies, mean_amplitude, params):
+    metadata_lines = ["# Metadata"]
+    for param, value in params.items():
+        metadata_lines.append(f"# {param}: {value}")
+    csv_data = f"{'; '.join(metadata_lines)}\n#frequency,mean_amplitude\n"
+    csv_data += "\n".join([f"{freq},{amp}" for freq, amp in zip(np.array(frequencies), np.array(mean_amplitude))])
+    return csv_data
+
+
+def _columns(size, seed=0):
+    rng = np.random.default_rng(seed)
+    frequencies = np.linspace(400.0, 4000.0, size)
+    amplitudes = rng.normal(scale=1e3, size=size) * 10.0 ** rng.integers(-12, 12, size)
+    special = [0.0, -0.0, 1.0, -1.5, 1e-300, 1e300, 123456789.0, float("nan"), float("inf"), -float("inf")]
+    count = min(size, len(special))
+    amplitudes[:count] = special[:count]
+    return frequencies.tolist(), amplitudes.tolist()
+
+
+# 70000 строк — больше одного блока по 65536
+SIZES = [0, 1, 7, 70000]
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_format_spectral_data_matches_legacy(size):
+    frequencies, amplitudes = _columns(size)
+    if size == 0:
+        assert format_spectral_data(frequencies, amplitudes) == ""
+        return
+    assert format_spectral_data(frequencies, amplitudes) == legacy_format_spectral_data(frequencies, amplitudes)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_processed_entry_matches_legacy(size):
+    frequencies, amplitudes = _columns(size, seed=1)
+    text = "".join(iter_processed_spectrum_text("sample.esp", frequencies, amplitudes, PARAMS))
+    assert text.encode("utf-8") == legacy_processed_entry("sample.esp", frequencies, amplitudes, PARAMS).encode("utf-8")
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_mean_csv_matches_legacy(size):
+    frequencies, mean_amplitude = _columns(size, seed=2)
+    text = "".join(iter_mean_spectrum_csv(frequencies, mean_amplitude, PARAMS))
+    assert text.encode("utf-8") == legacy_mean_csv(frequencies, mean_amplitude, PARAMS).encode("utf-8")
+
+
+def test_blocks_do_not_change_output():
+    frequencies, amplitudes = _columns(1000, seed=3)
+    whole = "".join(iter_formatted_rows([frequencies, amplitudes], "%r\t%r\n"))
+    assert "".join(iter_formatted_rows([frequencies, amplitudes], "%r\t%r\n", chunk_rows=7)) == whole
+
+
+def test_mismatched_columns():
+    with pytest.raises(ValueError):
+        list(iter_formatted_rows([[1.0, 2.0], [1.0]], "%r,%r\n"))